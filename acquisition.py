@@ -0,0 +1,161 @@
+"""Streaming power-meter acquisition into a preallocated ring buffer.
+
+A PowerStream reads the PM100D continuously and keeps timestamped readings in
+NumPy arrays, so the power is known at any time, including while the laser is
+simply held on during a measurement. Windowed statistics (mean, spread and
+drift) are available to the feedback loops and to the GUI.
+
+With real hardware a background thread owns the meter while the stream runs,
+and other readers take fresh samples from the stream instead of talking to the
+instrument themselves. The simulated bench runs on a virtual clock that a
+second thread cannot share, so there the stream records inline: every reading
+taken through it, and every capture() wait, goes into the same buffer.
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+# drift_uW_per_s: least-squares slope over the window; span: seconds covered by the samples
+WindowStats = namedtuple("WindowStats", "mean std drift_uW_per_s count span")
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of (time, value) samples; the oldest are overwritten."""
+
+    def __init__(self, capacity=65536):
+        self.capacity = int(capacity)
+        self._times = np.zeros(self.capacity)
+        self._values = np.zeros(self.capacity)
+        self._next = 0
+        self._count = 0
+
+    def append(self, t, value):
+        self._times[self._next] = t
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def latest(self, n=None):
+        """(times, values) of the last n samples in chronological order, as copies."""
+        n = self._count if n is None else min(int(n), self._count)
+        indices = (self._next - n + np.arange(n)) % self.capacity
+        return self._times[indices], self._values[indices]
+
+    def since(self, t0):
+        times, values = self.latest()
+        keep = times >= t0
+        return times[keep], values[keep]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+
+def window_stats(times, values):
+    if len(values) == 0:
+        return WindowStats(float("nan"), float("nan"), float("nan"), 0, 0.0)
+    span = float(times[-1] - times[0])
+    drift = float(np.polyfit(times - times[0], values, 1)[0]) if len(values) > 2 and span > 0 else 0.0
+    return WindowStats(float(values.mean()), float(values.std()), drift, len(values), span)
+
+
+class PowerStream:
+    """Continuous PM100D readings (µW) with windowed statistics."""
+
+    def __init__(self, bench, capacity=65536, period=0.005, threaded=None):
+        self.bench = bench
+        self.buffer = RingBuffer(capacity)
+        self.period = period
+        # Background thread only on a real clock, see the module docstring
+        self.threaded = not bench.simulated if threaded is None else threaded
+        self.error = None
+        self._lock = threading.Lock()
+        self._new_sample = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        if self.threaded:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self):
+        # Stamped when the read starts, so a "fresh" sample never predates a request
+        t = self.bench.time()
+        power = self.bench.power_meter.read * 1e6
+        with self._lock:
+            self.buffer.append(t, power)
+            self._new_sample.notify_all()
+        return power
+
+    def _run(self):
+        while self._running:
+            try:
+                self._record()
+                self.error = None
+            except Exception as e:
+                # Keep streaming through transient VISA errors, but slow down
+                self.error = e
+                self.bench.sleep(0.1)
+            self.bench.sleep(self.period)
+
+    def read_uW(self, timeout=1.0):
+        """A reading taken after this call; falls back to a direct read when not streaming."""
+        if not (self.threaded and self._running):
+            return self._record()
+        requested = self.bench.time()
+
+        def fresh():
+            return len(self.buffer) > 0 and self.buffer.latest(1)[0][0] >= requested
+
+        with self._new_sample:
+            if not self._new_sample.wait_for(fresh, timeout=timeout):
+                raise TimeoutError(f"No power meter reading within {timeout} s: {self.error}")
+            return float(self.buffer.latest(1)[1][0])
+
+    def capture(self, seconds):
+        """Lets seconds pass while the stream keeps recording; returns the start time."""
+        start = self.bench.time()
+        if self.threaded and self._running:
+            self.bench.sleep(seconds)
+            return start
+        while self.bench.time() - start < seconds:
+            self._record()
+            self.bench.sleep(min(self.period, seconds - (self.bench.time() - start)))
+        return start
+
+    def stats(self, window_s=1.0):
+        """Statistics of the samples taken in the last window_s seconds."""
+        return self.stats_since(self.bench.time() - window_s)
+
+    def samples_since(self, t0):
+        """(times, values) recorded since bench time t0, as copies."""
+        with self._lock:
+            return self.buffer.since(t0)
+
+    def stats_since(self, t0):
+        return window_stats(*self.samples_since(t0))
@@ -0,0 +1,160 @@
+"""Adaptive wavelength sampling for calibration.
+
+A fixed grid spends as many points on flat parts of the spectrum as on the steep
+blue edge. The sampler starts from a coarse grid and refines only the intervals
+where the linear interpolant used for measurements is likely to be wrong,
+estimated from the local curvature of the calibrated settings. Refinements are
+measured in passes, each pass in increasing wavelength, so the filter does not
+jump back and forth more than necessary.
+"""
+import math
+from collections import namedtuple
+
+from controllers import MAX_LASER_POWER, converge, out_of_reach
+from recalibration import bind_wavelength, move_filter
+
+# error: estimated worst-case linear interpolation error of the final grid (setting %)
+SamplingReport = namedtuple("SamplingReport", "points passes error elapsed")
+
+
+class AdaptiveSampler:
+    """Chooses where to calibrate next on [start, end]."""
+
+    def __init__(self, start, end, initial_step=80.0, min_step=2.5, error_target=1.0, focus=0.25,
+                 max_points=None):
+        self.start = start
+        self.end = end
+        self.initial_step = initial_step
+        self.max_points = max_points
+        self.min_step = min_step
+        # Stop refining once every interval's estimated error is below this (setting %)
+        self.error_target = error_target
+        # Each pass only refines intervals within this fraction of the worst one
+        self.focus = focus
+        self.samples = {}
+
+    def initial_grid(self):
+        """Evenly spaced start points, at least three of them."""
+        count = round((self.end - self.start) / self.initial_step)
+        # Refining only beats an even grid with points to spare for it: enough to
+        # split every initial interval twice. With fewer, spend them all evenly
+        if self.max_points is not None and self.max_points - (count + 1) < 2 * count:
+            count = self.max_points - 1
+        # Curvature needs three points; fewer would look like a straight line
+        count = max(2, count)
+        step = (self.end - self.start) / count
+        return [round(self.start + i * step, 1) for i in range(count + 1)]
+
+    def add(self, wavelength, setting):
+        self.samples[wavelength] = setting
+
+    def interval_errors(self):
+        """Estimated linear interpolation error for every interval between samples.
+
+        The error of linear interpolation over an interval of width h is about
+        h**2 / 8 * |f''|; f'' is taken from the second divided differences at the
+        interval's two ends, whichever is larger. With fewer than three samples
+        there is no estimate and the error is infinite.
+        """
+        xs = sorted(self.samples)
+        ys = [self.samples[x] for x in xs]
+        curvature = [math.inf] * len(xs)
+        for i in range(1, len(xs) - 1):
+            left = (ys[i] - ys[i - 1]) / (xs[i] - xs[i - 1])
+            right = (ys[i + 1] - ys[i]) / (xs[i + 1] - xs[i])
+            curvature[i] = abs(2 * (right - left) / (xs[i + 1] - xs[i - 1]))
+        # The end intervals only have one neighbour to judge by
+        if len(xs) > 2:
+            curvature[0], curvature[-1] = curvature[1], curvature[-2]
+        errors = []
+        for i in range(len(xs) - 1):
+            h = xs[i + 1] - xs[i]
+            errors.append((h * h / 8 * max(curvature[i], curvature[i + 1]), xs[i], xs[i + 1]))
+        return errors
+
+    def max_error(self):
+        errors = self.interval_errors()
+        return max(e[0] for e in errors) if errors else 0.0
+
+    def next_pass(self, budget):
+        """Midpoints of the worst intervals (at most budget of them), in wavelength order."""
+        candidates = [e for e in self.interval_errors() if e[2] - e[1] >= 2 * self.min_step]
+        if not candidates:
+            return []
+        # Intervals without an estimate (infinite error) go first, on their own
+        worst = max(e[0] for e in candidates)
+        threshold = worst if math.isinf(worst) else self.focus * worst
+        candidates = sorted((e for e in candidates if e[0] > self.error_target and e[0] >= threshold),
+                            reverse=True)
+        midpoints = [round((low + high) / 2, 1) for _, low, high in candidates[:budget]]
+        return sorted(m for m in midpoints if m not in self.samples)
+
+
+def adaptive_calibration(bench, start, end, target_uW, controller, settler, tolerance=0.5,
+                         max_iterations=10, max_points=21, time_budget=None,
+                         initial_step=80.0, min_step=2.5, error_target=1.0, focus=0.25,
+                         initial_setting=30.0, settle_time=0.5, jump_settle_time=2.0,
+                         on_point=None, on_reading=None):
+    """Calibrates [start, end] on an adaptively refined grid.
+
+    Stops when max_points are calibrated, time_budget bench seconds have passed,
+    or no interval's estimated error exceeds error_target. Returns the rows
+    (sorted by wavelength) and a SamplingReport. on_reading(wavelength,
+    setting, power_uW, iteration) is called for every feedback reading.
+    """
+    sampler = AdaptiveSampler(start, end, initial_step, min_step, error_target, focus, max_points)
+    rows = {}
+    began = bench.time()
+    setting = initial_setting
+    previous = None
+    passes = 0
+
+    def out_of_budget():
+        if len(rows) >= max_points:
+            return True
+        return time_budget is not None and bench.time() - began >= time_budget
+
+    try:
+        bench.laser.set_power(setting)
+        bench.laser.set_emission(True)
+        settler.emission_on()
+        plan = sampler.initial_grid()[:max_points]
+        while plan and not out_of_budget():
+            passes += 1
+            for wavelength in plan:
+                if out_of_budget():
+                    break
+                # Start from the interpolated neighbours once there are any
+                if sampler.samples:
+                    xs = sorted(sampler.samples)
+                    below = [x for x in xs if x < wavelength]
+                    above = [x for x in xs if x > wavelength]
+                    if below and above:
+                        low, high = below[-1], above[0]
+                        t = (wavelength - low) / (high - low)
+                        setting = (1 - t) * sampler.samples[low] + t * sampler.samples[high]
+                move_filter(bench, wavelength)
+                bench.laser.set_power(setting)
+                if previous is None:
+                    max_wait = 3
+                elif abs(wavelength - previous) > initial_step / 2:
+                    max_wait = jump_settle_time
+                else:
+                    max_wait = settle_time
+                power = settler.wait(max_wait=max_wait).power_uW
+                previous = wavelength
+                controller.start_step(wavelength)
+                setting, power, _ = converge(bench, controller, settler, target_uW, tolerance,
+                                             max_iterations, setting, power, settle_time,
+                                             bind_wavelength(on_reading, wavelength))
+                rows[wavelength] = (wavelength, setting, power)
+                sampler.add(wavelength, min(setting, MAX_LASER_POWER))
+                if on_point is not None:
+                    process = out_of_reach(controller, setting, power, target_uW, tolerance)
+                    on_point(process or "Calibration", wavelength, setting, power)
+            plan = sampler.next_pass(max_points - len(rows))
+    finally:
+        bench.laser.set_emission(False)
+
+    report = SamplingReport(len(rows), passes, sampler.max_error(), bench.time() - began)
+    return [rows[w] for w in sorted(rows)], report
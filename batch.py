@@ -0,0 +1,369 @@
+"""Headless runner: executes a job file of calibrations and measurements back to back.
+
+A job file is JSON. Top-level keys set defaults for the whole run, "jobs" lists
+what to do in order:
+
+    {
+      "controller": "proportional", "interpolation": "linear", "output": "batch-results",
+      "jobs": [
+        {"type": "calibration", "target_uW": [5, 10], "start": 500, "step": 5, "steps": 20},
+        {"type": "measurement", "start": 450, "end": 700, "step": 10,
+         "on_time": 2, "off_time": 1, "repeat": 3},
+        {"type": "calibration", "target_uW": [5, 100, 1000], "multi_target": true},
+        {"type": "measurement", "target_uW": 30, "start": 450, "end": 700, "step": 10,
+         "on_time": 2, "off_time": 1},
+        {"type": "recalibration"},
+        {"type": "measurement", "calibration": "test-results/calibration_20250401_144718.csv",
+         "start": 500, "end": 600, "step": 5, "on_time": 2, "off_time": 1},
+        {"type": "measurement", "start": 500, "end": 600, "step": 10, "on_time": 10, "off_time": 1,
+         "hold": "closed", "rate_hz": 5, "deadband_uW": 0.5, "max_rate": 5, "compensate_drift": true}
+      ]
+    }
+
+A list of target powers runs one calibration per target, or with
+"multi_target" a single sweep calibrating all of them; "repeat" runs a job
+several times. Measurements and recalibrations use the most recent calibration
+unless "calibration" names an exported CSV. A measurement with "target_uW"
+takes its settings from the last multi-target table (or the table CSV named by
+"table") instead, interpolated for any power in between. "hold": "closed"
+keeps correcting the laser setting during the ON phases (see stabilization.py);
+either way the per-step statistics go to <measurement CSV>_steps.csv.
+"compensate_drift": true corrects the settings by the drift fitted to the ON
+phases of the measurements so far (see drift_compensation.py); the drift
+trajectory goes to <measurement CSV>_drift.csv either way.
+Multi-target runs write a progress CSV with the target in an extra column and
+the table itself when they finish. Every sample of the whole batch, feedback
+readings and ON-phase power traces included, also streams into a result store
+(session_<timestamp>/ in the output directory, see result_store.py). Each run's
+timings (see instrumentation.py) are written next to its CSV as
+timings_<timestamp>_jobNNN.json, and the log ends with where its time went. The whole file is checked before
+the laser is touched: parameter types, calibration ranges against the filter
+range and every measurement's sweep (steps, ON/OFF times, filter range). What
+depends on a calibration still to be run (extrapolation, points out of reach)
+is reported when the measurement starts. Every run writes its rows to its own CSV in the output
+directory as they come in, so an interrupted night still leaves everything
+measured so far. Neither tkinter nor matplotlib is imported.
+
+    python batch.py jobs.json [--simulate] [--output DIR] [--stop-on-error] [--check]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from calibration_model import KINDS, sweep_wavelengths
+from calibration_store import CalibrationStore
+from controllers import CONTROLLERS
+from devices import open_bench
+from engine import CALIBRATION_HEADER, Engine
+from result_store import ResultStore
+from simulation import RESULTS_DIR, read_calibration_csv
+from stabilization import write_step_stats
+from sweep_planner import BANDWIDTH, MAX_WAVELENGTH, MIN_WAVELENGTH, MeasurementPlan
+
+DEFAULT_OUTPUT = "batch-results"
+
+# Parameters each job type accepts, with their defaults (None: required)
+JOB_PARAMETERS = {
+    "calibration": {"target_uW": None, "start": 500, "step": 5, "steps": 20, "sampling": "fixed",
+                    "multi_target": False, "tolerance": 0.5, "max_iterations": 10},
+    "recalibration": {"calibration": "", "tolerance": 0.5},
+    "measurement": {"calibration": "", "table": "", "target_uW": 0, "start": None, "end": None,
+                    "step": None, "on_time": None, "off_time": None, "hold": "open", "rate_hz": 5.0,
+                    "deadband_uW": 0.5, "max_rate": 5.0, "compensate_drift": False},
+}
+RUN_SETTINGS = {"simulate": None, "controller": "proportional", "interpolation": "linear",
+                "output": DEFAULT_OUTPUT}
+
+
+class JobFileError(ValueError):
+    """The job file cannot be run as written."""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def check_job(kind, parameters):
+    """Checks the values of one job with its defaults filled in; raises JobFileError.
+
+    Covers everything that does not depend on an earlier job: value types,
+    files named, the calibration range and the measurement sweep.
+    """
+    numbers = {"calibration": ("start", "step", "tolerance"),
+               "recalibration": ("tolerance",),
+               "measurement": ("target_uW", "start", "end", "step", "on_time", "off_time",
+                               "rate_hz", "deadband_uW", "max_rate")}[kind]
+    for key in numbers:
+        if not _is_number(parameters[key]):
+            raise JobFileError(f"{key} must be a number")
+    for key in ("steps", "max_iterations"):
+        if key in parameters and (not isinstance(parameters[key], int) or isinstance(parameters[key], bool)
+                                  or parameters[key] < 1):
+            raise JobFileError(f"{key} must be a positive integer")
+    for key in ("step", "tolerance", "rate_hz", "deadband_uW", "max_rate"):
+        if key in parameters and parameters[key] <= 0:
+            raise JobFileError(f"{key} must be positive")
+    for key in ("calibration", "table"):
+        if key in parameters and not isinstance(parameters[key], str):
+            raise JobFileError(f"{key} must be a file name")
+        if parameters.get(key) and not os.path.isfile(parameters[key]):
+            raise JobFileError(f"{key} file {parameters[key]} not found")
+
+    if kind == "calibration":
+        if parameters["sampling"] not in ("fixed", "adaptive"):
+            raise JobFileError("sampling must be fixed or adaptive")
+        if not isinstance(parameters["multi_target"], bool):
+            raise JobFileError("multi_target must be true or false")
+        end = parameters["start"] + parameters["step"] * parameters["steps"]
+        if parameters["start"] - BANDWIDTH / 2 < MIN_WAVELENGTH or end + BANDWIDTH / 2 > MAX_WAVELENGTH:
+            raise JobFileError(f"{parameters['start']:g}-{end:g} nm falls outside the filter range "
+                               f"{MIN_WAVELENGTH}-{MAX_WAVELENGTH} nm")
+    elif kind == "measurement":
+        if parameters["hold"] not in ("open", "closed"):
+            raise JobFileError("hold must be open or closed")
+        if not isinstance(parameters["compensate_drift"], bool):
+            raise JobFileError("compensate_drift must be true or false")
+        if parameters["target_uW"] < 0:
+            raise JobFileError("target_uW must not be negative")
+        # The settings come from a calibration that may not exist yet; the sweep itself is known
+        wavelengths = sweep_wavelengths(parameters["start"], parameters["end"], parameters["step"])
+        plan = MeasurementPlan(wavelengths, [0.0] * len(wavelengths), [False] * len(wavelengths),
+                               parameters["on_time"], parameters["off_time"])
+        if not plan.valid:
+            raise JobFileError("; ".join(plan.errors))
+
+
+def expand_jobs(jobs):
+    """One entry per run: repeats and target lists unrolled, defaults filled in."""
+    runs = []
+    if not isinstance(jobs, list) or not jobs:
+        raise JobFileError("'jobs' must be a non-empty list")
+    calibrated = tabled = False
+    for number, job in enumerate(jobs, 1):
+        job = dict(job)
+        kind = job.pop("type", None)
+        if kind not in JOB_PARAMETERS:
+            raise JobFileError(f"Job {number}: type must be one of {', '.join(JOB_PARAMETERS)}")
+        repeat = job.pop("repeat", 1)
+        if not isinstance(repeat, int) or repeat < 1:
+            raise JobFileError(f"Job {number}: repeat must be a positive integer")
+        defaults = JOB_PARAMETERS[kind]
+        unknown = sorted(set(job) - set(defaults))
+        if unknown:
+            raise JobFileError(f"Job {number}: unknown parameters {', '.join(unknown)}")
+        missing = [name for name, default in defaults.items() if default is None and name not in job]
+        if missing:
+            raise JobFileError(f"Job {number}: missing {', '.join(missing)}")
+        parameters = {**defaults, **job}
+        try:
+            check_job(kind, parameters)
+        except JobFileError as e:
+            raise JobFileError(f"Job {number}: {e}") from None
+
+        if kind == "calibration":
+            targets = parameters["target_uW"]
+            targets = targets if isinstance(targets, list) else [targets]
+            if not targets or any(not _is_number(t) or t <= 0 for t in targets):
+                raise JobFileError(f"Job {number}: target_uW must be a positive number or a list of them")
+            calibrated = True
+            if parameters["multi_target"]:
+                if len(set(targets)) < 2 or parameters["sampling"] != "fixed":
+                    raise JobFileError(f"Job {number}: multi_target needs at least two target powers "
+                                       f"and fixed sampling")
+                tabled = True
+                variants = [{**parameters, "target_uW": [float(t) for t in targets]}]
+            else:
+                variants = [{**parameters, "target_uW": float(t)} for t in targets]
+        else:
+            if parameters.get("target_uW"):
+                if not parameters["table"] and not tabled:
+                    raise JobFileError(f"Job {number}: target_uW needs an earlier multi-target "
+                                       f"calibration job or a table file")
+            elif not parameters["calibration"] and not calibrated:
+                raise JobFileError(f"Job {number}: {kind} needs an earlier calibration job "
+                                   f"or a calibration file")
+            variants = [parameters]
+
+        for _ in range(repeat):
+            for variant in variants:
+                runs.append((number, kind, variant))
+    return runs
+
+
+def load_job_file(path):
+    """Returns (settings, runs) of a job file; raises JobFileError when it is not runnable."""
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise JobFileError(f"Cannot read {path}: {e}") from None
+    if isinstance(content, list):
+        content = {"jobs": content}
+    jobs = content.pop("jobs", None)
+    unknown = sorted(set(content) - set(RUN_SETTINGS))
+    if unknown:
+        raise JobFileError(f"Unknown settings {', '.join(unknown)}")
+    settings = {**RUN_SETTINGS, **content}
+    if settings["controller"] not in CONTROLLERS:
+        raise JobFileError(f"controller must be one of {', '.join(sorted(CONTROLLERS))}")
+    if settings["interpolation"] not in KINDS:
+        raise JobFileError(f"interpolation must be one of {', '.join(KINDS)}")
+    return settings, expand_jobs(jobs)
+
+
+class ResultWriter:
+    """CSV file that receives one row per point and is flushed after every row."""
+
+    def __init__(self, path, with_process=False):
+        self.path = path
+        self.rows = 0
+        self.with_process = with_process
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(CALIBRATION_HEADER + (["Process"] if with_process else []))
+        self._file.flush()
+
+    def write(self, process, wavelength, setting, power):
+        row = [wavelength, setting, "" if power is None else power]
+        self._writer.writerow(row + [process] if self.with_process else row)
+        self._file.flush()
+        self.rows += 1
+
+    def close(self):
+        self._file.close()
+
+
+def run_job(engine, index, kind, parameters, output, log):
+    """Runs one expanded job and writes its rows; returns the CSV path."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    multi_target = parameters.get("multi_target", False)
+    # Not named calibration_*, which would feed mixed targets into the warm-start store
+    name = "multi_target" if multi_target else kind
+    path = os.path.join(output, f"{name}_{timestamp}_job{index:03d}.csv")
+    if parameters.get("calibration"):
+        engine.load_calibration(read_calibration_csv(parameters["calibration"]))
+    if parameters.get("table"):
+        engine.load_table(parameters["table"])
+
+    writer = ResultWriter(path, with_process=multi_target)
+    previous_timings = engine.timings
+    try:
+        if multi_target:
+            table = engine.calibrate_targets(parameters["target_uW"], start_wl=parameters["start"],
+                                             step=parameters["step"], steps=parameters["steps"],
+                                             tolerance=parameters["tolerance"],
+                                             max_iterations=parameters["max_iterations"],
+                                             on_point=writer.write, on_status=log)
+            path = os.path.join(output, f"multi_target_table_{timestamp}_job{index:03d}.csv")
+            table.to_csv(path)
+        elif kind == "calibration":
+            engine.calibrate(parameters["target_uW"], start_wl=parameters["start"],
+                             step=parameters["step"], steps=parameters["steps"],
+                             sampling=parameters["sampling"], tolerance=parameters["tolerance"],
+                             max_iterations=parameters["max_iterations"],
+                             on_point=writer.write, on_status=log)
+        elif kind == "recalibration":
+            # The file gets the complete merged curve, like a calibration export
+            version = engine.recalibrate(tolerance=parameters["tolerance"], on_status=log)
+            for row in version.rows:
+                writer.write("Recalibration", *row)
+        else:
+            plan = engine.plan(parameters["start"], parameters["end"], parameters["step"],
+                               parameters["on_time"], parameters["off_time"],
+                               target_uW=parameters["target_uW"] or None)
+            if not plan.valid:
+                raise ValueError(plan.summary())
+            for warning in plan.warnings:
+                log(warning)
+            log(plan.summary().splitlines()[0])
+            try:
+                engine.measure(plan, on_point=writer.write, hold_mode=parameters["hold"],
+                               rate_hz=parameters["rate_hz"], deadband_uW=parameters["deadband_uW"],
+                               max_rate=parameters["max_rate"],
+                               compensate_drift=parameters["compensate_drift"])
+            finally:
+                if engine.step_stats:
+                    write_step_stats(path[:-len(".csv")] + "_steps.csv", engine.step_stats)
+                    engine.drift.to_csv(path[:-len(".csv")] + "_drift.csv")
+            steps = engine.step_stats
+            if steps:
+                log(f"{parameters['hold'].capitalize()}-loop hold: RMS error "
+                    f"{sum(step.rms_error_uW for step in steps) / len(steps):.3f} µW per step, "
+                    f"{sum(step.adjustments for step in steps)} corrections")
+            log(engine.drift.summary(engine.bench.time()))
+    finally:
+        writer.close()
+        timings = engine.timings if engine.timings is not previous_timings else None
+        if timings is not None:
+            timings.to_json(os.path.join(output, f"timings_{timestamp}_job{index:03d}.json"))
+    # Where the time went, largest shares first
+    if timings is not None:
+        for key, seconds, share in timings.breakdown()[:6]:
+            log(f"{share:>6.1%} {seconds:>8.1f} s  {key}")
+    return path
+
+
+def run_batch(path, simulate=None, output=None, stop_on_error=False, check=False):
+    """Runs every job of the file; returns the number of failed runs."""
+    settings, runs = load_job_file(path)
+    output = output or settings["output"]
+    if simulate is None:
+        simulate = settings["simulate"]
+    print(f"{len(runs)} runs from {path}, results in {output}")
+    if check:
+        for index, (number, kind, parameters) in enumerate(runs, 1):
+            print(f"{index:3d}  job {number}  {kind:<14}{json.dumps(parameters)}")
+        return 0
+
+    os.makedirs(output, exist_ok=True)
+    bench = open_bench(simulate=simulate)
+    # Earlier batch results warm-start the calibrations just like the GUI's exports
+    store = CalibrationStore().load_directory(RESULTS_DIR).load_directory(output)
+    results = ResultStore(os.path.join(output, f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"),
+                          clock=bench.clock)
+    engine = Engine(bench, settings["controller"], settings["interpolation"], calibration_store=store,
+                    store=results)
+    failed = 0
+    try:
+        for index, (number, kind, parameters) in enumerate(runs, 1):
+            prefix = f"[{index}/{len(runs)} {kind}]"
+            started = time.monotonic()
+            try:
+                result = run_job(engine, index, kind, parameters, output,
+                                 log=lambda text: print(f"{prefix} {text}", flush=True))
+            except Exception as e:
+                failed += 1
+                print(f"{prefix} FAILED: {e}", file=sys.stderr, flush=True)
+                if stop_on_error:
+                    break
+                continue
+            print(f"{prefix} done in {time.monotonic() - started:.1f} s -> {result}", flush=True)
+    finally:
+        bench.laser.set_emission(False)
+        engine.close()
+        results.close()
+        bench.close()
+    print(f"{len(runs) - failed} of {len(runs)} runs succeeded, {len(results)} samples in {results.path}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run calibration and measurement jobs without the GUI")
+    parser.add_argument("jobs", help="JSON job file")
+    parser.add_argument("--simulate", action="store_true", default=None,
+                        help="run against the simulated laser, filter and power meter")
+    parser.add_argument("--output", help=f"directory for the result CSVs (default: {DEFAULT_OUTPUT})")
+    parser.add_argument("--stop-on-error", action="store_true",
+                        help="stop at the first failed run instead of going on with the next")
+    parser.add_argument("--check", action="store_true",
+                        help="only validate the job file and list the runs")
+    args = parser.parse_args()
+    try:
+        failures = run_batch(args.jobs, args.simulate, args.output, args.stop_on_error, args.check)
+    except JobFileError as e:
+        parser.exit(2, f"{e}\n")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,132 @@
+"""Benchmark: queries over thousands of calibration runs, CSVs vs the archive.
+
+Writes N synthetic calibration exports (a year of runs at 5, 10 and 100 µW,
+405-830 nm in 5 nm steps, the laser slowly losing output) to a temporary
+directory, then answers two questions both ways:
+
+    march    setting at 532 nm across all runs in March
+    drift    trend of the 405 nm setting over the year, 5 µW runs only
+
+"parse CSVs" reads every export with read_calibration_csv and interpolates
+each run, which is what answering them without an archive takes. "archive"
+opens a CalibrationArchive from disk (memory-mapped, nothing parsed) and runs
+the vectorized query. The one-off indexing and the incremental update after
+one new export are timed too.
+
+    python benchmarks/bench_archive.py [--runs N]
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from calibration_archive import CalibrationArchive
+from calibration_store import timestamp_from_name
+from engine import CALIBRATION_HEADER
+from simulation import read_calibration_csv
+
+WAVELENGTHS = np.arange(405.0, 831.0, 5.0)
+TARGETS_UW = (5.0, 10.0, 100.0)
+START = datetime(2025, 1, 1, 9, 0, 0)
+MARCH = ("2025-03-01", "2025-04-01")
+
+
+def write_runs(directory, count, start=START, seed=1):
+    rng = np.random.default_rng(seed)
+    # Power per setting percent: a bump around 600 nm, losing 10 % over the year
+    gain = 0.02 + 0.6 * np.exp(-((WAVELENGTHS - 600.0) / 120.0) ** 2)
+    for index in range(count):
+        when = start + timedelta(days=365.0 * index / count)
+        target = TARGETS_UW[index % len(TARGETS_UW)]
+        aging = 1.0 - 0.1 * index / count
+        settings = np.clip(target / (gain * aging) * rng.normal(1.0, 0.01, len(WAVELENGTHS)), 10.0, 100.0)
+        powers = np.minimum(target, settings * gain * aging) + rng.normal(0.0, 0.05, len(WAVELENGTHS))
+        path = os.path.join(directory, f"calibration_{when.strftime('%Y%m%d_%H%M%S')}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(CALIBRATION_HEADER)
+            writer.writerows(zip(WAVELENGTHS.tolist(), settings.tolist(), powers.tolist()))
+
+
+def parse_all(directory, wavelength, start=None, end=None, target_uW=None):
+    times, values = [], []
+    for name in sorted(os.listdir(directory)):
+        if not name.startswith("calibration_"):
+            continue
+        path = os.path.join(directory, name)
+        stamp = timestamp_from_name(path)
+        if start is not None and not datetime.fromisoformat(start) <= stamp < datetime.fromisoformat(end):
+            continue
+        rows = np.array(read_calibration_csv(path))
+        if target_uW is not None:
+            free = rows[:, 1] < 100.0
+            if not free.any() or abs(np.median(rows[free, 2]) / target_uW - 1) > 0.2:
+                continue
+        times.append(stamp.timestamp())
+        values.append(np.interp(wavelength, rows[:, 0], rows[:, 1]))
+    return np.array(times), np.array(values)
+
+
+def timed(function, repeat=3):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        exports = os.path.join(directory, "exports")
+        os.makedirs(exports)
+        write_runs(exports, args.runs)
+        archive_dir = os.path.join(directory, "archive")
+
+        start = time.perf_counter()
+        CalibrationArchive(archive_dir).update([exports])
+        indexing = time.perf_counter() - start
+        write_runs(exports, 1, start=START + timedelta(days=365), seed=2)
+        start = time.perf_counter()
+        CalibrationArchive(archive_dir).update([exports])
+        incremental = time.perf_counter() - start
+
+        def archive_march():
+            archive = CalibrationArchive(archive_dir)
+            return archive.at_wavelength(532.0, archive.select(*MARCH, wavelength=532.0)).values
+
+        def archive_drift():
+            return CalibrationArchive(archive_dir).drift(405.0, target_uW=5.0)
+
+        csv_march, (_, march_values) = timed(lambda: parse_all(exports, 532.0, *MARCH), repeat=1)
+        csv_drift, (times, drift_values) = timed(lambda: parse_all(exports, 405.0, target_uW=5.0), repeat=1)
+        fast_march, values = timed(archive_march)
+        fast_drift, drift = timed(archive_drift)
+
+        assert np.allclose(np.sort(values), np.sort(march_values))
+        assert np.allclose(np.sort(drift.settings), np.sort(drift_values))
+        csv_slope = np.polyfit((times - times.min()) / 86400.0, drift_values, 1)[0]
+
+        print(f"{args.runs} runs, {len(WAVELENGTHS)} points each")
+        print(f"{'index all exports':<28}{indexing * 1000:>10.0f} ms")
+        print(f"{'update after one new export':<28}{incremental * 1000:>10.0f} ms")
+        print(f"{'query':<10}{'runs':>6}{'parse CSVs ms':>16}{'archive ms':>13}{'speed-up':>10}")
+        for name, count, slow, fast in (("march", len(values), csv_march, fast_march),
+                                        ("drift", len(drift.runs), csv_drift, fast_drift)):
+            print(f"{name:<10}{count:>6}{slow * 1000:>16.1f}{fast * 1000:>13.2f}{slow / fast:>9.0f}x")
+        print(f"405 nm trend at 5 µW: {drift.slope_per_day:+.4f} %/day (parsed CSVs: {csv_slope:+.4f})")
+
+
+if __name__ == "__main__":
+    main()
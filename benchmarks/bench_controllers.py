@@ -0,0 +1,95 @@
+"""Benchmark: feedback iterations and time per wavelength step for each controller.
+
+Runs a full calibration sweep per controller and target power against the
+simulated bench and reports how many laser adjustments and how much (virtual)
+bench time each step needed to get within tolerance. The "seeded" scenario uses
+the default simulator, which is close to proportional; "nonlinear" gives the
+laser a 10 % threshold and a curved response, where the proportional update
+struggles. Each combination runs twice: starting every step from the previous
+wavelength's setting, and warm-started from the calibration store built from
+test-results/. Reads per step include the one right after the filter move.
+
+    python benchmarks/bench_controllers.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from calibration_store import CalibrationStore, WarmStart
+from controllers import CONTROLLERS, MIN_LASER_POWER, converge, make_controller
+from settling import SettlingDetector
+from simulation import RESULTS_DIR, SpectralModel, simulated_bench
+
+WAVELENGTHS = np.arange(405.0, 835.0, 5.0)
+TARGETS_UW = (5.0, 100.0)
+TOLERANCE = 0.5
+MAX_ITERATIONS = 10
+SCENARIOS = {
+    "seeded": {},
+    "nonlinear": {"threshold": 10.0, "exponent": 1.5},
+}
+
+
+def run_sweep(name, target_uW, model, store=None, seed=0):
+    bench = simulated_bench(model=model, seed=seed)
+    controller = make_controller(name)
+    settler = SettlingDetector(bench, band_uW=TOLERANCE, rel_band=0.01)
+    warm_start = WarmStart(store, target_uW) if store is not None else None
+
+    bench.filter.short_setpoint = WAVELENGTHS[0] - 5
+    bench.filter.long_setpoint = WAVELENGTHS[0] + 5
+    setting = 30.0
+    bench.laser.set_power(setting)
+    bench.laser.set_emission(True)
+    # Emission warm-up is setup, not part of the per-step numbers
+    bench.sleep(3)
+
+    iterations, step_times, converged = [], [], 0
+    for wavelength in WAVELENGTHS:
+        # Points outside the laser's range would only measure the iteration cap
+        exact = bench.power_meter.model.setting_for(wavelength, target_uW)
+        if exact is None or exact < MIN_LASER_POWER:
+            continue
+        start = bench.time()
+        bench.filter.short_setpoint = wavelength - 5
+        bench.filter.long_setpoint = wavelength + 5
+        prediction = warm_start.predict(wavelength) if warm_start is not None else None
+        if prediction is not None:
+            setting = prediction.setting
+            bench.laser.set_power(setting)
+        controller.start_step(wavelength)
+        power = settler.wait(max_wait=0.5).power_uW
+        setting, power, count = converge(bench, controller, settler, target_uW, TOLERANCE,
+                                         MAX_ITERATIONS, setting, power)
+        if warm_start is not None:
+            warm_start.update(wavelength, setting)
+        iterations.append(count)
+        step_times.append(bench.time() - start)
+        converged += abs(power - target_uW) <= TOLERANCE
+    return np.array(iterations), np.array(step_times), converged
+
+
+def main():
+    store = CalibrationStore().load_directory(RESULTS_DIR)
+    print(f"{'scenario':<11}{'controller':<14}{'start':<10}{'target µW':>10}{'steps':>7}{'conv.':>7}"
+          f"{'reads mean':>12}{'reads max':>11}{'bench s/step':>14}{'wall ms':>10}")
+    for scenario, options in SCENARIOS.items():
+        model = SpectralModel.from_csv(**options)
+        for target_uW in TARGETS_UW:
+            for name in CONTROLLERS:
+                for start, start_store in (("previous", None), ("store", store)):
+                    wall_start = time.perf_counter()
+                    iterations, step_times, converged = run_sweep(name, target_uW, model, start_store)
+                    wall_ms = (time.perf_counter() - wall_start) * 1e3
+                    reads = iterations + 1
+                    print(f"{scenario:<11}{name:<14}{start:<10}{target_uW:>10.1f}{len(reads):>7}"
+                          f"{converged:>7}{reads.mean():>12.2f}{reads.max():>11}"
+                          f"{step_times.mean():>14.3f}{wall_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
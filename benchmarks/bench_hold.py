@@ -0,0 +1,80 @@
+"""Benchmark: open vs closed-loop ON phases on a drifting simulated bench.
+
+Calibrates 500-600 nm for the target, lets the bench sit for a while with the
+laser output drifting, then measures the same range twice: holding the
+planned settings (open loop) and correcting them from the power stream
+(closed loop). Reported per mode, averaged over the steps: the offset from
+the target of the mean power over the second half of each ON phase (after
+the emission ramp), the RMS error over the whole phase, the settling time
+into the deadband, the corrections made and the steps that ended pinned at
+100 % (out of reach, which no hold can fix). --targets runs several powers
+one after the other.
+
+    python benchmarks/bench_hold.py [--drift 0.2] [--wait 3600] [--on 10] [--targets 50 200 400]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER
+from engine import Engine
+from simulation import simulated_bench
+
+
+def run(hold_mode, target_uW, args):
+    bench = simulated_bench(drift_per_hour=args.drift)
+    engine = Engine(bench)
+    starts = []
+
+    def phase(index, name):
+        if name == "on":
+            starts.append(bench.time())
+
+    try:
+        engine.calibrate(target_uW, start_wl=500, step=5, steps=20)
+        bench.sleep(args.wait)
+        engine.measure(engine.plan(500, 600, 10, args.on, 1.0), on_phase=phase, hold_mode=hold_mode,
+                       deadband_uW=args.deadband)
+        times, values = engine.stream.samples_since(starts[0])
+        steady = []
+        for start in starts:
+            late = (times >= start + args.on / 2) & (times < start + args.on)
+            steady.append(abs(values[late].mean() - target_uW))
+        return engine.step_stats, steady
+    finally:
+        engine.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drift", type=float, default=0.2, help="laser output drift per hour (fraction)")
+    parser.add_argument("--wait", type=float, default=3600.0, help="s between calibration and measurement")
+    parser.add_argument("--targets", type=float, nargs="+", default=[50.0], help="µW")
+    parser.add_argument("--on", type=float, default=10.0, help="ON time per step in s")
+    parser.add_argument("--deadband", type=float, default=0.5, help="µW")
+    args = parser.parse_args()
+
+    print(f"Drift {args.drift:+.0%}/h, measured {args.wait:.0f} s after calibrating, "
+          f"{args.on:g} s ON, deadband {args.deadband:g} µW")
+    print(f"{'target µW':>9}  {'hold':<8}{'steady error µW':>16}{'RMS error µW':>14}{'settling s':>12}"
+          f"{'unsettled':>11}{'pinned':>8}{'corrections':>13}")
+    for target_uW in args.targets:
+        for hold_mode in ("open", "closed"):
+            steps, steady = run(hold_mode, target_uW, args)
+            offset = np.mean(steady)
+            rms = np.mean([step.rms_error_uW for step in steps])
+            settling = [step.settling_time for step in steps]
+            settled = [seconds for seconds in settling if not np.isnan(seconds)]
+            pinned = sum(not MIN_LASER_POWER < step.final_setting < MAX_LASER_POWER for step in steps)
+            print(f"{target_uW:>9g}  {hold_mode:<8}{offset:>16.3f}{rms:>14.3f}"
+                  f"{(np.mean(settled) if settled else float('nan')):>12.2f}"
+                  f"{len(settling) - len(settled):>7}/{len(settling):<3}{pinned:>8}"
+                  f"{sum(step.adjustments for step in steps):>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark: cost of the timing instrumentation.
+
+Per call: a simulated laser.set_power straight on the device, through the
+instrumented proxy with no run active, and inside a run; the same for an
+empty span(). Per routine: the wall time of a 40-step simulated calibration
+with the bench instrumented and timed, against the same calibration on the
+bare bench. The simulator runs on a virtual clock, so the wall time is pure
+computation and the overhead shows at its largest; on the real bench every
+call also waits for USB.
+
+    python benchmarks/bench_instrumentation.py
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import instrumentation
+from engine import Engine
+from simulation import simulated_bench
+
+CALLS = 100000
+STEPS = 40
+
+
+def per_call(statement, setup):
+    return min(timeit.repeat(statement, setup, number=CALLS, repeat=5, globals=globals())) / CALLS * 1e9
+
+
+def calibration_wall(instrumented):
+    bench = simulated_bench()
+    raw = (bench.laser, bench.filter, bench.power_meter, bench.clock)
+    engine = Engine(bench)
+    if not instrumented:
+        bench.laser, bench.filter, bench.power_meter, bench.clock = raw
+    start = time.perf_counter()
+    if instrumented:
+        engine.calibrate(10.0, steps=STEPS)
+    else:
+        Engine.calibrate.__wrapped__(engine, 10.0, steps=STEPS)
+    wall = time.perf_counter() - start
+    engine.close()
+    return wall, engine.timings
+
+
+def main():
+    bench = simulated_bench()
+    laser = bench.laser
+    proxy = instrumentation.InstrumentedDevice(laser, "laser")
+    cases = [
+        ("laser.set_power, bare device", lambda: per_call("laser.set_power(20.0)", "")),
+        ("laser.set_power, no run", lambda: per_call("proxy.set_power(20.0)", "")),
+        ("laser.set_power, in a run", lambda: per_call(
+            "proxy.set_power(20.0)", "instrumentation.start_run('bench')")),
+        ("span(), no run", lambda: per_call("with instrumentation.span('x'): pass", "")),
+        ("span(), in a run", lambda: per_call(
+            "with instrumentation.span('x'): pass", "instrumentation.start_run('bench')")),
+    ]
+    globals().update(laser=laser, proxy=proxy)
+    print(f"{'per call':<34}{'ns':>8}")
+    for name, measure in cases:
+        instrumentation.finish_run()
+        print(f"{name:<34}{measure():>8.0f}")
+    instrumentation.finish_run()
+
+    bare = min(calibration_wall(False)[0] for _ in range(3))
+    runs = [calibration_wall(True) for _ in range(3)]
+    timed, timings = min(runs, key=lambda run: run[0])
+    calls = sum(count for count, _, _, _ in timings.stats().values())
+    print(f"\n{STEPS + 1}-point calibration, {calls} timed calls and spans")
+    print(f"{'bare bench':<34}{bare * 1000:>8.1f} ms wall")
+    print(f"{'instrumented':<34}{timed * 1000:>8.1f} ms wall ({timed / bare - 1:+.1%})")
+    print(f"{'simulated bench time':<34}{timings.elapsed():>8.1f} s")
+
+
+if __name__ == "__main__":
+    main()
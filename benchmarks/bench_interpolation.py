@@ -0,0 +1,80 @@
+"""Benchmark: evaluating a measurement sweep plan from the calibration curve.
+
+Compares the original per-point path (build interp1d from the calibration
+lists, then one float(interp_func(wl)) call and a clamp per wavelength) with a
+CalibrationModel compiled once and evaluated over the whole plan as one array.
+The calibration is the newest export in test-results/ and the plan has 10k
+wavelengths across and slightly beyond its range. Build and evaluation times
+are reported separately; the "max diff" column checks the linear model agrees
+with interp1d.
+
+    python benchmarks/bench_interpolation.py
+"""
+import glob
+import os
+import pickle
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+from calibration_model import KINDS, CalibrationModel
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER
+from simulation import RESULTS_DIR, read_calibration_csv
+
+PLAN_POINTS = 10000
+REPEATS = 5
+
+
+def best_of(function, repeats=REPEATS):
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def per_point(rows, plan):
+    # What run_measurement did before: lists -> interp1d, then one scalar call per step
+    wavelengths = np.array([x[0] for x in rows])
+    settings = np.array([x[1] for x in rows])
+    interp_func = interp1d(wavelengths, settings, kind='linear', fill_value="extrapolate")
+    calibrated_wls = [x[0] for x in rows]
+    min_cal_wl, max_cal_wl = min(calibrated_wls), max(calibrated_wls)
+    out = []
+    for wl in plan:
+        setting = float(interp_func(wl))
+        out.append(max(MIN_LASER_POWER, min(MAX_LASER_POWER, setting)))
+        _ = wl < min_cal_wl or wl > max_cal_wl
+    return np.array(out)
+
+
+def main():
+    paths = sorted(glob.glob(os.path.join(RESULTS_DIR, "calibration_*.csv")))
+    rows = read_calibration_csv(paths[-1])
+    low, high = min(r[0] for r in rows), max(r[0] for r in rows)
+    plan = np.linspace(low - 10, high + 10, PLAN_POINTS)
+    print(f"calibration {os.path.basename(paths[-1])}: {len(rows)} points, plan {PLAN_POINTS} wavelengths")
+
+    elapsed, reference = best_of(lambda: per_point(rows, plan), repeats=1)
+    print(f"{'method':<22}{'build ms':>10}{'eval ms':>10}{'per point us':>14}{'max diff':>10}{'pickle B':>10}")
+    print(f"{'interp1d per point':<22}{'':>10}{elapsed * 1e3:>10.1f}{elapsed / PLAN_POINTS * 1e6:>14.2f}"
+          f"{0.0:>10.2g}{'':>10}")
+
+    for kind in KINDS:
+        build, model = best_of(lambda: CalibrationModel.from_rows(rows, kind))
+        evaluate, plan_result = best_of(lambda: model.plan(plan))
+        diff = np.max(np.abs(plan_result.settings - reference))
+        size = len(pickle.dumps(model))
+        print(f"{kind + ' model':<22}{build * 1e3:>10.2f}{evaluate * 1e3:>10.2f}"
+              f"{evaluate / PLAN_POINTS * 1e6:>14.3f}{diff:>10.2g}{size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark: one multi-target sweep vs one sweep per target power.
+
+Calibrates 5 µW, 100 µW and 1 mW over 405-835 nm on the simulated bench,
+once as three separate Engine.calibrate() sweeps and once with
+Engine.calibrate_targets(). Reports (virtual) bench time, filter moves, laser
+adjustments and how many points ended within tolerance (1 mW is beyond the
+simulated laser, so those points end saturated in both modes), with the
+simulator's fast filter and with a filter that takes ten times longer to
+settle after a move. The table is
+then checked at 30 µW, a target that was never calibrated, against the
+simulator's exact settings.
+
+    python benchmarks/bench_multi_target.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from controllers import CONTROLLERS
+from engine import Engine
+from simulation import simulated_bench
+
+TARGETS_UW = (5.0, 100.0, 1000.0)
+START, STEP, STEPS = 405, 5, 86
+TOLERANCE = 0.5
+CHECK_TARGET_UW = 30.0
+FILTER_TAUS = (0.1, 1.0)  # s, filter settling time constant
+
+
+def counting(bench):
+    counts = {"filter": 0, "laser": 0}
+    set_power = bench.laser.set_power
+
+    def counted_set_power(setting):
+        counts["laser"] += 1
+        set_power(setting)
+
+    bench.laser.set_power = counted_set_power
+    return counts
+
+
+def run(controller, multi, filter_tau):
+    bench = simulated_bench(filter_tau=filter_tau)
+    counts = counting(bench)
+    # Both modes warm-start from the bundled test results
+    engine = Engine(bench, controller)
+    move_filter = engine.scheduler.move_filter
+
+    def counted_move(short, long):
+        counts["filter"] += 1
+        return move_filter(short, long)
+
+    engine.scheduler.move_filter = counted_move
+    start, wall = bench.time(), time.perf_counter()
+    if multi:
+        table = engine.calibrate_targets(TARGETS_UW, START, STEP, STEPS, TOLERANCE)
+        runs = [table.rows(target) for target in TARGETS_UW]
+    else:
+        table = None
+        runs = [engine.calibrate(target, START, STEP, STEPS, tolerance=TOLERANCE).rows
+                for target in TARGETS_UW]
+    elapsed, wall = bench.time() - start, time.perf_counter() - wall
+    engine.close()
+    within = sum(abs(row[2] - target) <= TOLERANCE for target, rows in zip(TARGETS_UW, runs) for row in rows)
+    points = sum(len(rows) for rows in runs)
+    return table, bench, elapsed, wall, counts, within, points
+
+
+def main():
+    print(f"targets {', '.join(f'{t:g}' for t in TARGETS_UW)} µW, {STEPS + 1} wavelengths from {START} nm")
+    print(f"{'filter tau':<12}{'controller':<14}{'mode':<15}{'bench s':>9}{'filter moves':>14}{'laser sets':>12}"
+          f"{'within tol.':>13}{'wall ms':>9}")
+    for filter_tau, controller in [(tau, name) for tau in FILTER_TAUS for name in sorted(CONTROLLERS)]:
+        for multi in (False, True):
+            table, bench, elapsed, wall, counts, within, points = run(controller, multi, filter_tau)
+            mode = "multi-target" if multi else "one per target"
+            print(f"{filter_tau:<12g}{controller:<14}{mode:<15}{elapsed:>9.1f}{counts['filter']:>14}{counts['laser']:>12}"
+                  f"{within:>7}/{points:<5}{wall * 1000:>9.0f}")
+            if multi and filter_tau == FILTER_TAUS[0]:
+                model = bench.power_meter.model
+                exact = np.array([model.setting_for(w, CHECK_TARGET_UW) or np.nan for w in table.wavelengths])
+                free = (exact > table.min_setting) & (exact < table.max_setting)
+                error = np.abs(table.model(CHECK_TARGET_UW)(table.wavelengths[free]) - exact[free])
+                print(f"{'':<41}{CHECK_TARGET_UW:g} µW from the table: mean |error| {error.mean():.2f} %, "
+                      f"max {error.max():.2f} % over {int(free.sum())} points")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Benchmark: calibrations whose target is out of reach over part of the range.
+
+Two simulated calibrations with no past runs to warm-start from: 100 µW over
+405-505 nm, where the blue end saturates at 100 %, and 5 µW over 560-660 nm,
+where even the minimum setting gives more. Each runs with converge() as it is
+(stopping once a point is pinned at a limit) and with the former loop, which
+kept adjusting until max_iterations. Reported: feedback iterations, simulated
+bench time and the points marked out of reach.
+
+    python benchmarks/bench_reach.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine as engine_module
+from calibration_store import CalibrationStore
+from controllers import converge
+from engine import Engine
+from instrumentation import span
+from simulation import simulated_bench
+
+CASES = ((100.0, 405), (5.0, 560))
+
+
+def converge_to_limit(bench, controller, settler, target_uW, tolerance, max_iterations,
+                      setting, power_uW, settle_time=0.5, on_reading=None):
+    # The loop before out-of-reach detection
+    iterations = 0
+    while iterations < max_iterations and abs(power_uW - target_uW) > tolerance:
+        with span("feedback iteration"):
+            setting = controller.next_setting(setting, power_uW, target_uW)
+            bench.laser.set_power(setting)
+            power_uW = settler.wait(max_wait=settle_time).power_uW
+        iterations += 1
+    return setting, power_uW, iterations
+
+
+def calibrate(target_uW, start_wl):
+    engine = Engine(simulated_bench(), calibration_store=CalibrationStore())
+    marked = []
+    try:
+        engine.calibrate(target_uW, start_wl=start_wl, step=5, steps=20,
+                         on_point=lambda process, *row: process != "Calibration" and marked.append(row))
+        timings = engine.timings
+        return timings.stats().get("feedback iteration", (0,))[0], timings.elapsed(), len(marked)
+    finally:
+        engine.close()
+
+
+def main():
+    print(f"{'case':<22}{'loop':<12}{'iterations':>11}{'bench s':>10}{'marked':>8}")
+    for target_uW, start_wl in CASES:
+        case = f"{target_uW:g} µW, {start_wl}-{start_wl + 100} nm"
+        for name, loop in (("to limit", converge_to_limit), ("early stop", converge)):
+            engine_module.converge = loop
+            iterations, elapsed, marked = calibrate(target_uW, start_wl)
+            print(f"{case:<22}{name:<12}{iterations:>11}{elapsed:>10.1f}{marked:>8}")
+    engine_module.converge = converge
+
+
+if __name__ == "__main__":
+    main()
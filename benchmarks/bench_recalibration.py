@@ -0,0 +1,94 @@
+"""Benchmark: incremental recalibration against a full recalibration sweep.
+
+Calibrates the simulated bench at 100 µW, then lets the spectrum drift and
+recalibrates twice: with a full sweep and incrementally. Reports bench time,
+the speed-up over the full sweep, points re-measured and how many points of
+the resulting curve deliver the target within tolerance. Without drift an
+incremental recalibration must re-measure (almost) nothing; the benchmark
+fails if it re-measures more than MAX_FALSE_DRIFTS points.
+
+    python benchmarks/bench_recalibration.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from controllers import make_controller
+from recalibration import VersionedCalibration, calibrate_wavelengths, incremental_recalibration
+from settling import SettlingDetector
+from simulation import SpectralModel, simulated_bench
+
+WAVELENGTHS = np.arange(490.0, 835.0, 5.0)
+TARGET_UW = 100.0
+TOLERANCE = 0.5
+SPACINGS = (25.0, 50.0)
+MAX_FALSE_DRIFTS = 1
+
+# name -> (centre nm, width nm, relative change) of a local change in the spectrum
+DRIFTS = {
+    "none": None,
+    "local": (600.0, 12.0, 0.06),
+    "broad": (700.0, 60.0, -0.05),
+}
+
+
+def apply_drift(model, drift):
+    if drift is None:
+        return
+    centre, width, change = drift
+    bump = np.exp(-0.5 * ((model.wavelengths - centre) / width) ** 2)
+    model.full_power_uW = model.full_power_uW * (1.0 + change * bump)
+
+
+def in_tolerance(bench, rows):
+    """Counts rows whose stored setting delivers the target on the drifted bench."""
+    meter = bench.power_meter
+    bench.laser.set_emission(True)
+    bench.sleep(5)
+    good = 0
+    for wavelength, setting, _ in rows:
+        power = meter.model.power(wavelength, 10.0, setting) * meter.gain()
+        good += abs(power - TARGET_UW) <= TOLERANCE
+    bench.laser.set_emission(False)
+    return good
+
+
+def main():
+    print(f"{'drift':<8}{'mode':<18}{'points':>7}{'re-measured':>13}{'bench s':>10}{'speed-up':>10}"
+          f"{'in tol.':>9}{'wall ms':>10}")
+    for name, drift in DRIFTS.items():
+        model = SpectralModel.from_csv()
+        bench = simulated_bench(model=model, noise=0.002)
+        settler = SettlingDetector(bench, band_uW=TOLERANCE, rel_band=0.01)
+        rows = calibrate_wavelengths(bench, WAVELENGTHS, TARGET_UW, make_controller("model"),
+                                     settler, TOLERANCE)
+        apply_drift(model, drift)
+
+        wall_start, start = time.perf_counter(), bench.time()
+        full = calibrate_wavelengths(bench, WAVELENGTHS, TARGET_UW, make_controller("model"),
+                                     settler, TOLERANCE)
+        full_time, full_wall = bench.time() - start, time.perf_counter() - wall_start
+        print(f"{name:<8}{'full':<18}{len(full):>7}{len(full):>13}{full_time:>10.1f}{1.0:>10.1f}"
+              f"{in_tolerance(bench, full):>9}{full_wall * 1e3:>10.1f}")
+
+        for spacing in SPACINGS:
+            calibration = VersionedCalibration()
+            calibration.commit(rows, TARGET_UW)
+            wall_start = time.perf_counter()
+            version, report = incremental_recalibration(bench, calibration, make_controller("model"),
+                                                        settler, TOLERANCE, spacing=spacing)
+            wall = time.perf_counter() - wall_start
+            mode = f"incremental/{spacing:.0f}nm"
+            print(f"{name:<8}{mode:<18}{len(version.rows):>7}{report.remeasured:>13}"
+                  f"{report.elapsed:>10.1f}{full_time / report.elapsed:>10.1f}"
+                  f"{in_tolerance(bench, version.rows):>9}{wall * 1e3:>10.1f}")
+            if drift is None and report.remeasured > MAX_FALSE_DRIFTS:
+                raise RuntimeError(f"{report.remeasured} points re-measured without drift ({mode})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark: adaptive wavelength sampling against a uniform grid.
+
+Calibrates 405-830 nm on the simulated bench with the same point budget on a
+uniform grid and with the adaptive sampler, then compares the linear
+interpolant of each (as used by run_measurement) with a dense reference: the
+simulator's exact, noise-free setting on a 1 nm grid. The adaptive sampler
+runs with its default error target, so it may stop short of the budget; the
+last rows do the same on the range Engine.calibrate covers by default
+(500-600 nm, 21 points), with a uniform grid of as many points as it used.
+
+    python benchmarks/bench_sampling.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from adaptive_sampling import adaptive_calibration
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER, make_controller
+from recalibration import calibrate_wavelengths
+from settling import SettlingDetector
+from simulation import SpectralModel, simulated_bench
+
+START, END = 405.0, 830.0
+TARGET_UW = 50.0
+TOLERANCE = 0.5
+BUDGETS = (12, 21, 43)
+# Engine.calibrate's defaults: start_wl=500, step=5, steps=20
+ENGINE_START, ENGINE_END, ENGINE_POINTS = 500.0, 600.0, 21
+
+
+def reference_curve(model, start=START, end=END):
+    wavelengths = np.arange(start, end + 1.0, 1.0)
+    settings = []
+    for wavelength in wavelengths:
+        exact = model.setting_for(wavelength, TARGET_UW)
+        settings.append(MAX_LASER_POWER if exact is None else max(MIN_LASER_POWER, exact))
+    return wavelengths, np.array(settings)
+
+
+def interpolation_error(rows, reference):
+    wavelengths, settings = reference
+    predicted = np.interp(wavelengths, [r[0] for r in rows], [r[1] for r in rows])
+    error = np.abs(predicted - settings)
+    return error.max(), np.sqrt(np.mean(error ** 2))
+
+
+def uniform(model, reference, start, end, points):
+    bench = simulated_bench(model=model)
+    settler = SettlingDetector(bench, band_uW=TOLERANCE, rel_band=0.01)
+    wall_start, began = time.perf_counter(), bench.time()
+    rows = calibrate_wavelengths(bench, np.linspace(start, end, points), TARGET_UW,
+                                 make_controller("model"), settler, TOLERANCE)
+    elapsed, wall = bench.time() - began, time.perf_counter() - wall_start
+    max_err, rms_err = interpolation_error(rows, reference)
+    print(f"{'uniform':<10}{len(rows):>7}{max_err:>11.2f}{rms_err:>11.2f}{'':>10}{elapsed:>9.1f}{wall * 1e3:>9.1f}")
+
+
+def adaptive(model, reference, start, end, budget):
+    bench = simulated_bench(model=model)
+    settler = SettlingDetector(bench, band_uW=TOLERANCE, rel_band=0.01)
+    wall_start = time.perf_counter()
+    rows, report = adaptive_calibration(bench, start, end, TARGET_UW, make_controller("model"),
+                                        settler, TOLERANCE, max_points=budget)
+    wall = time.perf_counter() - wall_start
+    max_err, rms_err = interpolation_error(rows, reference)
+    print(f"{'adaptive':<10}{len(rows):>7}{max_err:>11.2f}{rms_err:>11.2f}{report.error:>10.2f}"
+          f"{report.elapsed:>9.1f}{wall * 1e3:>9.1f}")
+    return len(rows)
+
+
+def main():
+    model = SpectralModel.from_csv()
+    reference = reference_curve(model)
+    print(f"{'grid':<10}{'points':>7}{'max err %':>11}{'rms err %':>11}{'est. err':>10}{'bench s':>9}{'wall ms':>9}")
+    for budget in BUDGETS:
+        uniform(model, reference, START, END, budget)
+        adaptive(model, reference, START, END, budget)
+
+    print(f"\nEngine default range {ENGINE_START:g}-{ENGINE_END:g} nm, up to {ENGINE_POINTS} points")
+    reference = reference_curve(model, ENGINE_START, ENGINE_END)
+    used = adaptive(model, reference, ENGINE_START, ENGINE_END, ENGINE_POINTS)
+    uniform(model, reference, ENGINE_START, ENGINE_END, used)
+    uniform(model, reference, ENGINE_START, ENGINE_END, ENGINE_POINTS)
+
+
+if __name__ == "__main__":
+    main()
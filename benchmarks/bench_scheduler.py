@@ -0,0 +1,100 @@
+"""Benchmark: per-step latency of a measurement sweep, sequential vs scheduled.
+
+The simulated instruments answer instantly on a virtual clock, so this uses
+stand-ins that block for a typical command latency on the real clock instead
+(Varia setpoint writes, Extreme power/emission writes, PM100D configuration).
+"sequential" is the original run_measurement order: move the filter, wait
+the 0.5 s settle, set the power, emission on, hold, emission off, wait. The
+scheduled runs use sweep_planner.execute_plan, inline and with one worker
+thread per device.
+
+    python benchmarks/bench_scheduler.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calibration_model import CalibrationModel
+from devices import Bench
+from scheduler import CommandScheduler
+from sweep_planner import execute_plan, plan_measurement
+
+FILTER_WRITE = 0.05   # s per Varia setpoint write
+LASER_WRITE = 0.03    # s per Extreme register write
+METER_WRITE = 0.01    # s per PM100D SCPI command
+ON_TIME, OFF_TIME = 0.2, 0.3
+STEPS = 5
+
+
+class SlowFilter:
+    def __init__(self):
+        self._short, self._long = 527, 537
+
+    @property
+    def short_setpoint(self):
+        return self._short
+
+    @short_setpoint.setter
+    def short_setpoint(self, value):
+        time.sleep(FILTER_WRITE)
+        self._short = value
+
+    @property
+    def long_setpoint(self):
+        return self._long
+
+    @long_setpoint.setter
+    def long_setpoint(self, value):
+        time.sleep(FILTER_WRITE)
+        self._long = value
+
+
+class SlowLaser:
+    def set_power(self, power):
+        time.sleep(LASER_WRITE)
+
+    def set_emission(self, value):
+        time.sleep(LASER_WRITE)
+
+
+class SlowMeter:
+    def set_wavelength(self, wavelength):
+        time.sleep(METER_WRITE)
+
+
+def sequential(bench, plan):
+    for i in range(len(plan)):
+        bench.filter.short_setpoint = int(plan.short[i])
+        bench.filter.long_setpoint = int(plan.long[i])
+        bench.power_meter.set_wavelength(plan.wavelengths[i])
+        bench.sleep(plan.filter_settle)
+        bench.laser.set_power(float(plan.settings[i]))
+        bench.laser.set_emission(True)
+        bench.sleep(plan.on_time)
+        bench.laser.set_emission(False)
+        bench.sleep(plan.off_time)
+
+
+def main():
+    model = CalibrationModel([450.0, 700.0], [60.0, 20.0])
+    plan = plan_measurement(model, 500, 500 + 10 * (STEPS - 1), 10, ON_TIME, OFF_TIME)
+    print(f"{STEPS} steps, on {ON_TIME} s, off {OFF_TIME} s, filter settle {plan.filter_settle} s, "
+          f"planned {plan.duration:.2f} s")
+    print(f"{'mode':<22}{'total s':>9}{'per step s':>12}")
+    runs = [
+        ("sequential", lambda bench: sequential(bench, plan)),
+        ("scheduled, inline", lambda bench: execute_plan(bench, plan, CommandScheduler(bench, threaded=False))),
+        ("scheduled, threaded", lambda bench: execute_plan(bench, plan)),
+    ]
+    for name, run in runs:
+        bench = Bench(SlowMeter(), SlowLaser(), SlowFilter())
+        start = time.perf_counter()
+        run(bench)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<22}{elapsed:>9.2f}{elapsed / STEPS:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
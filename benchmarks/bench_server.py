@@ -0,0 +1,178 @@
+"""Benchmark: command rate and power streaming of the local control server.
+
+Serves a simulated bench (on the wall clock) on a free localhost port and
+measures, from a client in the same process:
+
+- set_power round trips, one request at a time and --pipeline requests in flight;
+- power samples delivered to a subscriber reading as fast as it can, while a
+  second one (with a small receive buffer) stops reading for --stall s: the
+  fast one should not notice, and once the stalled one reads again it should
+  get through the bounded backlog and back to fresh samples quickly, the
+  samples it missed dropped and counted.
+
+Lag is the age of the newest sample of a batch when the client reads it.
+
+Before that, malformed requests (missing or mistyped parameters, missing or empty
+files, a sweep its calibration cannot plan) are sent on one connection: each
+must get an error reply, the connection must stay open and the engine's
+calibration must not change.
+
+    python benchmarks/bench_server.py [--requests 2000] [--pipeline 64] [--stall 5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acquisition import PowerStream
+from control_core import ControlCore
+from control_server import CommandError, ControlClient, ControlServer
+from devices import SystemClock
+from engine import Engine
+from scheduler import CommandScheduler
+from simulation import simulated_bench
+
+
+def start_server():
+    bench = simulated_bench(clock=SystemClock())
+    core = ControlCore(bench)
+    stream = PowerStream(bench, threaded=True).start()
+    scheduler = CommandScheduler(bench)
+    server = ControlServer(Engine(bench, stream=stream, scheduler=scheduler), core)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(server.start(port=0), loop).result()
+
+    def close():
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        core.close()
+        stream.stop()
+        scheduler.close()
+
+    return server, close
+
+
+def bad_requests(directory):
+    """(command, parameters) of requests the server must refuse."""
+    empty = os.path.join(directory, "empty.csv")
+    open(empty, "w").close()
+    calibration = os.path.join(directory, "calibration.csv")
+    with open(calibration, "w") as f:
+        f.write("Wavelength (nm),Laser Setting (%),Measured Power (uW)\n")
+        f.writelines(f"{wavelength},{40 + wavelength / 20},10.0\n" for wavelength in range(500, 605, 5))
+    sweep = {"start": 500, "end": 600, "step": 10, "on_time": 1, "off_time": 1}
+    return [
+        ("set_power", {"setting": "20"}),
+        ("calibrate", {"target_uW": 10, "steps": 2.5}),
+        ("calibrate", {"target_uW": 10, "start": 380}),
+        ("calibrate", {"target_uW": 10, "multi_target": "yes"}),
+        ("recalibrate", {"calibration": "/nope.csv"}),
+        ("recalibrate", {"calibration": 5}),
+        ("recalibrate", {"calibration": empty}),
+        ("run_sweep", {**sweep, "start": "500"}),
+        ("run_sweep", {**sweep, "calibration": "/nope.csv"}),
+        ("run_sweep", {**sweep, "table": empty, "target_uW": 10}),
+        ("run_sweep", {**sweep, "calibration": calibration, "end": 900}),
+    ]
+
+
+def check_errors(server):
+    """Sends bad_requests() on one connection; raises unless all are refused and nothing was loaded."""
+    versions = len(server.engine.calibration.versions)
+    with tempfile.TemporaryDirectory() as directory, ControlClient(port=server.port) as client:
+        for command, params in bad_requests(directory):
+            try:
+                client.call(command, **params)
+            except CommandError as e:
+                print(f"{command:<14}{e}")
+            else:
+                raise RuntimeError(f"{command} {params} was accepted")
+        client.call("ping")
+    if len(server.engine.calibration.versions) != versions:
+        raise RuntimeError("A refused request loaded a calibration")
+
+
+def round_trips(port, requests, in_flight):
+    with ControlClient(port=port) as client:
+        client.call("set_wavelength", wavelength=550)
+        started = time.perf_counter()
+        pending = []
+        for index in range(requests):
+            pending.append(client.send("set_power", setting=20 + index % 60))
+            if len(pending) >= in_flight:
+                client.reply(pending.pop(0))
+        for request_id in pending:
+            client.reply(request_id)
+        return requests / (time.perf_counter() - started)
+
+
+def lag(batch):
+    return time.monotonic() - batch["t"][-1]  # The bench runs on the wall clock
+
+
+def fast_subscriber(port, seconds, result):
+    with ControlClient(port=port) as client:
+        client.call("subscribe", topics=["power"])
+        received, lags = 0, []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            batch = client.event("power")
+            received += len(batch["t"])
+            lags.append(lag(batch))
+        result.extend([received / seconds, max(lags)])
+
+
+def stalled_subscriber(port, stall, result):
+    with ControlClient(port=port, receive_buffer=4096) as client:
+        client.call("subscribe", topics=["power"])
+        time.sleep(stall)
+        started = time.perf_counter()
+        batches = 0
+        while True:
+            batch = client.event("power")
+            batches += 1
+            if lag(batch) < 0.2:
+                break
+        result.extend([batches, time.perf_counter() - started, batch["dropped"]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--pipeline", type=int, default=64, help="requests in flight")
+    parser.add_argument("--stall", type=float, default=5.0, help="s the stalled subscriber does not read")
+    args = parser.parse_args()
+
+    server, close = start_server()
+    try:
+        check_errors(server)
+        print()
+        with ControlClient(port=server.port) as client:
+            client.call("emission", on=True)
+        print(f"{'set_power':<30}{'requests/s':>12}")
+        for in_flight in (1, args.pipeline):
+            rate = round_trips(server.port, args.requests, in_flight)
+            print(f"{f'{in_flight} in flight':<30}{rate:>12.0f}")
+
+        fast, stalled = [], []
+        threads = [threading.Thread(target=fast_subscriber, args=(server.port, args.stall + 1.0, fast)),
+                   threading.Thread(target=stalled_subscriber, args=(server.port, args.stall, stalled))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"\nSubscriber reading continuously: {fast[0]:.0f} samples/s, lag at most {fast[1]:.2f} s")
+        print(f"Subscriber stalled for {args.stall:g} s: {stalled[0]} batches and {stalled[1]:.2f} s to fresh "
+              f"samples, {stalled[2]} samples dropped")
+    finally:
+        close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Benchmark: time until the main window is interactive.
+
+Every measurement runs in a fresh interpreter. "import main" is the module
+load alone; "eager imports" adds the modules main.py used to load up front
+(matplotlib.pyplot, scipy.interpolate), where installed, for comparison. With a
+display, "window interactive" runs main.main() against the simulated bench
+with the target-power dialog answered automatically and stops at the first
+idle callback of the Tk main loop; "devices ready" is when the bench-dependent
+objects have been created. The heavy modules actually loaded at that point
+are listed as well.
+
+    python benchmarks/bench_startup.py [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("matplotlib", "scipy", "pyvisa", "ThorlabsPM100", "nkt_tools")
+
+IMPORT_MAIN = """
+import time
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start)
+"""
+
+EAGER_IMPORTS = """
+import time
+start = time.perf_counter()
+import main
+for name in ("matplotlib.pyplot", "scipy.interpolate"):
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+print(time.perf_counter() - start)
+"""
+
+WINDOW = """
+import time
+start = time.perf_counter()
+import sys
+import tkinter as tk
+from tkinter import simpledialog
+
+import main
+import engine
+
+simpledialog.askfloat = lambda *args, **kwargs: 10.0
+ready = {}
+engine_init = engine.Engine.__init__
+
+def timed_engine_init(self, *args, **kwargs):
+    engine_init(self, *args, **kwargs)
+    ready["devices"] = time.perf_counter() - start
+
+engine.Engine.__init__ = timed_engine_init
+mainloop = tk.Tk.mainloop
+
+def timed_mainloop(self, n=0):
+    def interactive():
+        ready["window"] = time.perf_counter() - start
+        self.after(200, self.destroy)
+    self.after_idle(interactive)
+    mainloop(self, n)
+
+tk.Tk.mainloop = timed_mainloop
+main.main(simulate=True)
+loaded = [name for name in HEAVY if name in sys.modules]
+print(ready.get("window", float("nan")), ready.get("devices", float("nan")), ",".join(loaded) or "-")
+"""
+
+
+def run(code, runs):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1]
+        results.append(out.stdout.split())
+    return results, None
+
+
+def display_available():
+    out = subprocess.run([sys.executable, "-c", "import tkinter; tkinter.Tk().destroy()"],
+                         capture_output=True)
+    return out.returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"median of {args.runs} fresh interpreters")
+    for name, code in (("import main", IMPORT_MAIN), ("eager imports", EAGER_IMPORTS)):
+        results, error = run(code, args.runs)
+        if error:
+            print(f"{name:<20} failed: {error}")
+            continue
+        print(f"{name:<20}{statistics.median(float(r[0]) for r in results) * 1000:>8.0f} ms")
+
+    if not display_available():
+        print("window interactive  skipped, no display")
+        return
+    results, error = run(f"HEAVY = {HEAVY!r}\n" + WINDOW, args.runs)
+    if error:
+        print(f"window interactive  failed: {error}")
+        return
+    print(f"{'window interactive':<20}{statistics.median(float(r[0]) for r in results) * 1000:>8.0f} ms")
+    print(f"{'devices ready':<20}{statistics.median(float(r[1]) for r in results) * 1000:>8.0f} ms")
+    print(f"{'heavy modules':<20}{results[-1][2]:>8}")
+
+
+if __name__ == "__main__":
+    main()
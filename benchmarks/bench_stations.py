@@ -0,0 +1,62 @@
+"""Benchmark: throughput of the station orchestrator with 1 to --max-stations simulated rigs.
+
+Every station runs the same jobs (two calibrations and a measurement) on a
+simulated bench whose clock is the wall clock sped up --speed times, so the
+instruments' settling and dwell times take real time as they do on hardware,
+only shorter. Reported per station count: wall time, runs per second, the
+speed-up over one station and the scaling efficiency (speed-up / stations).
+
+    python benchmarks/bench_stations.py [--max-stations 8] [--speed 50]
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import RUN_SETTINGS, expand_jobs
+from stations import Orchestrator, Station
+
+JOBS = [
+    {"type": "calibration", "target_uW": [10, 50], "start": 500, "step": 10, "steps": 10},
+    {"type": "measurement", "start": 500, "end": 600, "step": 10, "on_time": 2, "off_time": 1},
+]
+
+
+def run(count, speed):
+    stations = [Station(f"S{index}", simulate=True, speed=speed, simulation={"seed": index})
+                for index in range(count)]
+    runs = expand_jobs(JOBS)
+    with tempfile.TemporaryDirectory() as output:
+        orchestrator = Orchestrator(stations, dict(RUN_SETTINGS), runs, output, out=io.StringIO())
+        started = time.perf_counter()
+        failed = orchestrator.run()
+        elapsed = time.perf_counter() - started
+    if failed:
+        raise RuntimeError(f"{failed} runs failed with {count} stations")
+    return elapsed, count * len(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-stations", type=int, default=8)
+    parser.add_argument("--speed", type=float, default=50.0, help="simulated time per wall-clock second")
+    args = parser.parse_args()
+
+    counts = [1]
+    while counts[-1] * 2 <= args.max_stations:
+        counts.append(counts[-1] * 2)
+    print(f"{'stations':>8}{'runs':>6}{'wall s':>9}{'runs/s':>9}{'speed-up':>10}{'efficiency':>12}")
+    single = None
+    for count in counts:
+        elapsed, runs = run(count, args.speed)
+        rate = runs / elapsed
+        single = single or rate
+        print(f"{count:>8}{runs:>6}{elapsed:>9.2f}{rate:>9.2f}{rate / single:>10.2f}{rate / single / count:>12.0%}")
+
+
+if __name__ == "__main__":
+    main()
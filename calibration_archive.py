@@ -0,0 +1,254 @@
+"""Archive of every calibration export, indexed once and memory-mapped for queries.
+
+Comparing runs used to mean opening each calibration_YYYYMMDD_HHMMSS.csv in a
+spreadsheet. The archive parses each export once and keeps
+
+    runs.npy        one record per run: timestamp, target, wavelength range,
+                    number of points, saturated points, offset of its points
+    wavelength.npy  \\
+    setting.npy      > every point of every run, run after run in time order
+    power.npy       /
+    index.json      the source file, size and mtime of each run
+
+in a directory. Opening it memory-maps the arrays, so a query over thousands
+of runs touches only the pages it reads and never parses a CSV. Updating
+parses only exports that are new or changed since the last update; runs stay
+archived when their export is deleted. Queries are vectorized over runs: the
+value at a wavelength is interpolated inside every selected run at once with a
+single searchsorted over all points.
+
+    python calibration_archive.py update [DIR ...] [--archive DIR]
+    python calibration_archive.py list [--from 2025-03-01] [--to 2025-04-01] [--target 10]
+    python calibration_archive.py query 532 --from 2025-03-01 --to 2025-04-01 [--power]
+    python calibration_archive.py drift 405 [--target 10]
+"""
+import argparse
+import glob
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from calibration_store import CalibrationRun, timestamp_from_name
+from simulation import RESULTS_DIR, read_calibration_csv
+
+ARCHIVE_DIR = os.path.join("results", "calibration-archive")
+INDEX = "index.json"
+RUN_FIELDS = np.dtype([("timestamp", "<f8"), ("target", "<f8"), ("min_wavelength", "<f8"),
+                       ("max_wavelength", "<f8"), ("points", "<i4"), ("saturated", "<i4"),
+                       ("offset", "<i8")])
+POINT_COLUMNS = ("wavelength", "setting", "power")
+KEY_SPAN = 1e4  # nm; in the search key every run's wavelengths sort above the previous run's
+
+# runs: archive indices; timestamps: seconds since the epoch; values: one per run
+Series = namedtuple("Series", "runs timestamps values")
+# slope_per_day: least-squares trend of the setting in % per day, NaN with fewer than two runs
+Drift = namedtuple("Drift", "runs timestamps settings powers slope_per_day")
+
+
+def to_epoch(when):
+    """Seconds since the epoch of a datetime or an ISO date string."""
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when)
+    return when.timestamp()
+
+
+class CalibrationArchive:
+    """Index and concatenated points of many calibration runs."""
+
+    def __init__(self, path=ARCHIVE_DIR):
+        self.path = path
+        self._release()
+        if os.path.exists(os.path.join(path, INDEX)):
+            self._load()
+
+    def _release(self):
+        # Drops the memory maps, which keep the files open (and unreplaceable on Windows)
+        self.sources = []
+        self.runs = np.empty(0, dtype=RUN_FIELDS)
+        self.wavelengths = self.settings = self.powers = np.empty(0)
+        self._key = None
+
+    def _load(self):
+        with open(os.path.join(self.path, INDEX), encoding="utf-8") as f:
+            self.sources = json.load(f)["sources"]
+        if not self.sources:
+            return
+        self.runs = np.load(os.path.join(self.path, "runs.npy"), mmap_mode="r")
+        self.wavelengths, self.settings, self.powers = (
+            np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r") for name in POINT_COLUMNS)
+
+    def _save(self, name, array):
+        temporary = os.path.join(self.path, f"{name}.tmp.npy")
+        np.save(temporary, array)
+        os.replace(temporary, os.path.join(self.path, f"{name}.npy"))
+
+    def update(self, directories=(RESULTS_DIR, "."), pattern="calibration_*.csv"):
+        """Indexes the exports that are new or changed since the last update; returns how many."""
+        known = {source["source"]: source for source in self.sources}
+        changed = []
+        for path in sorted({os.path.abspath(p) for d in directories for p in glob.glob(os.path.join(d, pattern))}):
+            stat = os.stat(path)
+            source = known.get(path)
+            if source is None or source["size"] != stat.st_size or source["mtime"] != stat.st_mtime:
+                changed.append((path, stat))
+        if not changed:
+            return 0
+
+        # (source, run record without offset, wavelengths, settings, powers) per run
+        entries = []
+        replaced = {path for path, _ in changed}
+        for index, source in enumerate(self.sources):
+            if source["source"] in replaced:
+                continue
+            run = self.runs[index]
+            points = slice(int(run["offset"]), int(run["offset"]) + int(run["points"]))
+            entries.append((source, tuple(run)[:-1], np.array(self.wavelengths[points]),
+                            np.array(self.settings[points]), np.array(self.powers[points])))
+        added = 0
+        for path, stat in changed:
+            rows = read_calibration_csv(path)
+            if not rows:
+                continue
+            timestamp = timestamp_from_name(path) or datetime.fromtimestamp(stat.st_mtime)
+            run = CalibrationRun(rows, timestamp=timestamp, source=path)
+            record = (timestamp.timestamp(), np.nan if run.target_uW is None else run.target_uW,
+                      run.wavelengths[0], run.wavelengths[-1], len(run), int(run.saturated.sum()))
+            source = {"source": path, "size": stat.st_size, "mtime": stat.st_mtime}
+            entries.append((source, record, run.wavelengths, run.settings, run.powers))
+            added += 1
+        entries.sort(key=lambda entry: entry[1][0])
+
+        runs = np.empty(len(entries), dtype=RUN_FIELDS)
+        offset = 0
+        for index, (_, record, wavelengths, _, _) in enumerate(entries):
+            runs[index] = record + (offset,)
+            offset += len(wavelengths)
+        self._release()
+        os.makedirs(self.path, exist_ok=True)
+        self._save("runs", runs)
+        for column, name in enumerate(POINT_COLUMNS, 2):
+            self._save(name, np.concatenate([entry[column] for entry in entries]) if entries else np.empty(0))
+        # The index goes last: until it is replaced, readers keep seeing the previous archive
+        temporary = os.path.join(self.path, INDEX + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"sources": [entry[0] for entry in entries]}, f, indent=1, ensure_ascii=False)
+        os.replace(temporary, os.path.join(self.path, INDEX))
+        self._load()
+        return added
+
+    def __len__(self):
+        return len(self.runs)
+
+    def select(self, start=None, end=None, target_uW=None, rel_tolerance=0.2, wavelength=None):
+        """Indices of the runs from start (inclusive) to end (exclusive), near target_uW, covering wavelength."""
+        runs = self.runs
+        mask = np.ones(len(runs), dtype=bool)
+        if start is not None:
+            mask &= runs["timestamp"] >= to_epoch(start)
+        if end is not None:
+            mask &= runs["timestamp"] < to_epoch(end)
+        if target_uW is not None:
+            # Runs without an inferable target (all points pinned) never match; NaN compares False
+            mask &= np.abs(runs["target"] / target_uW - 1) <= rel_tolerance
+        if wavelength is not None:
+            mask &= (runs["min_wavelength"] <= wavelength) & (runs["max_wavelength"] >= wavelength)
+        return np.flatnonzero(mask)
+
+    def points(self, index):
+        """(wavelength, setting, power) rows of one run."""
+        run = self.runs[index]
+        points = slice(int(run["offset"]), int(run["offset"]) + int(run["points"]))
+        return list(zip(self.wavelengths[points].tolist(), self.settings[points].tolist(),
+                        self.powers[points].tolist()))
+
+    def _search_key(self):
+        if self._key is None:
+            run_of_point = np.repeat(np.arange(len(self.runs)), self.runs["points"])
+            self._key = run_of_point * KEY_SPAN + self.wavelengths
+        return self._key
+
+    def at_wavelength(self, wavelength, runs=None, quantity="setting"):
+        """Series of the setting (or power) at wavelength, interpolated in each run that covers it."""
+        runs = self.select(wavelength=wavelength) if runs is None else np.asarray(runs, dtype=np.int64)
+        records = self.runs[runs]
+        covered = (records["min_wavelength"] <= wavelength) & (records["max_wavelength"] >= wavelength)
+        runs, records = runs[covered], records[covered]
+        values = self.settings if quantity == "setting" else self.powers
+
+        first = records["offset"]
+        last = first + records["points"] - 1
+        right = np.clip(np.searchsorted(self._search_key(), runs * KEY_SPAN + wavelength), first, last)
+        left = np.maximum(right - 1, first)
+        x0, x1 = self.wavelengths[left], self.wavelengths[right]
+        y0, y1 = values[left], values[right]
+        span = np.where(x1 > x0, x1 - x0, 1.0)
+        fraction = np.where(x1 > x0, (wavelength - x0) / span, 0.0)
+        return Series(runs, records["timestamp"], y0 + fraction * (y1 - y0))
+
+    def drift(self, wavelength, target_uW=None, rel_tolerance=0.2, start=None, end=None):
+        """Setting and power at wavelength across the selected runs, with the setting's trend.
+
+        The setting for a wavelength depends on the target, so pass target_uW
+        unless the archive only holds runs at one power.
+        """
+        runs = self.select(start, end, target_uW, rel_tolerance, wavelength)
+        settings = self.at_wavelength(wavelength, runs)
+        powers = self.at_wavelength(wavelength, runs, "power")
+        days = settings.timestamps / 86400.0
+        if len(np.unique(days)) > 1:
+            slope = float(np.polyfit(days - days[0], settings.values, 1)[0])
+        else:
+            slope = float("nan")
+        return Drift(runs, settings.timestamps, settings.values, powers.values, slope)
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and query past calibration exports")
+    parser.add_argument("--archive", default=ARCHIVE_DIR, help=f"archive directory (default: {ARCHIVE_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    updater = commands.add_parser("update", help="index new and changed calibration_*.csv exports")
+    updater.add_argument("directories", nargs="*", default=[RESULTS_DIR, "."])
+    for name, help_text in (("list", "list the indexed runs"),
+                            ("query", "setting (or power) at a wavelength in every matching run"),
+                            ("drift", "trend of the setting at a wavelength over time")):
+        command = commands.add_parser(name, help=help_text)
+        if name != "list":
+            command.add_argument("wavelength", type=float)
+        command.add_argument("--from", dest="start", help="first date, e.g. 2025-03-01")
+        command.add_argument("--to", dest="end", help="date after the last, e.g. 2025-04-01")
+        command.add_argument("--target", type=float, help="target power in µW (±20 %%)")
+        if name == "query":
+            command.add_argument("--power", action="store_true", help="report measured power instead")
+    args = parser.parse_args()
+
+    archive = CalibrationArchive(args.archive)
+    if args.command == "update":
+        added = archive.update(args.directories)
+        print(f"{added} runs indexed, {len(archive)} in {args.archive}")
+    elif args.command == "list":
+        for index in archive.select(args.start, args.end, args.target):
+            run = archive.runs[index]
+            print(f"{_format_time(run['timestamp'])}  target {run['target']:8.2f} µW  "
+                  f"{run['min_wavelength']:.0f}-{run['max_wavelength']:.0f} nm  {run['points']:3d} points  "
+                  f"{run['saturated']:3d} saturated  {os.path.basename(archive.sources[index]['source'])}")
+    elif args.command == "query":
+        runs = archive.select(args.start, args.end, args.target, wavelength=args.wavelength)
+        series = archive.at_wavelength(args.wavelength, runs, "power" if args.power else "setting")
+        unit = "µW" if args.power else "%"
+        for timestamp, value in zip(series.timestamps, series.values):
+            print(f"{_format_time(timestamp)}  {value:8.3f} {unit}")
+        if len(series.values):
+            print(f"{len(series.values)} runs: mean {series.values.mean():.3f} {unit}, "
+                  f"std {series.values.std():.3f} {unit}")
+    else:
+        drift = archive.drift(args.wavelength, args.target, start=args.start, end=args.end)
+        for timestamp, setting, power in zip(drift.timestamps, drift.settings, drift.powers):
+            print(f"{_format_time(timestamp)}  {setting:8.3f} %  {power:9.3f} µW")
+        print(f"{len(drift.runs)} runs, trend {drift.slope_per_day:+.4f} %/day")
@@ -0,0 +1,285 @@
+"""Calibration curve compiled for fast evaluation of whole sweep plans.
+
+A CalibrationModel is built once per calibration from its (wavelength, setting,
+power) rows and then evaluates any number of wavelengths as one NumPy array,
+with the calibrated range cached so extrapolation can be flagged without
+rescanning the rows. Models hold only arrays and spline coefficients, so they
+pickle cleanly and can be handed to worker processes or saved with a run.
+
+A TargetTable holds the settings of a multi-target calibration, one column per
+target power on a shared wavelength grid. Every cell is a (setting, measured
+power) sample of the laser's response at that wavelength, including cells
+pinned at the setting limits, so settings for a power in between are
+interpolated per wavelength through those samples in log-log space (power
+follows the setting roughly as a power law) and then compiled into a
+CalibrationModel as usual.
+
+Where the calibration was pinned at a setting limit the target was out of
+reach, unless the power measured there was within tolerance of the target
+anyway (as controllers.out_of_reach() decides during the sweep). limited()
+marks the wavelengths whose curve sits at a limit short of the target, and
+power_range() estimates the power the laser can deliver there (from the
+measured powers, scaled proportionally to the limits), so a plan can say what
+to ask for instead.
+"""
+import csv
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER
+
+KINDS = ("linear", "pchip", "spline")
+
+# settings are clipped to what the laser accepts; extrapolated marks wavelengths outside the calibration,
+# limited those where the curve is pinned at a setting limit (the target out of reach)
+SweepPlan = namedtuple("SweepPlan", "wavelengths settings extrapolated limited")
+
+
+class CalibrationModel:
+    """Wavelength -> laser setting curve of one calibration."""
+
+    def __init__(self, wavelengths, settings, kind="linear", smoothing=0.5,
+                 min_setting=MIN_LASER_POWER, max_setting=MAX_LASER_POWER, powers=None,
+                 target_uW=None, tolerance=0.5):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown interpolation '{kind}', choose from {', '.join(KINDS)}")
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        settings = np.asarray(settings, dtype=float)
+        if len(wavelengths) == 0:
+            raise ValueError("No calibration data available")
+        # Repeated wavelengths (e.g. a re-measured point) are averaged
+        self.wavelengths, inverse = np.unique(wavelengths, return_inverse=True)
+        self.settings = np.bincount(inverse, weights=settings) / np.bincount(inverse)
+        # Measured power per calibrated wavelength, if known
+        self.powers = (np.bincount(inverse, weights=np.asarray(powers, dtype=float)) / np.bincount(inverse)
+                       if powers is not None else None)
+        # Target the powers were measured for; without it (or without powers) a pinned setting counts as short
+        self.target_uW = target_uW
+        self.tolerance = tolerance
+        self.kind = kind
+        self.smoothing = smoothing
+        self.min_setting = min_setting
+        self.max_setting = max_setting
+        self.min_wavelength = float(self.wavelengths[0])
+        self.max_wavelength = float(self.wavelengths[-1])
+
+        n = len(self.wavelengths)
+        self._pchip = None
+        self._tck = None
+        # scipy is only imported by the curves that need it; linear models start faster without it
+        if kind == "pchip" and n >= 2:
+            from scipy.interpolate import PchipInterpolator
+            self._pchip = PchipInterpolator(self.wavelengths, self.settings, extrapolate=True)
+        elif kind == "spline" and n >= 2:
+            from scipy.interpolate import splrep
+            # smoothing is the expected RMS deviation of a setting from the curve (in %)
+            self._tck = splrep(self.wavelengths, self.settings, k=min(3, n - 1),
+                               s=n * smoothing ** 2)
+
+    @classmethod
+    def from_rows(cls, rows, kind="linear", **kwargs):
+        return cls([row[0] for row in rows], [row[1] for row in rows], kind,
+                   powers=[row[2] for row in rows], **kwargs)
+
+    @property
+    def bounds(self):
+        return self.min_wavelength, self.max_wavelength
+
+    def evaluate(self, wavelengths):
+        """Raw interpolated settings; outside the calibration the end behaviour is extrapolated."""
+        x = np.asarray(wavelengths, dtype=float)
+        if len(self.wavelengths) == 1:
+            return np.full(x.shape, self.settings[0])
+        if self._pchip is not None:
+            return self._pchip(x)
+        if self._tck is not None:
+            from scipy.interpolate import splev
+            return splev(x, self._tck, ext=0)
+        # Linear, extended along the end segments like interp1d(fill_value="extrapolate")
+        xs, ys = self.wavelengths, self.settings
+        y = np.interp(x, xs, ys)
+        below, above = x < xs[0], x > xs[-1]
+        y = np.where(below, ys[0] + (x - xs[0]) * (ys[1] - ys[0]) / (xs[1] - xs[0]), y)
+        y = np.where(above, ys[-1] + (x - xs[-1]) * (ys[-1] - ys[-2]) / (xs[-1] - xs[-2]), y)
+        return y
+
+    def extrapolated(self, wavelengths):
+        x = np.asarray(wavelengths, dtype=float)
+        return (x < self.min_wavelength) | (x > self.max_wavelength)
+
+    def pinned(self, settings, powers=None):
+        """(saturated, floor) masks of settings at a limit with the power there short of the target."""
+        saturated = np.asarray(settings) >= self.max_setting
+        floor = np.asarray(settings) <= self.min_setting
+        if self.target_uW is not None and powers is not None:
+            # Negated comparisons so an unknown (NaN) power keeps the flag
+            saturated &= ~(powers >= self.target_uW - self.tolerance)
+            floor &= ~(powers <= self.target_uW + self.tolerance)
+        return saturated, floor
+
+    def limited(self, wavelengths):
+        """True where the curve reaches a setting limit short of the target, i.e. the target was out of reach."""
+        x = np.asarray(wavelengths, dtype=float)
+        powers = np.interp(x, self.wavelengths, self.powers) if self.powers is not None else None
+        saturated, floor = self.pinned(self.evaluate(x), powers)
+        return saturated | floor
+
+    def power_range(self, wavelengths):
+        """(lowest, highest) power in µW the laser can deliver at wavelengths, NaN without powers.
+
+        Exact where the calibration was pinned at a limit, elsewhere the
+        measured power scaled proportionally to the limits.
+        """
+        x = np.asarray(wavelengths, dtype=float)
+        if self.powers is None:
+            return np.full(x.shape, np.nan), np.full(x.shape, np.nan)
+        per_setting = self.powers / np.maximum(self.settings, 1e-9)
+        low = np.interp(x, self.wavelengths, per_setting * self.min_setting)
+        high = np.interp(x, self.wavelengths, per_setting * self.max_setting)
+        return low, high
+
+    def settings_for(self, wavelengths):
+        """Settings to send to the laser, clipped to [min_setting, max_setting]."""
+        return np.clip(self.evaluate(wavelengths), self.min_setting, self.max_setting)
+
+    def plan(self, wavelengths):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        return SweepPlan(wavelengths, self.settings_for(wavelengths), self.extrapolated(wavelengths),
+                         self.limited(wavelengths))
+
+    def __call__(self, wavelengths):
+        return self.settings_for(wavelengths)
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+
+def describe_reach(model):
+    """One line on the calibrated points pinned at a limit short of the target and the power there; '' if none."""
+    low, high = model.power_range(model.wavelengths)
+    saturated, floor = model.pinned(model.settings, model.powers)
+    parts = []
+    for pinned, name, bound, powers in ((saturated, "saturated", "max", high),
+                                        (floor, "at the floor", "min", low)):
+        if not pinned.any():
+            continue
+        wavelengths = model.wavelengths[pinned]
+        span = (f"{wavelengths[0]:g} nm" if len(wavelengths) == 1
+                else f"{wavelengths[0]:g}-{wavelengths[-1]:g} nm")
+        part = f"{int(pinned.sum())} {name} ({span}"
+        if np.isfinite(powers[pinned]).all():
+            part += f", {bound} {powers[pinned].min():.3g}-{powers[pinned].max():.3g} µW"
+        parts.append(part + ")")
+    return "Target out of reach at " + "; ".join(parts) if parts else ""
+
+
+_TARGET_COLUMN = re.compile(r"Setting @ ([0-9.eE+-]+)")
+
+
+class TargetTable:
+    """Wavelength x target power table of laser settings from one multi-target sweep."""
+
+    def __init__(self, wavelengths, targets_uW, settings, powers=None, kind="linear", smoothing=0.5,
+                 min_setting=MIN_LASER_POWER, max_setting=MAX_LASER_POWER):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.targets = np.asarray(targets_uW, dtype=float)
+        self.settings = np.asarray(settings, dtype=float).reshape(len(self.wavelengths), len(self.targets))
+        self.powers = (np.asarray(powers, dtype=float).reshape(self.settings.shape)
+                       if powers is not None else np.full(self.settings.shape, np.nan))
+        if len(self.targets) < 2 or np.any(np.diff(self.targets) <= 0):
+            raise ValueError("A target table needs at least two distinct target powers, ascending")
+        self.kind = kind
+        self.smoothing = smoothing
+        self.min_setting = min_setting
+        self.max_setting = max_setting
+        self._models = {}
+
+    def column(self, target_uW):
+        """Settings at every table wavelength for target_uW.
+
+        Per wavelength, log(setting) is interpolated linearly over the log of
+        the powers measured in that row (the targets where no power was
+        recorded); beyond them the nearest pair's slope is extended and the
+        result clipped, so a saturated row stays at max_setting.
+        """
+        exact = np.flatnonzero(self.targets == target_uW)
+        if len(exact):
+            return self.settings[:, exact[0]].copy()
+        measured = np.isfinite(self.powers) & (self.powers > 0)
+        log_powers = np.log(np.where(measured, self.powers, self.targets))
+        log_settings = np.log(np.maximum(self.settings, 1e-9))
+        x = np.log(target_uW)
+        column = np.empty(len(self.wavelengths))
+        for i in range(len(column)):
+            order = np.argsort(log_powers[i], kind="stable")
+            xs, ys = log_powers[i][order], log_settings[i][order]
+            high = int(np.clip(np.searchsorted(xs, x), 1, len(xs) - 1))
+            low = high - 1
+            if xs[high] - xs[low] <= 0:
+                column[i] = ys[high] if x >= xs[high] else ys[low]
+            else:
+                column[i] = ys[low] + (x - xs[low]) * (ys[high] - ys[low]) / (xs[high] - xs[low])
+        return np.clip(np.exp(column), self.min_setting, self.max_setting)
+
+    def target_extrapolated(self, target_uW):
+        return not self.targets[0] <= target_uW <= self.targets[-1]
+
+    def model(self, target_uW):
+        """CalibrationModel for one target power, compiled once per target."""
+        key = float(target_uW)
+        if key not in self._models:
+            if len(self._models) >= 16:
+                self._models.clear()
+            # Measured powers are known for the calibrated targets only
+            exact = np.flatnonzero(self.targets == key)
+            powers = self.powers[:, exact[0]] if len(exact) else None
+            self._models[key] = CalibrationModel(self.wavelengths, self.column(key), self.kind,
+                                                 self.smoothing, self.min_setting, self.max_setting, powers,
+                                                 target_uW=key)
+        return self._models[key]
+
+    def settings_for(self, wavelengths, target_uW):
+        return self.model(target_uW).settings_for(wavelengths)
+
+    def rows(self, target_uW):
+        """(wavelength, setting, power) rows of one calibrated target."""
+        exact = np.flatnonzero(self.targets == target_uW)
+        if not len(exact):
+            raise ValueError(f"{target_uW:g} µW was not calibrated; use model() for targets in between")
+        j = exact[0]
+        return [(float(w), float(s), float(p))
+                for w, s, p in zip(self.wavelengths, self.settings[:, j], self.powers[:, j])]
+
+    def header(self):
+        return (["Wavelength (nm)"] + [f"Setting @ {t:g} µW (%)" for t in self.targets]
+                + [f"Power @ {t:g} µW (µW)" for t in self.targets])
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.header())
+            for i, wavelength in enumerate(self.wavelengths):
+                writer.writerow([wavelength] + list(self.settings[i]) + list(self.powers[i]))
+
+    @classmethod
+    def from_csv(cls, path, **kwargs):
+        with open(path, newline='', encoding='latin-1') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            targets = [float(m.group(1)) for m in map(_TARGET_COLUMN.search, header) if m]
+            data = np.array([[float(value) for value in row] for row in reader if row], dtype=float)
+        n = len(targets)
+        if data.ndim != 2 or data.shape[1] != 1 + 2 * n:
+            raise ValueError(f"{path} is not a multi-target table")
+        return cls(data[:, 0], targets, data[:, 1:1 + n], data[:, 1 + n:1 + 2 * n], **kwargs)
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+
+def sweep_wavelengths(start_wl, end_wl, step_size):
+    """Wavelengths of a measurement sweep from start_wl to end_wl (inclusive) in step_size steps."""
+    num_steps = int((end_wl - start_wl) / step_size) + 1
+    return np.round(start_wl + step_size * np.arange(num_steps), 1)
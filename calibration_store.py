@@ -0,0 +1,210 @@
+"""Index of past calibration runs used to predict starting laser settings.
+
+Every calibrated point (wavelength, setting, power) tells how much power one
+percent of laser setting delivers at that wavelength. A point pinned at 100 %
+is just as useful: it is the most power the laser can deliver there. The store
+interpolates that gain across wavelengths for every run, combines runs with a
+weight that favours similar target powers, and turns it back into a setting
+for a new (wavelength, target) pair, flagging targets out of reach up front.
+During a sweep, WarmStart rescales those predictions by how far the points
+already calibrated today landed from them, which absorbs day-to-day laser
+output changes. A constant scale cannot absorb a laser whose response has
+changed shape (a threshold, a curved response), so WarmStart tracks how far off
+both its prediction and the previous point's setting have been and seeds from
+the better of the two; on such a laser it is then about as good as starting
+from the previous setting, not better.
+"""
+import glob
+import math
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER
+from simulation import RESULTS_DIR, read_calibration_csv
+
+# saturated: the target is out of reach even at 100 %; setting is then MAX_LASER_POWER
+Prediction = namedtuple("Prediction", "setting saturated max_power_uW")
+
+_TIMESTAMP = re.compile(r"(\d{8}_\d{6})")
+
+
+def timestamp_from_name(path):
+    match = _TIMESTAMP.search(os.path.basename(path))
+    if match is None:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+
+
+class CalibrationRun:
+    """One calibration curve: settings and measured powers per wavelength."""
+
+    def __init__(self, rows, target_uW=None, timestamp=None, source=None, tolerance=0.5):
+        rows = sorted(rows)
+        self.wavelengths = np.array([r[0] for r in rows], dtype=float)
+        self.settings = np.array([r[1] for r in rows], dtype=float)
+        self.powers = np.array([r[2] for r in rows], dtype=float)
+        self.timestamp = timestamp
+        self.source = source
+        self.tolerance = tolerance
+        self.target_uW = target_uW if target_uW is not None else self.infer_target()
+
+    def infer_target(self):
+        # Exports carry no target column: it is what the unpinned points converged to
+        free = (self.settings < MAX_LASER_POWER) & (self.settings >= MIN_LASER_POWER)
+        if not free.any():
+            return None
+        return float(np.median(self.powers[free]))
+
+    @property
+    def saturated(self):
+        """Points pinned at 100 % that still fell short of the target."""
+        pinned = self.settings >= MAX_LASER_POWER
+        if self.target_uW is None:
+            return pinned
+        return pinned & (self.powers < self.target_uW - self.tolerance)
+
+    def gain_points(self):
+        """Wavelengths and power per setting percent, from points the laser actually followed."""
+        valid = (self.settings >= MIN_LASER_POWER) & (self.powers > 0)
+        return self.wavelengths[valid], self.powers[valid] / self.settings[valid]
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+
+class CalibrationStore:
+    """Past calibration runs indexed by wavelength and target power."""
+
+    def __init__(self, runs=()):
+        self.runs = list(runs)
+
+    def add_run(self, run):
+        self.runs.append(run)
+        return run
+
+    def add_results(self, results, target_uW, timestamp=None, tolerance=0.5):
+        """Adds an in-memory calibration_results list of (wavelength, setting, power) tuples."""
+        if not results:
+            return None
+        return self.add_run(CalibrationRun(results, target_uW=target_uW,
+                                           timestamp=timestamp or datetime.now(),
+                                           tolerance=tolerance))
+
+    def load_csv(self, path):
+        for run in self.runs:
+            if run.source is not None and os.path.abspath(run.source) == os.path.abspath(path):
+                return run
+        return self.add_run(CalibrationRun(read_calibration_csv(path),
+                                           timestamp=timestamp_from_name(path), source=path))
+
+    def load_directory(self, directory, pattern="calibration_*.csv"):
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            self.load_csv(path)
+        return self
+
+    def gain_at(self, wavelength, target_uW):
+        """Weighted power per setting percent at wavelength, or None without coverage."""
+        total, weights = 0.0, 0.0
+        for run in self.runs:
+            wavelengths, gains = run.gain_points()
+            if len(wavelengths) == 0 or not wavelengths[0] <= wavelength <= wavelengths[-1]:
+                continue
+            gain = float(np.interp(wavelength, wavelengths, gains))
+            # The setting->power curve is not linear, so runs near the requested
+            # power are the better guide
+            if run.target_uW is None or target_uW <= 0:
+                weight = 0.5
+            else:
+                weight = math.exp(-abs(math.log(run.target_uW / target_uW)))
+            total += weight * gain
+            weights += weight
+        if weights == 0:
+            return None
+        return total / weights
+
+    def max_power_at(self, wavelength):
+        """Highest power seen at 100 % around wavelength, or None if never pinned there."""
+        best = None
+        for run in self.runs:
+            pinned = run.settings >= MAX_LASER_POWER
+            if not pinned.any() or not run.wavelengths[0] <= wavelength <= run.wavelengths[-1]:
+                continue
+            full = np.interp(wavelength, run.wavelengths, np.where(pinned, run.powers, np.nan))
+            if not np.isnan(full):
+                best = float(full) if best is None else max(best, float(full))
+        return best
+
+    def predict(self, wavelength, target_uW, min_setting=MIN_LASER_POWER):
+        """Starting setting for (wavelength, target), or None if no run covers wavelength."""
+        gain = self.gain_at(wavelength, target_uW)
+        if gain is None or gain <= 0:
+            return None
+        max_power = self.max_power_at(wavelength)
+        if max_power is None:
+            max_power = gain * MAX_LASER_POWER
+        setting = target_uW / gain
+        if setting >= MAX_LASER_POWER or target_uW > max_power:
+            return Prediction(MAX_LASER_POWER, True, max_power)
+        return Prediction(max(min_setting, setting), False, max_power)
+
+    def __len__(self):
+        return len(self.runs)
+
+
+class WarmStart:
+    """Store predictions for one sweep, rescaled by the points calibrated so far.
+
+    Falls back to the previous point's setting while that has been the closer guess.
+    """
+
+    def __init__(self, store, target_uW, min_setting=MIN_LASER_POWER, smoothing=0.7):
+        self.store = store
+        self.target_uW = target_uW
+        self.min_setting = min_setting
+        self.smoothing = smoothing
+        self.scale = 1.0
+        self._predicted = {}
+        # Last settled setting, and how far (in log) each seed has been off so far
+        self._previous = None
+        self._store_error = 0.0
+        self._previous_error = 0.0
+
+    def predict(self, wavelength):
+        # Unclamped, so that a prediction below the minimum setting still scales: on
+        # a laser with a threshold that is where the needed setting sits above it
+        prediction = self.store.predict(wavelength, self.target_uW, min_setting=0.0)
+        if prediction is None:
+            return None
+        self._predicted[wavelength] = prediction
+        if prediction.saturated:
+            return prediction
+        setting = prediction.setting * self.scale
+        # When the laser responds differently from the recorded runs (a threshold,
+        # a curved response) the neighbouring point is the better seed
+        if self._previous is not None and self._previous_error < self._store_error:
+            setting = self._previous
+        setting = min(MAX_LASER_POWER, max(self.min_setting, setting))
+        return prediction._replace(setting=setting)
+
+    def update(self, wavelength, setting):
+        """Records the setting the feedback loop actually settled on at wavelength."""
+        prediction = self._predicted.pop(wavelength, None)
+        if prediction is None or prediction.saturated:
+            return
+        # Pinned settings say nothing about the scale
+        if not self.min_setting < setting < MAX_LASER_POWER:
+            return
+        if not 0 < prediction.setting < MAX_LASER_POWER:
+            return
+        store_error = abs(math.log(setting / (prediction.setting * self.scale)))
+        self._store_error += self.smoothing * (store_error - self._store_error)
+        if self._previous is not None:
+            previous_error = abs(math.log(setting / self._previous))
+            self._previous_error += self.smoothing * (previous_error - self._previous_error)
+        self._previous = setting
+        ratio = setting / prediction.setting
+        self.scale += self.smoothing * (ratio - self.scale)
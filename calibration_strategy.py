@@ -1,12 +1,10 @@
-import time
-import pyvisa
-from ThorlabsPM100 import ThorlabsPM100
-from nkt_tools.extreme import Extreme
-from nkt_tools.varia import Varia
+from devices import open_bench
+from instrumentation import finish_run, instrument_bench, span, start_run
+from settling import SettlingDetector
 
-rm = pyvisa.ResourceManager()
-inst = rm.open_resource('USB0::0x1313::0x8078::P0017991::INSTR')
-power_meter = ThorlabsPM100(inst=inst)
+# Real bench by default, simulated one with LASER_SIMULATE=1
+bench = instrument_bench(open_bench())
+power_meter = bench.power_meter
 
 # Coloring for text
 GREEN = "\033[32m"
@@ -14,8 +12,8 @@ CYAN = "\033[36m"
 RESET = "\033[0m"
 
 # Setting up the laser (SuperK Extreme) and the filter (SuperK Varia)
-Laser = Extreme()
-Filter = Varia()
+Laser = bench.laser
+Filter = bench.filter
 
 # Parameters
 Step = 5                  # Step size for the wavelength increase (nm)
@@ -26,6 +24,13 @@ StepDuration = 2          # Duration of each step (seconds)
 target_power_uW = 109.0   # Target power in microwatts (µW)
 tolerance = 0.5           # Tolerance in µW
 max_iterations = 10       # Maximum number of feedback iterations per step
+settle_time = 0.5         # Upper bound for laser/filter settling (seconds)
+
+# Moves on as soon as the power reading is stable instead of always waiting settle_time
+settler = SettlingDetector(bench, band_uW=tolerance, rel_band=0.01)
+
+# Every instrument call, sleep and settle from here on is timed
+start_run("Calibration strategy", bench.time)
 
 # Initialize laser settings
 initial_laser_power_setting = 30.0  # initial power setting (percentage)
@@ -33,8 +38,8 @@ Laser.set_power(initial_laser_power_setting)
 Laser.set_emission(True)            # Turn on the emission
 
 # Initialize filter settings (set initial short and long setpoints)
-Filter.short_setpoint = 527  # Initial short wave pass value
-Filter.long_setpoint = 537   # Initial long wave pass value
+# Initial short/long wave pass values; the meter's wavelength correction follows the centre
+bench.set_passband(527, 537)
 
 starting_wavelength = (Filter.short_setpoint + Filter.long_setpoint) / 2
 print(f"{GREEN}Starting wavelength is: {starting_wavelength} nm{RESET}")
@@ -49,24 +54,19 @@ for i in range(NumberOfSteps):
     new_long_setpoint = Filter.long_setpoint + Step
 
     # Update filter setpoints
-    Filter.short_setpoint = new_short_setpoint
-    Filter.long_setpoint = new_long_setpoint
+    bench.set_passband(new_short_setpoint, new_long_setpoint)
 
     # Compute and print the actual wavelength (average of setpoints)
     actual_wavelength = (new_short_setpoint + new_long_setpoint) / 2
     print(f"{GREEN}Step {i+1}: Set short setpoint to {new_short_setpoint} nm, "
           f"long setpoint to {new_long_setpoint} nm. Actual wavelength is: {actual_wavelength} nm{RESET}")
 
-    # Allow the system to settle after changing the filter settings
-    time.sleep(.5)
+    # Allow the system to settle after changing the filter settings (power in µW)
+    measured_uW = settler.wait(max_wait=settle_time).power_uW
 
     # Feedback loop: Adjust laser power to reach the target power reading
     iteration = 0
     while iteration < max_iterations:
-        # Read power (in Watts) and convert to µW
-        power_W = power_meter.read
-        measured_uW = power_W * 1e6
-
         # If within tolerance, break out of the loop
         if abs(measured_uW - target_power_uW) <= tolerance:
             break
@@ -77,24 +77,27 @@ for i in range(NumberOfSteps):
         else:
             adjustment_factor = target_power_uW / measured_uW
 
-        # Calculate new laser power setting using a simple proportional controller
-        new_setting = current_laser_setting * adjustment_factor
-        Laser.set_power(new_setting)
-        current_laser_setting = new_setting
+        with span("feedback iteration"):
+            # Calculate new laser power setting using a simple proportional controller
+            new_setting = current_laser_setting * adjustment_factor
+            Laser.set_power(new_setting)
+            current_laser_setting = new_setting
 
-        time.sleep(0.5)  # Wait for the laser to respond
+            # Wait for the laser to respond
+            measured_uW = settler.wait(max_wait=settle_time).power_uW
         iteration += 1
 
-    # Final power measurement after adjustments
-    power_W = power_meter.read
-    measured_uW = power_W * 1e6
-    print(f"{CYAN}Current Power: {measured_uW:.1f} µW{RESET}")
+    # Power after adjustments is the last settled reading
+    print(f"{CYAN}Current Power: {measured_uW:.1f} µW "
+          f"(settling saved {settler.take_saved():.2f} s){RESET}")
 
     # Wait for the remainder of the step duration
-    time.sleep(StepDuration)
+    with span("dwell"):
+        bench.sleep(StepDuration)
 
 # Turn off the laser emission after the sequence
 Laser.set_emission(False)
+print(finish_run().summary())
 
 # Print final status
 Laser.print_status()
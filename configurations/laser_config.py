@@ -1,15 +1,14 @@
-import time
-import pyvisa
-from ThorlabsPM100 import ThorlabsPM100
-from nkt_tools.extreme import Extreme
-from nkt_tools.varia import Varia
+import os
+import sys
 
-rm = pyvisa.ResourceManager()  # Let PyVISA choose the available backend
-# resources = rm.list_resources()
-# print("Available VISA Resources:", resources)
+# Allow running this script directly from the configurations folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-inst = rm.open_resource('USB0::0x1313::0x8078::P0017991::INSTR')
-power_meter = ThorlabsPM100(inst=inst)
+from devices import open_bench
+
+# Real bench by default, simulated one with LASER_SIMULATE=1
+bench = open_bench()
+power_meter = bench.power_meter
 
 # print(power_meter.read) # Read-only property
 # print(power_meter.sense.average.count) # read property
@@ -22,8 +21,8 @@ CYAN = "\033[36m"
 RESET = "\033[0m"
 
 # Setting up the laser (SuperK Extreme) and the filter (SuperK Varia)
-Laser = Extreme()
-Filter = Varia()
+Laser = bench.laser
+Filter = bench.filter
 
 # Start wavelength in nm
 InitialWavelength = 532
@@ -64,7 +63,7 @@ for i in range(NumberOfSteps):
     print(f"{GREEN}Step {i + 1}: Set short setpoint to {new_short_setpoint} nm, long setpoint to {new_long_setpoint} nm. Actual wavelength is: {(new_short_setpoint + new_long_setpoint)/2}{RESET}")
     
     # Sleep for precise power output
-    time.sleep(.5)
+    bench.sleep(.5)
 
     # Read the current power measurement
     power_W = power_meter.read  # Power in Watts
@@ -76,7 +75,7 @@ for i in range(NumberOfSteps):
     print(f"{CYAN}Current Power: {power_uW} µW{RESET}")
 
     # Wait for the step duration
-    time.sleep(StepDuration)  # Seconds for sleep
+    bench.sleep(StepDuration)  # Seconds for sleep
 
 # Turn off the emission after completing the sequence
 Laser.set_emission(False)
@@ -1,12 +1,14 @@
-import pyvisa
-from ThorlabsPM100 import ThorlabsPM100
+import os
+import sys
 
-rm = pyvisa.ResourceManager()  # Let PyVISA choose the available backend
-# resources = rm.list_resources()
-# print("Available VISA Resources:", resources)
+# Allow running this script directly from the configurations folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-inst = rm.open_resource('USB0::0x1313::0x8078::P0017991::INSTR')
-power_meter = ThorlabsPM100(inst=inst)
+from devices import open_bench
+
+# Real bench by default, simulated one with LASER_SIMULATE=1
+bench = open_bench()
+power_meter = bench.power_meter
 
 # print(power_meter.read) # Read-only property
 # print(power_meter.sense.average.count) # read property
@@ -0,0 +1,261 @@
+"""Asyncio control core for the laser, the filter and the power meter.
+
+The core runs an asyncio loop in its own thread. Every instrument gets a
+single-thread executor, and every call to it, from awaitable drivers or from
+the existing blocking routines, goes through that executor with a timeout, so
+a hung instrument raises InstrumentTimeout instead of freezing a sweep. A
+semaphore bounds how many instrument calls are in flight at once.
+
+Calibrations, recalibrations and measurements run as jobs, one at a time: a
+second job is refused with Busy instead of racing the first. Jobs may be
+coroutines using the awaitable drivers, or the existing blocking routines.
+Blocking jobs sleep through the bench clock, which the core makes abortable:
+abort() wakes the job at its next sleep with TaskAborted (settling polls every
+few tens of milliseconds) and switches emission off straight away.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from functools import partial
+
+from devices import SystemClock
+
+DEFAULT_TIMEOUT = 5.0  # s for any single instrument call
+DEVICES = ("laser", "filter", "power_meter")
+
+
+class TaskAborted(Exception):
+    """Raised inside a job that was aborted."""
+
+
+class InstrumentTimeout(TimeoutError):
+    """An instrument did not answer in time."""
+
+
+class Busy(RuntimeError):
+    """Another job is already running."""
+
+
+class AbortableClock:
+    """Bench clock whose sleeps raise TaskAborted in the job thread once abort is requested."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.aborted = threading.Event()
+        self.job_thread = None
+
+    def time(self):
+        return self.clock.time()
+
+    def check(self):
+        if self.aborted.is_set() and threading.get_ident() == self.job_thread:
+            raise TaskAborted("Aborted")
+
+    def sleep(self, seconds):
+        self.check()
+        if isinstance(self.clock, SystemClock) and threading.get_ident() == self.job_thread:
+            # Wakes up as soon as abort is requested
+            self.aborted.wait(max(0.0, seconds) / self.clock.speed)
+        else:
+            self.clock.sleep(seconds)
+        self.check()
+
+
+class _DeviceExecutor:
+    """Single worker thread for one instrument."""
+
+    def __init__(self, name):
+        self.name = name
+        self.thread_id = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name,
+                                           initializer=self._remember_thread)
+
+    def _remember_thread(self):
+        self.thread_id = threading.get_ident()
+
+    def run(self, function, timeout):
+        # Calls made from the worker itself (e.g. a driver method using its own properties) run inline
+        if threading.get_ident() == self.thread_id:
+            return function()
+        future = self.executor.submit(function)
+        try:
+            return future.result(timeout)
+        except FuturesTimeout:
+            raise InstrumentTimeout(f"{self.name} did not answer within {timeout} s") from None
+
+
+class TimedDevice:
+    """Blocking proxy: every attribute read, write and method call runs on the device's executor."""
+
+    def __init__(self, device, executor, timeout):
+        object.__setattr__(self, "_device", device)
+        object.__setattr__(self, "_executor", executor)
+        object.__setattr__(self, "_timeout", timeout)
+
+    def _run(self, function):
+        return self._executor.run(function, self._timeout)
+
+    def __getattr__(self, name):
+        value = self._run(partial(getattr, self._device, name))
+        if callable(value):
+            return lambda *args, **kwargs: self._run(partial(value, *args, **kwargs))
+        return value
+
+    def __setattr__(self, name, value):
+        self._run(partial(setattr, self._device, name, value))
+
+
+class AsyncDevice:
+    """Awaitable driver for one instrument."""
+
+    def __init__(self, core, name):
+        self.core = core
+        self.name = name
+
+    async def call(self, method, *args):
+        device = self.core.devices[self.name]
+        return await self.core.device_call(self.name, lambda: getattr(device, method)(*args))
+
+    async def get(self, attribute):
+        return await self.core.device_call(self.name, partial(getattr, self.core.devices[self.name], attribute))
+
+    async def set(self, attribute, value):
+        return await self.core.device_call(self.name, partial(setattr, self.core.devices[self.name],
+                                                               attribute, value))
+
+
+class ControlCore:
+    """Event loop, instrument executors and the single running job."""
+
+    def __init__(self, bench, timeout=DEFAULT_TIMEOUT, max_concurrent=3):
+        self.bench = bench
+        self.timeout = timeout
+        self.devices = {name: getattr(bench, name) for name in DEVICES}
+        self._executors = {name: _DeviceExecutor(name) for name in DEVICES}
+        # From now on the blocking code paths reach the instruments through the executors too
+        for name in DEVICES:
+            setattr(bench, name, TimedDevice(self.devices[name], self._executors[name], timeout))
+        self.clock = AbortableClock(bench.clock)
+        bench.clock = self.clock
+
+        self.laser = AsyncDevice(self, "laser")
+        self.filter = AsyncDevice(self, "filter")
+        self.power_meter = AsyncDevice(self, "power_meter")
+
+        self._job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job")
+        self._job = None
+        self._job_name = None
+        self._job_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    async def device_call(self, name, function):
+        executor = self._executors[name]
+        async with self._slots:
+            try:
+                return await asyncio.wait_for(
+                    self.loop.run_in_executor(executor.executor, function), self.timeout)
+            except asyncio.TimeoutError:
+                raise InstrumentTimeout(f"{name} did not answer within {self.timeout} s") from None
+
+    async def sleep(self, seconds):
+        """Cancellable sleep on the bench clock (virtual time on the simulated bench)."""
+        if isinstance(self.clock.clock, SystemClock):
+            await asyncio.sleep(seconds / self.clock.clock.speed)
+        else:
+            self.clock.clock.sleep(seconds)
+            await asyncio.sleep(0)
+
+    @property
+    def busy(self):
+        return self._job is not None and not self._job.done()
+
+    @property
+    def job_name(self):
+        return self._job_name if self.busy else None
+
+    def submit(self, coroutine):
+        """Runs a coroutine on the core loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def start(self, name, job, *args):
+        """Starts job(*args) as the one running job; coroutine functions receive the core first.
+
+        Raises Busy while another job is still running. Returns a
+        concurrent.futures.Future with the job's result.
+        """
+        with self._job_lock:
+            if self.busy:
+                raise Busy(f"{self._job_name} is already running")
+            self._job_name = name
+            self._job = self.submit(self._run_job(job, args))
+            return self._job
+
+    async def _run_job(self, job, args):
+        if asyncio.iscoroutinefunction(job):
+            self.clock.aborted.clear()
+            return await job(self, *args)
+        return await self.loop.run_in_executor(self._job_executor, self._call_blocking, job, args)
+
+    def _call_blocking(self, job, args):
+        # Runs on the job thread, after any aborted predecessor has finished
+        self.clock.job_thread = threading.get_ident()
+        self.clock.aborted.clear()
+        try:
+            return job(*args)
+        finally:
+            self.clock.job_thread = None
+
+    def abort(self):
+        """Stops the running job and switches emission off; returns a Future for the latter."""
+        self.clock.aborted.set()
+        if self._job is not None:
+            self._job.cancel()
+        return self.submit(self.laser.call("set_emission", False))
+
+    def close(self):
+        try:
+            self.abort().result(self.timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1.0)
+        self._job_executor.shutdown(wait=False)
+        for executor in self._executors.values():
+            executor.executor.shutdown(wait=False)
+
+
+class TkBridge:
+    """Hands results of core futures back to the Tk main loop."""
+
+    def __init__(self, root, interval_ms=50):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._watched = []
+        root.after(interval_ms, self._poll)
+
+    def watch(self, future, on_done=None, on_error=None):
+        """on_done(result) or on_error(exception) runs in the Tk thread once future finishes."""
+        self._watched.append((future, on_done, on_error))
+
+    def _poll(self):
+        pending = []
+        for future, on_done, on_error in self._watched:
+            if not future.done():
+                pending.append((future, on_done, on_error))
+            elif future.cancelled():
+                if on_error is not None:
+                    on_error(TaskAborted("Aborted"))
+            elif future.exception() is not None:
+                if on_error is not None:
+                    on_error(future.exception())
+            elif on_done is not None:
+                on_done(future.result())
+        self._watched = pending
+        try:
+            self.root.after(self.interval_ms, self._poll)
+        except Exception:
+            pass  # The window is being destroyed
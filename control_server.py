@@ -0,0 +1,630 @@
+"""Local control server: other lab software drives the bench over TCP.
+
+Clients connect to 127.0.0.1:8765 (--host/--port) and exchange JSON objects,
+one per line. A request names a command and may carry an id, which the reply
+echoes; replies come in the order the requests were sent:
+
+    > {"id": 1, "cmd": "set_wavelength", "wavelength": 532}
+    < {"id": 1, "ok": true, "wavelength": 532.0}
+    > {"id": 2, "cmd": "set_power", "power_uW": 20}
+    < {"id": 2, "ok": false, "error": "power_uW needs a multi-target calibration ..."}
+    > {"id": 3, "cmd": "subscribe", "topics": ["power"]}
+    < {"event": "power", "t": [...], "uW": [...], "dropped": 0}
+
+Commands:
+
+    ping, status
+    set_wavelength  wavelength: filter passband of BANDWIDTH nm around it, meter correction there
+    set_power       setting (%), or power_uW at the current wavelength from the current calibration
+                    (any power with a multi-target table)
+    emission        on: true or false
+    calibrate       the parameters of a batch.py calibration job; several target_uW need multi_target
+    recalibrate     the parameters of a batch.py recalibration job
+    run_sweep       the parameters of a batch.py measurement job
+    abort           stops the running job and switches emission off
+    subscribe, unsubscribe
+                    topics: power (the power-meter stream), points (every logged row),
+                    log (status lines and finished jobs)
+
+Calibrations, recalibrations and sweeps run as jobs on the control core (see
+control_core.py), by the same Engine as the GUI and batch.py. The reply comes
+as soon as the job has started; a {"event": "job", ...} line with the result
+follows when it ends, to the client that started it and to "log" subscribers.
+The manual commands are refused while a job runs.
+
+Power samples go out in batches, publish_rate times a second. Every client
+has room for max_batches of them; a subscriber reading slower than the stream
+loses its oldest batches (counted in "dropped", in samples) instead of
+holding up the server or the other clients. The socket's send buffer is kept
+small (SEND_BUFFER) so the backlog waits where it can be dropped; a client
+wanting fresh samples after a stall keeps its receive buffer small too
+(ControlClient(receive_buffer=...)). Replies and the other events are never
+dropped: once max_replies of them are waiting for a client, its next request
+is only read after they have been sent.
+
+A simulated bench runs on the wall clock here (--speed to run it faster), so
+the power stream is live between jobs as it is with hardware. ControlClient
+is a blocking client for scripts.
+
+    python control_server.py [--simulate] [--host 127.0.0.1] [--port 8765] [--stations FILE --station NAME]
+"""
+import argparse
+import asyncio
+import json
+import math
+import socket
+from collections import deque
+from datetime import datetime
+
+from acquisition import PowerStream
+from batch import JOB_PARAMETERS, check_job
+from calibration_model import KINDS
+from calibration_store import CalibrationStore
+from control_core import Busy, ControlCore, InstrumentTimeout, TaskAborted
+from controllers import CONTROLLERS, MAX_LASER_POWER
+from devices import SystemClock, open_bench
+from engine import Engine
+from result_store import ResultStore
+from scheduler import CommandScheduler
+from simulation import RESULTS_DIR, read_calibration_csv
+from stations import StationFileError, find_station, load_stations
+from sweep_planner import BANDWIDTH
+
+DEFAULT_HOST = "127.0.0.1"  # Local clients only
+DEFAULT_PORT = 8765
+TOPICS = ("power", "points", "log")
+SEND_BUFFER = 4096  # bytes queued per client outside the droppable power batches
+
+
+class CommandError(ValueError):
+    """A request that cannot be carried out; its message is the reply's error."""
+
+
+def _value(x):
+    # JSON has no NaN
+    x = float(x)
+    return None if math.isnan(x) else x
+
+
+def _number(params, key, default=None):
+    value = params.get(key, default)
+    if value is None:
+        raise CommandError(f"{key} is required")
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise CommandError(f"{key} must be a number")
+    return float(value)
+
+
+def _encode(message):
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+class Client:
+    """One connection: its subscriptions and what is waiting to be sent to it."""
+
+    def __init__(self, writer, max_batches, max_replies):
+        self.writer = writer
+        self.topics = set()
+        self.messages = deque()  # Replies and events, never dropped
+        self.batches = deque(maxlen=max_batches)  # Power samples, oldest dropped first
+        self.dropped = 0  # Samples dropped so far
+        self.task = None  # Serving the connection
+        self.max_replies = max_replies
+        self._wake = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+
+    def send(self, message):
+        self.messages.append(message)
+        if len(self.messages) >= self.max_replies:
+            self._room.clear()
+        self._wake.set()
+
+    def send_batch(self, batch):
+        if len(self.batches) == self.batches.maxlen:
+            self.dropped += len(self.batches[0]["t"])
+        self.batches.append(batch)
+        self._wake.set()
+
+    def close(self):
+        self.writer.close()
+        self._room.set()
+
+    async def room(self):
+        """Waits until the replies waiting for this client are below max_replies."""
+        await self._room.wait()
+
+    async def write_loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self.messages or self.batches:
+                if self.messages:
+                    message = self.messages.popleft()
+                    if len(self.messages) < self.max_replies:
+                        self._room.set()
+                else:
+                    message = dict(self.batches.popleft(), dropped=self.dropped)
+                self.writer.write(_encode(message))
+                await self.writer.drain()
+
+
+class ControlServer:
+    """Serves the commands above for one Engine on a ControlCore."""
+
+    def __init__(self, engine, core, publish_rate=20.0, max_batches=20, max_replies=256):
+        self.engine = engine
+        self.core = core
+        self.bench = engine.bench
+        self.stream = engine.stream
+        self.scheduler = engine.scheduler
+        self.publish_rate = publish_rate
+        self.max_batches = max_batches
+        self.max_replies = max_replies
+        self.clients = set()
+        # Last manual settings; unknown once a job has moved the instruments
+        self.wavelength = self.setting = self.emission = None
+        self.loop = None
+        self.server = None
+        self._publisher = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Starts listening (port 0 picks a free one, see .port) and publishing the power stream."""
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._connection, host, port)
+        self._publisher = asyncio.create_task(self._publish_power())
+        return self
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        self._publisher.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+        # Closing the connections ends their request loops
+        clients = list(self.clients)
+        for client in clients:
+            client.close()
+        await asyncio.gather(*(client.task for client in clients), return_exceptions=True)
+
+    async def _connection(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=SEND_BUFFER)
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        client = Client(writer, self.max_batches, self.max_replies)
+        client.task = asyncio.current_task()
+        self.clients.add(client)
+        writing = asyncio.create_task(client.write_loop())
+        try:
+            while True:
+                await client.room()
+                line = await reader.readline()
+                if not line:
+                    break
+                client.send(await self._handle(client, line))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writing.cancel()
+            writer.close()
+
+    async def _handle(self, client, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return {"ok": False, "error": f"Not JSON: {e}"}
+        if not isinstance(request, dict):
+            return {"ok": False, "error": "A request is a JSON object"}
+        request_id = request.pop("id", None)
+        command = request.pop("cmd", None)
+        reply = {} if request_id is None else {"id": request_id}
+        handler = getattr(self, f"_cmd_{command}", None) if isinstance(command, str) else None
+        try:
+            if handler is None:
+                raise CommandError(f"Unknown command {command}")
+            reply.update(ok=True, **(await handler(client, request)))
+        except (ValueError, TypeError, LookupError, OSError, Busy, InstrumentTimeout) as e:
+            reply.update(ok=False, error=str(e) or type(e).__name__)
+        return reply
+
+    def _publish(self, topic, message):
+        for client in self.clients:
+            if topic in client.topics:
+                client.send(message)
+
+    def _publisher_for(self, topic):
+        """Callback for the job thread that hands messages to the server loop."""
+        return lambda message: self.loop.call_soon_threadsafe(self._publish, topic, message)
+
+    async def _publish_power(self):
+        last = self.bench.time()
+        while True:
+            await asyncio.sleep(1.0 / self.publish_rate)
+            subscribers = [client for client in self.clients if "power" in client.topics]
+            times, values = self.stream.samples_since(last)
+            new = times > last
+            if not new.any():
+                continue
+            times, values = times[new], values[new]
+            last = float(times[-1])
+            if subscribers:
+                batch = {"event": "power", "t": times.tolist(), "uW": values.tolist()}
+                for client in subscribers:
+                    client.send_batch(batch)
+
+    def _idle(self):
+        if self.core.busy:
+            raise Busy(f"{self.core.job_name} is running")
+
+    async def _wait(self, function, *args):
+        # Blocking scheduler calls run off the server loop
+        return await self.loop.run_in_executor(None, function, *args)
+
+    # Commands; each returns the reply's fields
+
+    async def _cmd_ping(self, client, params):
+        return {"time": self.bench.time()}
+
+    async def _cmd_status(self, client, params):
+        current = self.engine.calibration.current
+        table = self.engine.table
+        stats = self.stream.stats(window_s=1.0)
+        return {
+            "job": self.core.job_name, "wavelength": self.wavelength, "setting": self.setting,
+            "emission": self.emission,
+            "calibration": None if current is None else {"version": current.number,
+                                                         "target_uW": current.target_uW,
+                                                         "points": len(current.rows)},
+            "table_targets_uW": None if table is None else table.targets.tolist(),
+            "power": {"mean_uW": _value(stats.mean), "std_uW": _value(stats.std),
+                      "drift_uW_per_s": _value(stats.drift_uW_per_s), "count": stats.count},
+            "clients": len(self.clients),
+        }
+
+    async def _cmd_set_wavelength(self, client, params):
+        self._idle()
+        wavelength = _number(params, "wavelength")
+        if not self.engine.min_wavelength <= wavelength <= self.engine.max_wavelength:
+            raise CommandError(f"wavelength must be within {self.engine.min_wavelength:g}-"
+                               f"{self.engine.max_wavelength:g} nm")
+        self.scheduler.move_filter(wavelength - BANDWIDTH / 2, wavelength + BANDWIDTH / 2)
+        await self._wait(self.scheduler.join, "filter", "meter")
+        self.wavelength = wavelength
+        return {"wavelength": wavelength}
+
+    async def _cmd_set_power(self, client, params):
+        self._idle()
+        if "setting" in params:
+            setting = _number(params, "setting")
+            if not self.engine.min_setting <= setting <= MAX_LASER_POWER:
+                raise CommandError(f"setting must be within {self.engine.min_setting:g}-{MAX_LASER_POWER:g} %")
+            power_uW = None
+        else:
+            power_uW = _number(params, "power_uW")
+            if self.wavelength is None:
+                raise CommandError("set_wavelength first")
+            current = self.engine.calibration.current
+            if self.engine.table is not None:
+                model = self.engine.model(power_uW)
+            elif current is not None and math.isclose(power_uW, current.target_uW, rel_tol=0.01):
+                model = self.engine.model()
+            else:
+                raise CommandError("power_uW needs a multi-target calibration, or a calibration for "
+                                   "that power; send a setting instead")
+            setting = float(model.settings_for(self.wavelength))
+        await asyncio.wrap_future(self.scheduler.set_power(setting))
+        self.setting = setting
+        return {"setting": setting, "power_uW": power_uW}
+
+    async def _cmd_emission(self, client, params):
+        self._idle()
+        on = params.get("on")
+        if not isinstance(on, bool):
+            raise CommandError("on must be true or false")
+        await self._wait(self.scheduler.set_emission, on)
+        self.emission = on
+        return {"emission": on}
+
+    async def _cmd_abort(self, client, params):
+        job = self.core.job_name
+        await asyncio.wrap_future(self.core.abort())
+        self.emission = False
+        return {"aborted": job}
+
+    async def _cmd_subscribe(self, client, params):
+        client.topics |= self._topics(params)
+        return {"topics": sorted(client.topics)}
+
+    async def _cmd_unsubscribe(self, client, params):
+        client.topics -= self._topics(params)
+        return {"topics": sorted(client.topics)}
+
+    def _topics(self, params):
+        topics = params.get("topics", list(TOPICS))
+        topics = [topics] if isinstance(topics, str) else topics
+        if not isinstance(topics, list) or not set(topics) <= set(TOPICS):
+            raise CommandError(f"topics must be a list of {', '.join(TOPICS)}")
+        return set(topics)
+
+    def _job_parameters(self, kind, params):
+        # The same parameters as a batch.py job of the kind
+        defaults = JOB_PARAMETERS[kind]
+        unknown = sorted(set(params) - set(defaults))
+        if unknown:
+            raise CommandError(f"Unknown parameters {', '.join(unknown)}")
+        missing = [name for name, default in defaults.items() if default is None and name not in params]
+        if missing:
+            raise CommandError(f"Missing {', '.join(missing)}")
+        parameters = {**defaults, **params}
+        check_job(kind, parameters)
+        return parameters
+
+    def _job_files(self, p):
+        """Calibration rows and TargetTable a job names (None if not), read but not loaded yet."""
+        rows = table = None
+        if p.get("calibration"):
+            rows = read_calibration_csv(p["calibration"])
+            if not rows:
+                raise CommandError(f"{p['calibration']} holds no calibration rows")
+        if p.get("table"):
+            table = self.engine.read_table(p["table"])
+        return rows, table
+
+    def _load(self, rows, table):
+        # Only once the job is accepted, on the core's thread like the job itself
+        if rows is not None:
+            self.engine.load_calibration(rows)
+        if table is not None:
+            self.engine.table = table
+
+    def _callbacks(self):
+        points, log = self._publisher_for("points"), self._publisher_for("log")
+
+        def on_point(process, wavelength, setting, power):
+            points({"event": "point", "process": process, "wavelength": _value(wavelength),
+                    "setting": _value(setting), "power_uW": None if power is None else _value(power)})
+
+        def on_status(text):
+            log({"event": "log", "text": text})
+
+        return on_point, on_status
+
+    def _start_job(self, client, name, routine):
+        job = self.core.start(name, routine)
+        self.wavelength = self.setting = self.emission = None
+        self.loop.create_task(self._watch_job(client, name, job))
+        return {"job": name}
+
+    async def _watch_job(self, client, name, job):
+        message = {"event": "job", "job": name}
+        try:
+            message.update(state="done", result=await asyncio.wrap_future(job))
+        except (asyncio.CancelledError, TaskAborted):
+            message.update(state="aborted")
+        except Exception as e:
+            message.update(state="failed", error=str(e) or type(e).__name__)
+        if client in self.clients and "log" not in client.topics:
+            client.send(message)
+        self._publish("log", message)
+
+    async def _cmd_calibrate(self, client, params):
+        self._idle()
+        p = self._job_parameters("calibration", params)
+        targets = p["target_uW"] if isinstance(p["target_uW"], list) else [p["target_uW"]]
+        if not targets or any(isinstance(t, bool) or not isinstance(t, (int, float)) or t <= 0 for t in targets):
+            raise CommandError("target_uW must be a positive number or a list of them")
+        if p["multi_target"] != (len(targets) > 1):
+            raise CommandError("Several target powers go with multi_target, and multi_target needs several")
+        self.engine.check_range(p["start"], p["start"] + p["step"] * p["steps"])
+        on_point, on_status = self._callbacks()
+        engine = self.engine
+
+        def calibrate():
+            if p["multi_target"]:
+                table = engine.calibrate_targets(targets, start_wl=p["start"], step=p["step"], steps=p["steps"],
+                                                 tolerance=p["tolerance"], max_iterations=p["max_iterations"],
+                                                 on_point=on_point, on_status=on_status)
+                return {"targets_uW": table.targets.tolist(), "wavelengths": len(table)}
+            version = engine.calibrate(float(targets[0]), start_wl=p["start"], step=p["step"], steps=p["steps"],
+                                       sampling=p["sampling"], tolerance=p["tolerance"],
+                                       max_iterations=p["max_iterations"], on_point=on_point, on_status=on_status)
+            return {"version": version.number, "points": len(version.rows)}
+
+        return self._start_job(client, "Multi-target calibration" if p["multi_target"] else "Calibration",
+                               calibrate)
+
+    async def _cmd_recalibrate(self, client, params):
+        self._idle()
+        p = self._job_parameters("recalibration", params)
+        rows, _ = self._job_files(p)
+        if rows is None and self.engine.calibration.current is None:
+            raise CommandError("Perform calibration first!")
+        on_point, on_status = self._callbacks()
+
+        def recalibrate():
+            self._load(rows, None)
+            version = self.engine.recalibrate(tolerance=p["tolerance"], on_point=on_point, on_status=on_status)
+            return {"version": version.number, "points": len(version.rows)}
+
+        return self._start_job(client, "Recalibration", recalibrate)
+
+    async def _cmd_run_sweep(self, client, params):
+        self._idle()
+        p = self._job_parameters("measurement", params)
+        rows, table = self._job_files(p)
+        plan = self.engine.plan(p["start"], p["end"], p["step"], p["on_time"], p["off_time"],
+                                target_uW=p["target_uW"] or None, rows=rows, table=table)
+        if not plan.valid:
+            raise CommandError(plan.summary())
+        on_point, on_status = self._callbacks()
+        engine = self.engine
+
+        def measure():
+            self._load(rows, table)
+            results = engine.measure(plan, on_point=on_point, hold_mode=p["hold"], rate_hz=p["rate_hz"],
+                                     deadband_uW=p["deadband_uW"], max_rate=p["max_rate"],
+                                     compensate_drift=p["compensate_drift"])
+            steps = engine.step_stats
+            return {"rows": [[_value(value) for value in row] for row in results],
+                    "rms_error_uW": _value(sum(s.rms_error_uW for s in steps) / len(steps)) if steps else None}
+
+        reply = self._start_job(client, "Measurement", measure)
+        reply.update(steps=len(plan.wavelengths), warnings=list(plan.warnings))
+        return reply
+
+
+class ControlClient:
+    """Blocking client for scripts: call() returns the reply, events are kept in .events."""
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10.0, receive_buffer=None):
+        family, kind, protocol, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        self._socket = socket.socket(family, kind, protocol)
+        if receive_buffer is not None:
+            # bytes; small keeps a slow reader's power samples recent, the server dropping the oldest.
+            # Set before connecting, as the TCP window is agreed then
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        self._reader = self._socket.makefile("rb")
+        self._next_id = 0
+        self._replies = {}
+        self.events = deque()
+
+    def send(self, cmd, **params):
+        """Sends a request without waiting; returns its id for reply()."""
+        self._next_id += 1
+        self._socket.sendall(_encode({"id": self._next_id, "cmd": cmd, **params}))
+        return self._next_id
+
+    def receive(self):
+        """The next message from the server."""
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)
+
+    def reply(self, request_id):
+        """Waits for the reply to request_id; raises CommandError for an error reply."""
+        while request_id not in self._replies:
+            message = self.receive()
+            if "event" in message:
+                self.events.append(message)
+            else:
+                self._replies[message.get("id")] = message
+        message = self._replies.pop(request_id)
+        if not message.get("ok"):
+            raise CommandError(message.get("error"))
+        return message
+
+    def call(self, cmd, **params):
+        return self.reply(self.send(cmd, **params))
+
+    def event(self, name=None):
+        """The next event (named name, if given); earlier ones of other names stay queued."""
+        for message in list(self.events):
+            if name is None or message["event"] == name:
+                self.events.remove(message)
+                return message
+        while True:
+            message = self.receive()
+            if "event" not in message:
+                self._replies[message.get("id")] = message
+            elif name is None or message["event"] == name:
+                return message
+            else:
+                self.events.append(message)
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_server(simulate=None, station=None, speed=1.0, controller_name="proportional", interpolation="linear",
+                **server_options):
+    """Opens the bench and builds its Engine and ControlServer, as main.py builds the GUI's.
+
+    A simulated bench gets a wall clock (speed times real time) so the power
+    stream runs between jobs. Returns (server, close).
+    """
+    if station is not None:
+        if station.speed is None:
+            station.speed = speed
+        bench = station.open_bench(simulate)
+    else:
+        bench = open_bench(simulate, clock=SystemClock(speed))
+    core = ControlCore(bench)
+    stream = PowerStream(bench, threaded=True).start()
+    scheduler = CommandScheduler(bench)
+    session = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    store = ResultStore(f"results/{station.name}/{session}" if station is not None else f"results/{session}",
+                        clock=bench.clock)
+    if station is not None:
+        calibration_store = station.calibration_store()
+    else:
+        calibration_store = CalibrationStore().load_directory(RESULTS_DIR).load_directory(".")
+    options = dict(stream=stream, scheduler=scheduler, calibration_store=calibration_store, store=store)
+    if station is not None:
+        engine = station.engine(bench, controller_name, interpolation, **options)
+    else:
+        engine = Engine(bench, controller_name, interpolation, **options)
+
+    def close():
+        core.close()  # Aborts a running job and switches emission off
+        stream.stop()
+        scheduler.close()
+        engine.close()
+        store.close()
+        bench.close()
+
+    return ControlServer(engine, core, **server_options), close
+
+
+async def serve(server, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    await server.start(host, port)
+    print(f"Listening on {host}:{server.port}", flush=True)
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the bench to local clients over TCP")
+    parser.add_argument("--simulate", action="store_true", default=None,
+                        help="run against the simulated laser, filter and power meter")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated time per wall-clock second")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--controller", choices=sorted(CONTROLLERS), default="proportional",
+                        help="feedback strategy used during calibration")
+    parser.add_argument("--interpolation", choices=KINDS, default="linear",
+                        help="curve used to turn the calibration into measurement settings")
+    parser.add_argument("--stations", help="JSON stations file describing the rigs (see stations.py)")
+    parser.add_argument("--station", help="name of the rig in the stations file to serve")
+    args = parser.parse_args()
+    station = None
+    if args.stations or args.station:
+        if not (args.stations and args.station):
+            parser.error("--stations and --station go together")
+        try:
+            station = find_station(load_stations(args.stations), args.station)
+        except StationFileError as e:
+            parser.error(str(e))
+    control_server, close = open_server(args.simulate, station, args.speed, args.controller, args.interpolation)
+    try:
+        asyncio.run(serve(control_server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close()
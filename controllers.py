@@ -0,0 +1,140 @@
+"""Feedback controllers that pick the next laser setting from a power reading.
+
+ProportionalController is the original update (setting *= target / power), which
+assumes power is proportional to the setting. ModelController fits a local
+power law power ~ setting ** elasticity instead: the elasticity comes from a
+secant through the last two readings at the current wavelength (in log-log
+space) and is learned along the way and reused at every wavelength, so a single
+reading after a filter move is usually enough for a good step.
+
+Both clamp to the laser's range, so a target out of reach shows as the
+controller asking for the setting it is already pinned at. converge() stops
+right there instead of spending its remaining iterations, and out_of_reach()
+tells such a point ("Saturated" at 100 %, "Floor" at the minimum setting)
+from a converged one.
+"""
+
+import math
+
+from instrumentation import span
+
+MIN_LASER_POWER = 10.0  # Minimum allowed laser power setting (%)
+MAX_LASER_POWER = 100.0
+
+
+class ProportionalController:
+    """setting *= target / power, clamped to the allowed range."""
+
+    name = "proportional"
+
+    def __init__(self, min_setting=MIN_LASER_POWER, max_setting=MAX_LASER_POWER):
+        self.min_setting = min_setting
+        self.max_setting = max_setting
+
+    def clamp(self, setting):
+        return max(self.min_setting, min(self.max_setting, setting))
+
+    def start_step(self, wavelength):
+        pass
+
+    def next_setting(self, setting, power_uW, target_uW):
+        if power_uW <= 0:
+            # No light at all (e.g. below the lasing threshold): step up instead of dividing by zero
+            return self.clamp(2 * setting)
+        return self.clamp(setting * target_uW / power_uW)
+
+
+class ModelController(ProportionalController):
+    """Secant steps on a locally fitted power-law setting->power model."""
+
+    name = "model"
+
+    def __init__(self, min_setting=MIN_LASER_POWER, max_setting=MAX_LASER_POWER,
+                 elasticity=1.0, smoothing=0.5, min_secant_step=0.05):
+        super().__init__(min_setting, max_setting)
+        # d ln(power) / d ln(setting), shared by all wavelengths; 1.0 is the proportional update
+        self.elasticity = elasticity
+        self.smoothing = smoothing
+        self.min_secant_step = min_secant_step
+        self._last = None
+
+    def start_step(self, wavelength):
+        # Readings at the previous wavelength cannot form a secant with this one's
+        self._last = None
+
+    def secant_elasticity(self, setting, power_uW):
+        if self._last is None:
+            return None
+        last_setting, last_power = self._last
+        if last_power <= 0 or abs(math.log(setting / last_setting)) < self.min_secant_step:
+            return None
+        elasticity = math.log(power_uW / last_power) / math.log(setting / last_setting)
+        # A short secant amplifies noise; only trust it when it is physically plausible
+        if not 0.5 * self.elasticity <= elasticity <= 2.0 * self.elasticity:
+            return None
+        return elasticity
+
+    def next_setting(self, setting, power_uW, target_uW):
+        if power_uW <= 0:
+            self._last = None
+            return super().next_setting(setting, power_uW, target_uW)
+
+        elasticity = self.secant_elasticity(setting, power_uW)
+        if elasticity is not None:
+            self.elasticity += self.smoothing * (elasticity - self.elasticity)
+        else:
+            elasticity = self.elasticity
+        self._last = (setting, power_uW)
+        return self.clamp(setting * (target_uW / power_uW) ** (1.0 / elasticity))
+
+
+CONTROLLERS = {
+    ProportionalController.name: ProportionalController,
+    ModelController.name: ModelController,
+}
+
+
+def make_controller(name, **kwargs):
+    if name not in CONTROLLERS:
+        raise ValueError(f"Unknown controller '{name}', choose from {', '.join(CONTROLLERS)}")
+    return CONTROLLERS[name](**kwargs)
+
+
+def out_of_reach(controller, setting, power_uW, target_uW, tolerance):
+    """"Saturated" or "Floor" when setting is pinned at a limit short of the target, else None."""
+    if setting >= controller.max_setting and power_uW < target_uW - tolerance:
+        return "Saturated"
+    if setting <= controller.min_setting and power_uW > target_uW + tolerance:
+        return "Floor"
+    return None
+
+
+def converge(bench, controller, settler, target_uW, tolerance, max_iterations,
+             setting, power_uW, settle_time=0.5, on_reading=None):
+    """Adjusts the laser until the power is within tolerance of the target.
+
+    power_uW is the settled reading at the current setting. Returns the final
+    (setting, power_uW, iterations), where iterations counts laser adjustments.
+    Stops early once the setting is pinned at a limit and the controller asks
+    for more of the same (see out_of_reach()). on_reading(setting, power_uW,
+    iteration) is called for the given reading (iteration 0) and after every
+    adjustment.
+    """
+    iterations = 0
+    if on_reading is not None:
+        on_reading(setting, power_uW, iterations)
+    while iterations < max_iterations:
+        if abs(power_uW - target_uW) <= tolerance:
+            break
+        next_setting = controller.next_setting(setting, power_uW, target_uW)
+        # Already at the limit the controller clamps to: another reading there cannot get closer
+        if next_setting == setting and out_of_reach(controller, setting, power_uW, target_uW, tolerance):
+            break
+        with span("feedback iteration"):
+            setting = next_setting
+            bench.laser.set_power(setting)
+            power_uW = settler.wait(max_wait=settle_time).power_uW
+        iterations += 1
+        if on_reading is not None:
+            on_reading(setting, power_uW, iterations)
+    return setting, power_uW, iterations
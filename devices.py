@@ -0,0 +1,213 @@
+"""Device layer shared by every entry point.
+
+A Bench bundles the power meter, the laser, the filter and the clock the control
+loops should sleep on. The real bench talks to the PM100D over VISA and to the
+SuperK Extreme/Varia through nkt_tools; the simulated bench (see simulation.py)
+exposes the same attributes so the loops run unchanged without hardware.
+
+BenchConnector opens the bench in a background thread instead, so a window can
+come up before any driver is imported. Each instrument is opened on its own and
+the missing ones are retried until all three answer.
+
+A rig other than the default one is picked by the power meter's VISA address
+and the serial ports of the laser and the filter (see stations.py).
+"""
+import os
+import threading
+import time
+
+# Default VISA address of the Thorlabs PM100D on the optical bench
+PM100D_RESOURCE = 'USB0::0x1313::0x8078::P0017991::INSTR'
+
+# Set LASER_SIMULATE=1 to make every entry point use the simulated bench
+SIMULATE_ENV = "LASER_SIMULATE"
+
+
+class SystemClock:
+    """Wall clock used with real hardware; speed > 1 runs a simulated bench faster than real time."""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+
+    def time(self):
+        return time.monotonic() * self.speed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speed)
+
+
+class Bench:
+    """Power meter, laser and filter plus the clock the control loops use."""
+
+    def __init__(self, power_meter, laser, filter, clock=None, on_close=None, simulated=False):
+        self.power_meter = power_meter
+        self.laser = laser
+        self.filter = filter
+        self.clock = clock if clock is not None else SystemClock()
+        self.simulated = simulated
+        self._on_close = on_close
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    def set_passband(self, short, long):
+        """Moves the filter and points the meter's wavelength correction at the new centre."""
+        self.filter.short_setpoint = short
+        self.filter.long_setpoint = long
+        set_wavelength = getattr(self.power_meter, "set_wavelength", None)
+        if set_wavelength is not None:
+            set_wavelength((short + long) / 2)
+
+    def time(self):
+        return self.clock.time()
+
+    def close(self):
+        if self._on_close is not None:
+            on_close, self._on_close = self._on_close, None
+            on_close()
+
+
+# Driver imports stay local so the simulated bench works without them installed
+def open_power_meter(resource=PM100D_RESOURCE):
+    """Connects to the PM100D; returns (power_meter, close)."""
+    import pyvisa
+    from ThorlabsPM100 import ThorlabsPM100
+
+    from pm100d import PowerMeter
+
+    rm = pyvisa.ResourceManager()
+    try:
+        inst = rm.open_resource(resource)
+        # Start from a known state: single samples, auto range
+        power_meter = PowerMeter(ThorlabsPM100(inst=inst)).configure(average_count=1, auto_range=True)
+    except Exception:
+        rm.close()
+        raise
+
+    def close():
+        inst.close()
+        rm.close()
+
+    return power_meter, close
+
+
+# port=None lets nkt_tools find the instrument, which only works with one rig per computer
+def open_laser(port=None):
+    from nkt_tools.extreme import Extreme
+    return Extreme() if port is None else Extreme(port)
+
+
+def open_filter(port=None):
+    from nkt_tools.varia import Varia
+    return Varia() if port is None else Varia(port)
+
+
+def open_hardware(resource=PM100D_RESOURCE, laser_port=None, filter_port=None):
+    """Connects to the PM100D, SuperK Extreme and SuperK Varia."""
+    power_meter, close = open_power_meter(resource)
+    try:
+        laser = open_laser(laser_port)
+        filter = open_filter(filter_port)
+    except Exception:
+        close()
+        raise
+    return Bench(power_meter, laser, filter, on_close=close)
+
+
+DEVICE_NAMES = {"power_meter": "power meter", "laser": "laser", "filter": "filter"}
+
+
+class BenchConnector:
+    """Opens the bench in the background, retrying every instrument that does not answer yet."""
+
+    def __init__(self, simulate=None, resource=PM100D_RESOURCE, retry_interval=2.0, laser_port=None,
+                 filter_port=None, **sim_options):
+        self.simulate = simulation_requested() if simulate is None else simulate
+        self.resource = resource
+        self.laser_port = laser_port
+        self.filter_port = filter_port
+        self.retry_interval = retry_interval
+        self.sim_options = sim_options
+        self.bench = None
+        self.attempts = 0
+        self.errors = {}  # Device -> last error, only for devices still missing
+        self._devices = {}
+        self._close = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def connected(self):
+        return self.bench is not None
+
+    def _open(self, name):
+        if name == "power_meter":
+            power_meter, self._close = open_power_meter(self.resource)
+            return power_meter
+        return open_laser(self.laser_port) if name == "laser" else open_filter(self.filter_port)
+
+    def _run(self):
+        if self.simulate:
+            from simulation import simulated_bench
+            self.bench = simulated_bench(**self.sim_options)
+            return
+        while not self._stop.is_set():
+            self.attempts += 1
+            for name in DEVICE_NAMES:
+                if name in self._devices:
+                    continue
+                try:
+                    self._devices[name] = self._open(name)
+                    self.errors.pop(name, None)
+                except Exception as e:
+                    self.errors[name] = str(e) or type(e).__name__
+            if len(self._devices) == len(DEVICE_NAMES):
+                self.bench = Bench(self._devices["power_meter"], self._devices["laser"],
+                                   self._devices["filter"], on_close=self._close)
+                return
+            self._stop.wait(self.retry_interval)
+
+    def status(self):
+        """One line for a status indicator."""
+        if self.connected:
+            return "Devices: simulated" if self.simulate else "Devices: connected"
+        if self.simulate or not self.attempts:
+            return "Devices: connecting..."
+        missing = "; ".join(f"{DEVICE_NAMES[name]}: {error}" for name, error in self.errors.items())
+        return f"Devices: retrying (attempt {self.attempts}) - {missing}"
+
+    def wait(self, timeout=None):
+        """Blocks until the bench is open (or timeout); returns it or None."""
+        self._thread.join(timeout)
+        return self.bench
+
+    def stop(self):
+        """Stops retrying and closes a power meter opened without the rest of the bench."""
+        self._stop.set()
+        if self.bench is None and self._close is not None:
+            close, self._close = self._close, None
+            close()
+
+
+def simulation_requested():
+    return os.environ.get(SIMULATE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def open_bench(simulate=None, resource=PM100D_RESOURCE, laser_port=None, filter_port=None, **sim_options):
+    """Opens the real bench, or the simulated one when requested.
+
+    With simulate=None the LASER_SIMULATE environment variable decides.
+    Extra keyword arguments are passed to simulation.simulated_bench.
+    """
+    if simulate is None:
+        simulate = simulation_requested()
+    if simulate:
+        from simulation import simulated_bench
+        return simulated_bench(**sim_options)
+    return open_hardware(resource, laser_port, filter_port)
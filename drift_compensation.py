@@ -0,0 +1,177 @@
+"""Online drift compensation: a slowly varying gain fitted from measurement ON phases.
+
+A calibration says which setting gave target_uW at each wavelength back then.
+Hours later the same setting gives gain * target_uW, with gain drifting slowly
+(source ageing, temperature, fibre coupling). Every ON phase of a measurement
+is a reference read for free: the power at the end of the phase, at a known
+setting, against what the calibration promised. A short ON phase ends while
+the emission is still ramping up; steady_power() then extrapolates the
+first-order approach in the phase's tail to where it is heading, as long as
+most of the ramp is behind it. DriftEstimator fits
+
+    log(gain) = a + b * x + c * hours
+
+to those reads, x being the wavelength scaled to [-1, 1] over the filter
+range and hours the time since the latest read. Reads are weighted by
+exp(-age / time_constant), so the fit follows the drift as it goes; the trend
+c keeps the estimate from lagging behind a steady drift, across the gaps
+between sweeps as well. b and c start out pinned to zero by a weak prior and
+only move once the reads support them: a sweep over a few nanometres yields a
+plain gain, a wide sweep a tilt across the spectrum if there is one.
+
+The correction assumes the power follows the setting proportionally near the
+operating point, like the proportional controller: the setting for a
+wavelength becomes the calibrated setting / gain. Every update is kept as a
+DriftPoint, so a session's drift trajectory can be exported and looked at.
+"""
+import csv
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from acquisition import window_stats
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER
+from stabilization import trend_significant
+
+# gain: fitted gain at the centre of the range; tilt: fractional gain change per 100 nm;
+# trend: fractional gain change per hour; observed: the gain of this read alone
+DriftPoint = namedtuple("DriftPoint", "time wavelength observed gain tilt trend reads")
+DRIFT_HEADER = ["Time (s)", "Wavelength (nm)", "Observed Gain", "Gain", "Tilt (per 100 nm)",
+                "Trend (per hour)", "Reads"]
+
+CENTER_WAVELENGTH = 620.0
+HALF_RANGE = 220.0  # nm, 400-840 nm maps onto [-1, 1]
+MAX_EXTRAPOLATION = 0.25  # Of the steady power still to come at the end of the tail
+
+
+def steady_power(times, values, max_extrapolation=MAX_EXTRAPOLATION):
+    """Power the tail of an ON phase settles at, or None when it cannot tell.
+
+    A tail without a significant trend (against its own noise) is steady: its
+    mean. A rising or falling one is taken as a first-order approach: the
+    means of its three thirds give the ratio r of successive steps, and the
+    level is extrapolated from them (Aitken's delta-squared). Tails that do not
+    look like such an approach, or still have more than max_extrapolation of
+    the level to go, give None.
+    """
+    stats = window_stats(times, values)
+    if stats.count < 9 or stats.span <= 0:
+        return None
+    if not trend_significant(stats):
+        return stats.mean
+    thirds = np.minimum(((times - times[0]) / stats.span * 3).astype(int), 2)
+    counts = np.bincount(thirds, minlength=3)
+    if counts.min() < 3:
+        return None
+    first, second, third = np.bincount(thirds, weights=values, minlength=3) / counts
+    if second == first:
+        return None
+    ratio = (third - second) / (second - first)
+    if not 0 < ratio < 1:
+        return None
+    level = third + (third - second) * ratio / (1 - ratio)
+    if level <= 0 or abs(level - values[-1]) > max_extrapolation * level:
+        return None
+    return float(level)
+
+
+class DriftEstimator:
+    """Gain of the laser against its calibration, fitted online from reference reads."""
+
+    def __init__(self, time_constant=1800.0, wavelength_dependent=True, tilt_prior=1.0,
+                 trend_prior=0.1, min_setting=MIN_LASER_POWER, max_setting=MAX_LASER_POWER):
+        self.time_constant = time_constant  # s
+        self.wavelength_dependent = wavelength_dependent
+        # Weight of the zero priors, in reads: a small prior on the offset keeps the fit defined
+        self.prior = np.diag([1e-6, tilt_prior, trend_prior])
+        self.min_setting = min_setting
+        self.max_setting = max_setting
+        self.reset()
+
+    def reset(self, key=None):
+        """Forgets every read, e.g. for a new calibration; key names what the reads refer to."""
+        self.key = key
+        self.trajectory = []
+        self._information = np.zeros((3, 3))  # Decayed sum of w * phi phi^T
+        self._moments = np.zeros(3)  # Decayed sum of w * phi * log(gain)
+        self._theta = np.zeros(3)
+        self._time = None  # Reference time of the sums: the latest read
+        self._reads = 0
+
+    def _features(self, wavelengths, time):
+        x = (np.asarray(wavelengths, dtype=float) - CENTER_WAVELENGTH) / HALF_RANGE
+        if not self.wavelength_dependent:
+            x = np.zeros_like(x)
+        # Extrapolating the trend beyond one time constant is guesswork; hold it there
+        hours = 0.0 if self._time is None else min(time - self._time, self.time_constant) / 3600.0
+        return x, hours
+
+    def observe(self, time, wavelength, setting, power_uW, calibrated_setting, target_uW):
+        """Adds one reference read: power_uW at setting where the calibration had target_uW.
+
+        Reads whose calibrated setting sits at a limit say nothing about the
+        gain (the calibration never reached target_uW there) and are skipped,
+        as are non-positive powers. Returns the DriftPoint, or None.
+        """
+        if (target_uW is None or power_uW is None or not power_uW > 0 or not setting > 0
+                or not self.min_setting < calibrated_setting < self.max_setting):
+            return None
+        observed = (power_uW / target_uW) * (calibrated_setting / setting)
+        if self._time is not None:
+            elapsed = time - self._time
+            # Move the sums' time origin to this read, then let the old reads fade
+            shift = np.eye(3)
+            shift[2, 0] = -elapsed / 3600.0
+            self._information = shift @ self._information @ shift.T
+            self._moments = shift @ self._moments
+            decay = math.exp(-max(0.0, elapsed) / self.time_constant)
+            self._information *= decay
+            self._moments *= decay
+        self._time = time
+        x, _ = self._features(wavelength, time)
+        phi = np.array([1.0, float(x), 0.0])
+        self._information += np.outer(phi, phi)
+        self._moments += phi * math.log(observed)
+        self._theta = np.linalg.solve(self._information + self.prior, self._moments)
+        self._reads += 1
+        offset, tilt, trend = self._theta
+        point = DriftPoint(time, float(wavelength), observed, math.exp(offset),
+                           math.expm1(tilt * 100.0 / HALF_RANGE), math.expm1(trend), self._reads)
+        self.trajectory.append(point)
+        return point
+
+    @property
+    def reads(self):
+        return self._reads
+
+    def gain(self, wavelengths, time):
+        """Fitted gain at wavelengths and bench time."""
+        x, hours = self._features(wavelengths, time)
+        offset, tilt, trend = self._theta
+        return np.exp(offset + tilt * x + trend * hours)
+
+    def correct(self, wavelengths, settings, time):
+        """Calibrated settings adjusted for the drift, clipped to the laser's range.
+
+        Settings pinned at a limit stay where they are.
+        """
+        settings = np.asarray(settings, dtype=float)
+        corrected = np.clip(settings / self.gain(wavelengths, time), self.min_setting, self.max_setting)
+        pinned = (settings <= self.min_setting) | (settings >= self.max_setting)
+        return np.where(pinned, settings, corrected)
+
+    def summary(self, time):
+        if not self._reads:
+            return "No drift reference reads yet"
+        gain = float(self.gain(CENTER_WAVELENGTH, time))
+        point = self.trajectory[-1]
+        return (f"Drift: gain {gain:.3f} at {CENTER_WAVELENGTH:.0f} nm, {point.tilt:+.1%} per 100 nm, "
+                f"{point.trend:+.1%} per hour ({self._reads} reads)")
+
+    def to_csv(self, path):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(DRIFT_HEADER)
+            for point in self.trajectory:
+                writer.writerow([f"{value:.6g}" if isinstance(value, float) else value for value in point])
@@ -0,0 +1,542 @@
+"""Calibration, recalibration and measurement routines without any GUI.
+
+The Engine owns the calibration history and runs the routines main.py used to
+keep as closures inside its window: it talks to the bench only, takes every
+parameter as an argument and reports progress through optional callbacks
+(on_point for each logged row, on_status for status lines, on_phase for the
+ON/OFF phases of a measurement). main.py drives it from Tk, batch.py from a
+job file; neither tkinter nor matplotlib is imported here.
+
+With a ResultStore attached, every sample is streamed to disk as it is taken:
+each feedback reading ("Feedback", with its iteration), each logged point
+(under its process name) and every power reading of a measurement's ON phases
+("On"), all with the target power they belong to.
+
+Every routine is one instrumentation run (see instrumentation.py): instrument
+calls, sleeps, settling, feedback iterations, dwell and logging are timed on
+the bench clock. The Timings of the last routine are kept as engine.timings
+and, with a store, written next to it as timings_<n>_<routine>.json.
+
+A measurement holds each ON phase open loop (the planned setting, left alone)
+or closed loop (stabilization.PowerHold corrects the setting from the power
+stream). Either way every step gets its StepStats, kept as engine.step_stats
+and, with a store, written as steps_<n>_measurement.csv.
+
+The end of every ON phase doubles as a reference read for engine.drift, a
+DriftEstimator (drift_compensation.py) of how far the laser has drifted from
+the current calibration. With compensate_drift the settings of a measurement
+are corrected by it step by step as they are issued. Its trajectory is
+written as drift_<n>_measurement.csv; a new calibration starts it afresh.
+"""
+import functools
+import os
+
+from acquisition import PowerStream
+from adaptive_sampling import adaptive_calibration
+from calibration_model import CalibrationModel, TargetTable, describe_reach
+from calibration_store import CalibrationRun, CalibrationStore, WarmStart
+from controllers import MAX_LASER_POWER, MIN_LASER_POWER, converge, make_controller, out_of_reach
+from drift_compensation import DriftEstimator, steady_power
+from instrumentation import finish_run, instrument_bench, span, start_run
+from recalibration import VersionedCalibration, bind_wavelength, incremental_recalibration
+from scheduler import CommandScheduler
+from settling import SettlingDetector
+from simulation import RESULTS_DIR
+from stabilization import PowerHold, step_stats, write_step_stats
+from sweep_planner import BANDWIDTH, MAX_WAVELENGTH, MIN_WAVELENGTH, execute_plan, plan_measurement
+
+CALIBRATION_HEADER = ["Wavelength (nm)", "Laser Setting (%)", "Measured Power (µW)"]
+
+# Longest a meter read may average for during a calibration (s): the settling
+# detector polls several reads within every 0.5 s settle time
+AVERAGING_READ_TIME = 0.025
+# Longest extra settle (s) before storing a reading pinned at a setting limit that had not settled: the
+# laser may just have jumped between far-apart settings
+PINNED_SETTLE_TIME = 2.0
+
+
+def timed(name):
+    """Runs an Engine routine as one instrumentation run named name."""
+    def decorate(routine):
+        @functools.wraps(routine)
+        def wrapper(self, *args, **kwargs):
+            start_run(name, self.bench.time, self.bench.clock.scope)
+            try:
+                return routine(self, *args, **kwargs)
+            finally:
+                self._keep_timings(finish_run())
+        return wrapper
+    return decorate
+
+
+class Engine:
+    """Calibration history plus the routines that produce and use it."""
+
+    def __init__(self, bench, controller_name="proportional", interpolation="linear",
+                 min_setting=MIN_LASER_POWER, min_wavelength=MIN_WAVELENGTH,
+                 max_wavelength=MAX_WAVELENGTH, stream=None, scheduler=None, calibration_store=None,
+                 store=None):
+        # Every instrument call and sleep is timed while a routine runs
+        self.bench = instrument_bench(bench)
+        self.controller_name = controller_name
+        self.interpolation = interpolation
+        self.min_setting = min_setting
+        self.min_wavelength = min_wavelength
+        self.max_wavelength = max_wavelength
+        self.calibration = VersionedCalibration()
+        if calibration_store is None:
+            calibration_store = CalibrationStore().load_directory(RESULTS_DIR)
+        self.calibration_store = calibration_store
+        # Stream and scheduler are shared with the caller when given, otherwise owned here
+        self._own_stream = stream is None
+        self.stream = stream if stream is not None else PowerStream(bench).start()
+        self._own_scheduler = scheduler is None
+        self.scheduler = scheduler if scheduler is not None else CommandScheduler(bench)
+        self.table = None  # TargetTable of the last multi-target calibration
+        self.store = store  # ResultStore receiving every sample, optional
+        self.timings = None  # instrumentation.Timings of the last routine
+        self.step_stats = []  # stabilization.StepStats of the last measurement
+        self.drift = DriftEstimator(min_setting=min_setting)  # Against the current calibration
+        self._timed_runs = 0
+        self._models = {}
+
+    @property
+    def rows(self):
+        """Rows of the current calibration version."""
+        current = self.calibration.current
+        return list(current.rows) if current is not None else []
+
+    def load_calibration(self, rows, target_uW=None):
+        """Makes previously exported rows the current calibration; returns the new version."""
+        rows = list(rows)
+        if not rows:
+            raise ValueError("No calibration data available")
+        if target_uW is None:
+            target_uW = CalibrationRun(rows).target_uW
+        return self.calibration.commit(rows, target_uW)
+
+    def read_table(self, path):
+        """Reads a multi-target table exported by TargetTable.to_csv, without making it current."""
+        return TargetTable.from_csv(path, kind=self.interpolation, min_setting=self.min_setting)
+
+    def load_table(self, path):
+        """Makes a multi-target table exported by TargetTable.to_csv the current table."""
+        self.table = self.read_table(path)
+        return self.table
+
+    def model(self, target_uW=None):
+        """CalibrationModel of the current version, or for target_uW from the multi-target table."""
+        if target_uW is not None:
+            if self.table is None:
+                raise ValueError("No multi-target calibration available")
+            return self.table.model(target_uW)
+        current = self.calibration.current
+        if current is None:
+            raise ValueError("No calibration data available")
+        key = (current.number, self.interpolation)
+        if key not in self._models:
+            self._models.clear()
+            self._models[key] = CalibrationModel.from_rows(current.rows, self.interpolation,
+                                                           min_setting=self.min_setting,
+                                                           target_uW=current.target_uW)
+        return self._models[key]
+
+    def _keep_timings(self, timings):
+        self.timings = timings
+        self._timed_runs += 1
+        if self.store is not None:
+            name = timings.name.lower().replace(" ", "_")
+            timings.to_json(os.path.join(self.store.path, f"timings_{self._timed_runs:03d}_{name}.json"))
+
+    @timed("Calibration")
+    def calibrate(self, target_uW, start_wl=500, step=5, steps=20, sampling="fixed",
+                  tolerance=0.5, max_iterations=10, on_point=None, on_status=None):
+        """Calibrates steps + 1 wavelengths from start_wl on for target_uW; returns the new version.
+
+        sampling="adaptive" spends the same number of points on the same range
+        where the curve bends. on_point(process, wavelength, setting, power_uW)
+        is called for every calibrated point, on_status(text) with progress.
+        """
+        end_wl = start_wl + step * steps
+        self.check_range(start_wl, end_wl)
+        settler, controller, log_point, status, restore = self._calibration_tools(tolerance, on_point,
+                                                                                  on_status)
+        if sampling == "adaptive":
+            point, reading = self._recording(target_uW, log_point)
+            try:
+                run_results, report = adaptive_calibration(self.bench, start_wl, end_wl, target_uW,
+                                                           controller, settler, tolerance, max_iterations,
+                                                           max_points=steps + 1, on_point=point,
+                                                           on_reading=reading)
+            finally:
+                restore()
+                self._flush()
+            version = self._commit(run_results, target_uW, tolerance)
+            status(f"Calibration complete: {report.points} points in "
+                   f"{report.passes} passes, est. error {report.error:.1f} %")
+            self._report_reach(run_results, target_uW, tolerance, status)
+            return version
+
+        try:
+            run_results = self._sweep([target_uW], start_wl, step, steps, tolerance, max_iterations,
+                                      settler, controller, log_point, status)[0]
+        finally:
+            restore()
+        version = self._commit(run_results, target_uW, tolerance)
+        status(f"Calibration complete (settling saved {settler.total_saved:.1f} s in total)")
+        self._report_reach(run_results, target_uW, tolerance, status)
+        return version
+
+    @timed("Multi-target calibration")
+    def calibrate_targets(self, targets_uW, start_wl=500, step=5, steps=20, tolerance=0.5,
+                          max_iterations=10, on_point=None, on_status=None):
+        """One fixed-grid sweep that converges to every target power at each wavelength.
+
+        Returns the TargetTable, which is also kept as self.table. The first
+        target in targets_uW becomes the current calibration version as well, so
+        single-target measurements and recalibration work as after calibrate().
+        """
+        targets = sorted(set(float(target) for target in targets_uW))
+        if len(targets) < 2:
+            raise ValueError("Multi-target calibration needs at least two different target powers")
+        self.check_range(start_wl, start_wl + step * steps)
+        settler, controller, log_point, status, restore = self._calibration_tools(tolerance, on_point,
+                                                                                  on_status)
+        try:
+            runs = self._sweep(targets, start_wl, step, steps, tolerance, max_iterations,
+                               settler, controller, log_point, status)
+        finally:
+            restore()
+        for target_uW, run in zip(targets, runs):
+            self.calibration_store.add_results(run, target_uW, tolerance=tolerance)
+        primary = float(targets_uW[0])
+        self.calibration.commit(runs[targets.index(primary)], primary)
+        self.table = TargetTable([row[0] for row in runs[0]], targets,
+                                 [[run[i][1] for run in runs] for i in range(len(runs[0]))],
+                                 [[run[i][2] for run in runs] for i in range(len(runs[0]))],
+                                 kind=self.interpolation, min_setting=self.min_setting)
+        status(f"Calibration complete for {len(targets)} targets "
+               f"(settling saved {settler.total_saved:.1f} s in total)")
+        for target_uW, run in zip(targets, runs):
+            self._report_reach(run, target_uW, tolerance, status, f"{target_uW:g} µW: ")
+        return self.table
+
+    def _report_reach(self, rows, target_uW, tolerance, status, prefix=""):
+        # Which points could not reach the target, and what the laser delivers there instead
+        reach = describe_reach(CalibrationModel.from_rows(rows, min_setting=self.min_setting,
+                                                          target_uW=target_uW, tolerance=tolerance))
+        if reach:
+            status(prefix + reach)
+
+    def _recording(self, target_uW, on_point=None):
+        """on_point and on_reading callbacks that also append to the result store.
+
+        Only the appends are timed as "logging"; callers do not open the span again.
+        """
+        store = self.store
+        if store is None:
+            return on_point, None
+
+        def point(process, wavelength, setting, power):
+            with span("logging"):
+                store.append(process, wavelength, setting, power, target_uW=target_uW)
+            if on_point is not None:
+                on_point(process, wavelength, setting, power)
+
+        def reading(wavelength, setting, power, iteration):
+            with span("logging"):
+                store.append("Feedback", wavelength, setting, power, iteration, target_uW)
+
+        return point, reading
+
+    def _flush(self):
+        if self.store is not None:
+            self.store.flush()
+
+    def check_range(self, start_wl, end_wl):
+        """Raises ValueError unless the filter passband stays within this station's wavelengths."""
+        if start_wl - BANDWIDTH / 2 < self.min_wavelength or end_wl + BANDWIDTH / 2 > self.max_wavelength:
+            raise ValueError(f"{start_wl:g}-{end_wl:g} nm falls outside the filter range "
+                             f"{self.min_wavelength:g}-{self.max_wavelength:g} nm")
+
+    def _calibration_tools(self, tolerance, on_point, on_status):
+        """Settler, controller and callbacks of one calibration, plus restore() for its end.
+
+        The meter's averaging count is chosen at the first steady point (the
+        noise can only be measured with the laser on and settled) and put back
+        by restore(), so measurements afterwards read as before.
+        """
+        # The former fixed sleeps are now only upper bounds for the settling detector
+        settler = SettlingDetector(self.bench, band_uW=tolerance, rel_band=0.01, stream=self.stream)
+        controller = make_controller(self.controller_name, min_setting=self.min_setting)
+        meter = self.bench.power_meter
+        previous_count = meter.average_count or 1
+        averaging = []
+
+        def status(text):
+            if on_status is not None:
+                on_status(text)
+
+        def log_point(process, wavelength, setting, power):
+            # At the first steady point, let the meter average enough for a quarter of the tolerance
+            if not averaging:
+                count = meter.auto_average(precision_uW=tolerance / 4, max_read_time=AVERAGING_READ_TIME)
+                settler.set_averaging(count)
+                averaging.append(count)
+            if on_point is not None:
+                on_point(process, wavelength, setting, power)
+
+        def restore():
+            if averaging:
+                meter.set_average_count(previous_count)
+
+        return settler, controller, log_point, status, restore
+
+    def _sweep(self, targets, start_wl, step, steps, tolerance, max_iterations,
+               settler, controller, log_point, status):
+        """Fixed-grid sweep converging to each target (ascending) in turn; one row list per target."""
+        bench, scheduler = self.bench, self.scheduler
+        warm_starts = [WarmStart(self.calibration_store, target_uW, self.min_setting) for target_uW in targets]
+        runs = [[] for _ in targets]
+        readings = [self._recording(target_uW)[1] for target_uW in targets]
+
+        def label(process, target_uW):
+            return process if len(targets) == 1 else f"{process} @ {target_uW:g} µW"
+
+        def calibrate_target(index, wavelength, current_setting, settle_time, previous):
+            target_uW, warm_start = targets[index], warm_starts[index]
+            if previous is not None:
+                last_target, last_setting, last_power = previous
+                if out_of_reach(controller, last_setting, last_power, last_target, tolerance) == "Saturated":
+                    # A lower target is already out of reach
+                    return last_setting, last_power, "Saturated"
+                # Same wavelength, higher target: one step of the controller's model from the
+                # last reading, unless past calibrations know better
+                current_setting = controller.next_setting(last_setting, last_power, target_uW)
+            # Start from past calibrations when they cover this wavelength; predicted
+            # while the filter move issued by the caller is still running
+            prediction = warm_start.predict(wavelength)
+            if prediction is not None:
+                current_setting = prediction.setting
+            # With several targets the laser is still at the setting of the last one
+            if prediction is not None or len(targets) > 1:
+                scheduler.set_power(current_setting)
+            scheduler.join()
+            settle = settler.wait(max_wait=settle_time)
+            power = settle.power_uW
+
+            # Out of reach even at 100 %: one reading confirms it, no iterations
+            saturated = prediction.saturated if prediction is not None else previous is not None
+            if saturated and current_setting >= MAX_LASER_POWER and power < target_uW - tolerance:
+                if not settle.settled:
+                    power = settler.wait(max_wait=PINNED_SETTLE_TIME).power_uW
+                return current_setting, power, "Saturated"
+
+            current_setting, power, iterations = converge(bench, controller, settler, target_uW, tolerance,
+                                                          max_iterations, current_setting, power,
+                                                          on_reading=bind_wavelength(readings[index], wavelength))
+            warm_start.update(wavelength, current_setting)
+            # Pinned points are kept, marked with what stopped them
+            reach = out_of_reach(controller, current_setting, power, target_uW, tolerance)
+            if reach and not iterations and not settle.settled:
+                # Stored as read; the laser may just have jumped from a far-apart setting
+                power = settler.wait(max_wait=PINNED_SETTLE_TIME).power_uW
+                reach = out_of_reach(controller, current_setting, power, target_uW, tolerance)
+            return current_setting, power, reach or "Calibration"
+
+        try:
+            # Initial setup
+            short, long = start_wl - BANDWIDTH / 2, start_wl + BANDWIDTH / 2
+            scheduler.move_filter(short, long)
+            scheduler.set_power(max(30.0, self.min_setting))
+            scheduler.set_emission(True)
+            settler.emission_on()
+            current_setting, settle_time = 30.0, 3
+
+            # Wavelength sweep, starting with the initial calibration
+            for step_index in range(steps + 1):
+                if step_index:
+                    short, long = short + step, long + step
+                    scheduler.move_filter(short, long)
+                current_wl = (short + long) / 2
+                controller.start_step(current_wl)
+
+                previous = None
+                for index, (target_uW, run) in enumerate(zip(targets, runs)):
+                    setting, power, process = calibrate_target(index, current_wl, current_setting,
+                                                               settle_time if index == 0 else 0.5, previous)
+                    if index == 0:
+                        # The next wavelength starts from the lowest target's setting
+                        current_setting = setting
+                    previous = (target_uW, setting, power)
+                    if self.store is not None:
+                        with span("logging"):
+                            self.store.append(process, current_wl, setting, power, target_uW=target_uW)
+                    log_point(label(process, target_uW), current_wl, setting, power)
+                    run.append((current_wl, setting, power))
+                settle_time = 0.5
+
+                powers = ", ".join(f"{run[-1][2]:.1f}" for run in runs)
+                status(f"Calibrated {current_wl:.1f}nm: {powers} µW "
+                       f"(settling saved {settler.take_saved():.1f} s)")
+        finally:
+            bench.laser.set_emission(False)
+            self._flush()
+        return runs
+
+    def _commit(self, run_results, target_uW, tolerance):
+        version = self.calibration.commit(run_results, target_uW)
+        self.calibration_store.add_results(run_results, target_uW, tolerance=tolerance)
+        return version
+
+    @timed("Recalibration")
+    def recalibrate(self, tolerance=0.5, on_point=None, on_status=None):
+        """Spot-checks the current calibration and re-measures what drifted; returns the version."""
+        if self.calibration.current is None:
+            raise ValueError("Perform calibration first!")
+        wavelengths = [row[0] for row in self.calibration.current.rows]
+        self.check_range(min(wavelengths), max(wavelengths))
+        settler = SettlingDetector(self.bench, band_uW=tolerance, rel_band=0.01, stream=self.stream)
+        controller = make_controller(self.controller_name, min_setting=self.min_setting)
+        point, reading = self._recording(self.calibration.current.target_uW, on_point)
+        try:
+            version, report = incremental_recalibration(self.bench, self.calibration, controller, settler,
+                                                        tolerance, on_point=point, on_reading=reading)
+        finally:
+            self._flush()
+        if on_status is not None:
+            on_status(f"Recalibration complete: {report.remeasured} of "
+                      f"{len(version.rows)} points re-measured "
+                      f"in {report.elapsed:.0f} s (version {version.number})")
+        return version
+
+    def plan(self, start_wl, end_wl, step_size, on_time, off_time, target_uW=None, rows=None, table=None):
+        """Measurement plan for the current calibration (or a target of the table), validated but not run.
+
+        rows (of a calibration) or a TargetTable plan for those instead, before
+        load_calibration() or load_table() makes them current.
+        """
+        table = self.table if table is None else table
+        if target_uW is not None:
+            if table is None:
+                raise ValueError("No multi-target calibration available")
+            model, plan_target = table.model(target_uW), target_uW
+        elif rows is not None:
+            plan_target = CalibrationRun(rows).target_uW
+            model = CalibrationModel.from_rows(rows, self.interpolation, min_setting=self.min_setting,
+                                               target_uW=plan_target)
+        else:
+            model = self.model()
+            plan_target = self.calibration.current.target_uW
+        plan = plan_measurement(model, start_wl, end_wl, step_size, on_time, off_time,
+                                min_wavelength=self.min_wavelength, max_wavelength=self.max_wavelength,
+                                target_uW=plan_target)
+        if target_uW is not None and table.target_extrapolated(target_uW):
+            plan.warnings.append(f"Extrapolating beyond calibrated targets! {target_uW:g} µW is outside "
+                                 f"{table.targets[0]:g}-{table.targets[-1]:g} µW")
+        return plan
+
+    @timed("Measurement")
+    def measure(self, plan, on_point=None, on_phase=None, hold_mode="open", rate_hz=5.0,
+                deadband_uW=0.5, max_rate=5.0, compensate_drift=False):
+        """Runs a plan; returns its (wavelength, setting, mean ON power) rows.
+
+        on_point("Measurement", wavelength, setting, power_uW) is called after
+        each step, on_phase(index, phase) as each "on" and "off" phase starts.
+        hold_mode="closed" keeps correcting the setting during the ON phases,
+        rate_hz times a second, outside deadband_uW and by at most max_rate %
+        per second; the rows then carry the setting each phase ended with.
+        compensate_drift divides each planned setting by the drift gain
+        estimated so far when the step is issued.
+        """
+        if hold_mode not in ("open", "closed"):
+            raise ValueError(f"Unknown hold mode {hold_mode!r}, expected 'open' or 'closed'")
+        if hold_mode == "closed" and plan.target_uW is None:
+            raise ValueError("Closed-loop hold needs the plan's target power")
+        stream, store = self.stream, self.store
+        rows = []
+        steps = self.step_stats = []
+        current = {"index": 0}
+        drift = self._drift()
+        issued = {}
+        power_hold = None
+        if hold_mode == "closed":
+            controller = make_controller(self.controller_name, min_setting=self.min_setting)
+            power_hold = PowerHold(self.bench, stream, controller, rate_hz=rate_hz, deadband_uW=deadband_uW,
+                                   max_rate=max_rate, scheduler=self.scheduler)
+
+        def phase(index, name):
+            current["index"] = index
+            if on_phase is not None:
+                on_phase(index, name)
+
+        def setting_for(index):
+            setting = float(plan.settings[index])
+            if compensate_drift:
+                setting = float(drift.correct(plan.wavelengths[index], setting, self.bench.time()))
+            issued[index] = setting
+            return setting
+
+        def hold(seconds):
+            # Mean power actually delivered during the ON phase
+            index = current["index"]
+            wavelength, setting = float(plan.wavelengths[index]), issued[index]
+            start = self.bench.time()
+            with span("dwell"):
+                if power_hold is not None:
+                    times, values, stats = power_hold.hold(seconds, wavelength, setting, plan.target_uW)
+                else:
+                    stream.capture(seconds)
+                    times, values = stream.samples_since(start)
+                    stats = step_stats(times, values, start, wavelength, setting, plan.target_uW, deadband_uW)
+            steps.append(stats)
+            # Reference read: the last second (at most half) of the phase, after any correction
+            steady_from = max(start + seconds / 2, start + seconds - 1.0)
+            if power_hold is not None and power_hold.changed_at is not None:
+                steady_from = max(steady_from, power_hold.changed_at + power_hold.interval)
+            tail = times >= steady_from
+            power = steady_power(times[tail], values[tail])
+            # Extrapolated or pinned settings were never measured at the target: no reference
+            if power is not None and not plan.extrapolated[index] and not plan.limited[index]:
+                drift.observe(self.bench.time(), wavelength, stats.final_setting, power,
+                              float(plan.settings[index]), plan.target_uW)
+            if store is not None and len(times):
+                with span("logging"):
+                    store.append_many("On", times, wavelength, stats.final_setting, values,
+                                      target_uW=plan.target_uW)
+            return stats.mean_uW if stats.samples else None
+
+        point, _ = self._recording(plan.target_uW, on_point)
+
+        def on_step(index, wavelength, setting, power):
+            setting = steps[index].final_setting
+            rows.append((wavelength, setting, power))
+            if point is not None:
+                point("Measurement", wavelength, setting, power)
+
+        # The next step's filter move and laser setting run during each OFF phase
+        try:
+            execute_plan(self.bench, plan, self.scheduler, hold=hold, on_phase=phase, on_step=on_step,
+                         setting_for=setting_for)
+        finally:
+            self._flush()
+            if store is not None and steps:
+                # _keep_timings numbers this routine once it returns
+                number = self._timed_runs + 1
+                write_step_stats(os.path.join(store.path, f"steps_{number:03d}_measurement.csv"), steps)
+                drift.to_csv(os.path.join(store.path, f"drift_{number:03d}_measurement.csv"))
+        return rows
+
+    def _drift(self):
+        # Reads only compare with the calibration (and table) they were taken against
+        current = self.calibration.current
+        key = (current.number if current is not None else None, id(self.table))
+        if self.drift.key != key:
+            self.drift.reset(key)
+        return self.drift
+
+    def close(self):
+        if self._own_stream:
+            self.stream.stop()
+        if self._own_scheduler:
+            self.scheduler.close()
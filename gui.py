@@ -1,13 +1,14 @@
 import tkinter as tk
 from tkinter import ttk
 import threading
-import time
-import pyvisa
-from ThorlabsPM100 import ThorlabsPM100
-from nkt_tools.extreme import Extreme
-from nkt_tools.varia import Varia
-
-def main():
+import argparse
+from devices import open_bench
+from engine import AVERAGING_READ_TIME
+from instrumentation import finish_run, instrument_bench, span, start_run
+from settling import SettlingDetector
+from result_log import BatchedTreeLog
+
+def main(simulate=None):
     # Create the main window
     root = tk.Tk()
     root.title("Laser Power Feedback Sequence")
@@ -38,55 +39,59 @@ def main():
     status_label = ttk.Label(root, text="Status: Idle", font=("Helvetica", 12))
     status_label.pack(pady=10)
 
-    # Hardware Setup (similar to your existing code)
-    rm = pyvisa.ResourceManager()
-    inst = rm.open_resource('USB0::0x1313::0x8078::P0017991::INSTR')
-    power_meter = ThorlabsPM100(inst=inst)
-
-    Laser = Extreme()
-    Filter = Varia()
+    # Hardware Setup (simulated bench with --simulate or LASER_SIMULATE=1)
+    bench = instrument_bench(open_bench(simulate=simulate))
+    power_meter = bench.power_meter
+
+    Laser = bench.laser
+    Filter = bench.filter
+
+    # Rows are queued from the sequence thread and rendered by the main loop in batches
+    results_log = BatchedTreeLog(
+        root, tree, scrollbar,
+        lambda step, short_sp, long_sp, wavelength, power_uw: (
+            step,
+            f"{short_sp:.1f}",
+            f"{long_sp:.1f}",
+            f"{wavelength:.1f}",
+            f"{power_uw:.1f}"
+        ),
+        n_values=4
+    )
 
     # Define a function to insert rows into the table
     def log_measurement(step, short_sp, long_sp, wavelength, power_uw):
-        """Inserts one row of data into the Treeview."""
-        tree.insert(
-            "", "end",
-            values=(
-                step,
-                f"{short_sp:.1f}",
-                f"{long_sp:.1f}",
-                f"{wavelength:.1f}",
-                f"{power_uw:.1f}"
-            )
-        )
+        """Queues one row of data for the Treeview; safe to call from any thread."""
+        results_log.log(step, short_sp, long_sp, wavelength, power_uw)
 
-    def calibrate_initial_power(target_power_uW, tolerance, max_iterations):
+    def calibrate_initial_power(target_power_uW, tolerance, max_iterations, settler):
         iteration = 0
         current_laser_setting = 30.0
         Laser.set_power(current_laser_setting)
         Laser.set_emission(True)
-        time.sleep(3)
+        settler.emission_on()
+        measured_uW = settler.wait(max_wait=3).power_uW
 
         while iteration < max_iterations:
-            power_W = power_meter.read
-            measured_uW = power_W * 1e6
-
             if abs(measured_uW - target_power_uW) <= tolerance:
                 break
 
             adjustment_factor = target_power_uW / measured_uW if measured_uW != 0 else 1.0
-            new_setting = current_laser_setting * adjustment_factor
-            Laser.set_power(new_setting)
-            current_laser_setting = new_setting
+            with span("feedback iteration"):
+                new_setting = current_laser_setting * adjustment_factor
+                Laser.set_power(new_setting)
+                current_laser_setting = new_setting
 
-            time.sleep(0.5)
+                measured_uW = settler.wait(max_wait=0.5).power_uW
             iteration += 1
 
-        return power_meter.read * 1e6
+        return measured_uW
 
     # Main sequence logic in a separate thread
     def run_sequence():
         status_label.config(text="Status: Initializing hardware...")
+        # Instrument calls, sleeps and settles of the sequence are timed
+        start_run("Sequence", bench.time)
 
         # --- Parameters ---
         Step = 5
@@ -95,6 +100,8 @@ def main():
         target_power_uW = 10.0
         tolerance = 0.5
         max_iterations = 10
+        # Fixed settle times below are upper bounds; the detector moves on once readings are stable
+        settler = SettlingDetector(bench, band_uW=tolerance, rel_band=0.01)
 
         # --- Laser and Filter setup ---
         initial_laser_power_setting = 30.0
@@ -102,14 +109,17 @@ def main():
         Laser.set_emission(True)
         current_laser_setting = initial_laser_power_setting
 
-        Filter.short_setpoint = 527
-        Filter.long_setpoint = 537
+        bench.set_passband(527, 537)
         starting_wavelength = (Filter.short_setpoint + Filter.long_setpoint) / 2
 
         # --- Measure initial power before the sequence starts ---
-        initial_power_uW = calibrate_initial_power(target_power_uW, tolerance, max_iterations)
+        initial_power_uW = calibrate_initial_power(target_power_uW, tolerance, max_iterations, settler)
+        # Average on the meter from now on, enough for a quarter of the tolerance
+        settler.set_averaging(power_meter.auto_average(precision_uW=tolerance / 4,
+                                                       max_read_time=AVERAGING_READ_TIME))
         log_measurement("Start", Filter.short_setpoint, Filter.long_setpoint, starting_wavelength, initial_power_uW)
-        status_label.config(text=f"Status: Initial Power Calibrated = {initial_power_uW:.1f} µW")
+        status_label.config(text=f"Status: Initial Power Calibrated = {initial_power_uW:.1f} µW "
+                                 f"(settling saved {settler.take_saved():.1f} s)")
 
         # Optional range checks
         min_wavelength = 500
@@ -127,18 +137,15 @@ def main():
                 break
 
             # Update the filter
-            Filter.short_setpoint = new_short_setpoint
-            Filter.long_setpoint = new_long_setpoint
+            bench.set_passband(new_short_setpoint, new_long_setpoint)
             actual_wavelength = proposed_wavelength
 
-            time.sleep(0.5)  # Wait for filter to settle
+            # Wait for filter to settle (0.5 s at most)
+            measured_uW = settler.wait(max_wait=0.5).power_uW
 
             # --- Feedback loop to maintain target power ---
             iteration = 0
             while iteration < max_iterations:
-                power_W = power_meter.read
-                measured_uW = power_W * 1e6
-
                 # Check if we're within tolerance
                 if abs(measured_uW - target_power_uW) <= tolerance:
                     break
@@ -149,17 +156,14 @@ def main():
                 else:
                     adjustment_factor = target_power_uW / measured_uW
 
-                new_setting = current_laser_setting * adjustment_factor
-                Laser.set_power(new_setting)
-                current_laser_setting = new_setting
+                with span("feedback iteration"):
+                    new_setting = current_laser_setting * adjustment_factor
+                    Laser.set_power(new_setting)
+                    current_laser_setting = new_setting
 
-                time.sleep(0.5)
+                    measured_uW = settler.wait(max_wait=0.5).power_uW
                 iteration += 1
 
-            # Final measurement after feedback
-            power_W = power_meter.read
-            measured_uW = power_W * 1e6
-
             # Insert row into the table
             log_measurement(
                 i+1,
@@ -168,14 +172,16 @@ def main():
                 actual_wavelength,
                 measured_uW
             )
-            status_label.config(text=f"Status: Step {i+1}, Power = {measured_uW:.1f} µW")
+            status_label.config(text=f"Status: Step {i+1}, Power = {measured_uW:.1f} µW "
+                                     f"(settling saved {settler.take_saved():.1f} s)")
 
             # Sleep for the duration of the step
-            time.sleep(StepDuration)
+            with span("dwell"):
+                bench.sleep(StepDuration)
 
         # Turn off laser
         Laser.set_emission(False)
-        status_label.config(text="Status: Sequence completed.")
+        status_label.config(text=f"Status: Sequence completed. {finish_run().headline()}")
 
     # 10. Function to start the sequence in a separate thread
     def start_sequence():
@@ -189,4 +195,7 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Laser Power Feedback Sequence")
+    parser.add_argument("--simulate", action="store_true", default=None,
+                        help="run against the simulated laser, filter and power meter")
+    main(simulate=parser.parse_args().simulate)
\ No newline at end of file
@@ -0,0 +1,347 @@
+"""Timing of instrument calls and control-loop phases, aggregated per run.
+
+instrument_bench() wraps the laser, the filter, the power meter and the clock
+of a bench in thin proxies that time every instrument call ("laser.set_power",
+"power_meter.read", "filter.short_setpoint=") and every sleep. The control
+loops mark their phases with span("settle"), span("feedback iteration"),
+span("dwell") and span("logging"). Nothing is recorded outside a run: between
+start_run() and finish_run() (or inside run()), every call and span lands in
+that run's Timings, which keeps a count, total and log-spaced histogram per
+key, plus the self time (total minus whatever is nested inside) per nesting
+path. Paths tell apart the same call in different places: "settle > sleep" is
+waiting for the filter after a move, "feedback iteration > settle > sleep"
+waiting for the laser after an adjustment.
+
+Durations are taken on the bench clock, so on the simulated bench they are the
+virtual time the bench would have spent. Calls made from other threads (the
+command scheduler's device workers, the power stream) overlap the run's own
+thread and are reported apart, as background. The self times of the run's
+thread add up to its total, which is what summary() breaks down: where did the
+time go.
+
+Runs belong to the thread that started them, so several stations can each run
+a routine at the same time (see stations.py). A run started with the scope of
+an instrumented bench also collects that bench's calls from other threads, as
+background; a run started without one is seen by every thread, as before.
+
+Overhead with no run active is a few attribute lookups per instrument call;
+with a run, two clock reads and a dictionary update.
+"""
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bin edges in seconds: 1 µs to 1000 s, four bins per decade
+BIN_EDGES = [10.0 ** (exponent / 4) for exponent in range(-24, 13)]
+BACKGROUND = " (background)"
+UNTRACKED = "untracked"
+PATH_SEPARATOR = " > "
+
+_active = None  # Timings of the run started without a scope, seen by every thread
+
+
+class _Local(threading.local):
+    timings = None  # Run started by this thread
+
+
+_local = _Local()
+
+
+class RunScope:
+    """The run an instrumented bench's calls from any thread are recorded into."""
+
+    timings = None
+
+
+class Timings:
+    """Per-key durations of one run."""
+
+    def __init__(self, name, clock=time.perf_counter):
+        self.name = name
+        self.clock = clock
+        self.thread = threading.get_ident()
+        self.started = clock()
+        self.total = None  # s, set by stop()
+        self.scope = None  # RunScope the run was started with, if any
+        self._stats = {}  # key -> [count, total, min, max, histogram]
+        self._self = {}  # nesting path -> self total
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, key, seconds, nested=0.0):
+        """Adds one duration of key; nested is the part spent in inner spans and calls."""
+        if threading.get_ident() != self.thread:
+            key += BACKGROUND
+        stack = self._stack()
+        if stack:
+            parent = stack[-1]
+            parent[1] += seconds
+            path = parent[0] + PATH_SEPARATOR + key
+        else:
+            path = key
+        self._add(key, path, seconds, nested)
+
+    def _add(self, key, path, seconds, nested):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = [0, 0.0, seconds, seconds, [0] * (len(BIN_EDGES) + 1)]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = min(stats[2], seconds)
+            stats[3] = max(stats[3], seconds)
+            stats[4][bisect.bisect_right(BIN_EDGES, seconds)] += 1
+            self._self[path] = self._self.get(path, 0.0) + seconds - nested
+
+    def span(self, key):
+        return _Span(self, key)
+
+    def stop(self):
+        self.total = self.clock() - self.started
+        return self
+
+    def elapsed(self):
+        return self.total if self.total is not None else self.clock() - self.started
+
+    def stats(self):
+        """{key: (count, total, min, max)} in seconds."""
+        with self._lock:
+            return {key: tuple(stats[:4]) for key, stats in self._stats.items()}
+
+    def breakdown(self):
+        """(path, self seconds, share of the run) of the run's own thread, largest first.
+
+        The remainder not covered by any span or call is listed as untracked
+        (computation, callbacks, waiting on background threads).
+        """
+        total = self.elapsed()
+        with self._lock:
+            parts = [(path, seconds) for path, seconds in self._self.items() if not path.endswith(BACKGROUND)]
+        parts.append((UNTRACKED, max(0.0, total - sum(seconds for _, seconds in parts))))
+        parts.sort(key=lambda part: -part[1])
+        return [(key, seconds, seconds / total if total > 0 else 0.0) for key, seconds in parts]
+
+    def headline(self, top=4):
+        """One line: the largest shares of the run."""
+        shares = ", ".join(f"{key} {share:.0%}" for key, _, share in self.breakdown()[:top])
+        return f"{self.name} took {self.elapsed():.1f} s: {shares}"
+
+    def summary(self):
+        """Multi-line report: the breakdown, then every key's counts and latencies."""
+        lines = [f"Where did the time go: {self.name}, {self.elapsed():.1f} s"]
+        for key, seconds, share in self.breakdown():
+            if seconds < 0.005:
+                continue  # Shown as 0.00 s anyway; the table below still has every key
+            lines.append(f"  {key:<48}{seconds:>10.2f} s{share:>7.1%}")
+        lines.append(f"  {'key':<48}{'count':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}")
+        for key, (count, total, _, longest) in sorted(self.stats().items()):
+            lines.append(f"  {key:<48}{count:>8}{total:>10.2f}{total / count * 1000:>10.2f}"
+                         f"{longest * 1000:>10.2f}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        with self._lock:
+            keys = {key: {"count": stats[0], "total_s": stats[1], "min_s": stats[2], "max_s": stats[3],
+                          "histogram": list(stats[4])}
+                    for key, stats in sorted(self._stats.items())}
+            background = {path: seconds for path, seconds in self._self.items() if path.endswith(BACKGROUND)}
+        return {"name": self.name, "total_s": self.elapsed(), "bin_edges_s": BIN_EDGES,
+                "breakdown": [{"path": path, "self_s": seconds, "share": share}
+                              for path, seconds, share in self.breakdown()],
+                "background": background, "keys": keys}
+
+    def to_json(self, path):
+        """Writes counts, totals and histograms; histogram[i] counts durations below bin_edges_s[i]."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=1, ensure_ascii=False)
+
+
+class _Span:
+    """Context manager timing one phase; inner spans and calls count as nested."""
+
+    __slots__ = ("timings", "key", "start", "stack", "entry")
+
+    def __init__(self, timings, key):
+        self.timings = timings
+        self.key = key
+
+    def __enter__(self):
+        timings = self.timings
+        if threading.get_ident() != timings.thread:
+            self.key += BACKGROUND
+        stack = self.stack = timings._stack()
+        # [nesting path, time spent in nested spans and calls]
+        self.entry = [stack[-1][0] + PATH_SEPARATOR + self.key if stack else self.key, 0.0]
+        stack.append(self.entry)
+        self.start = timings.clock()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = self.timings.clock() - self.start
+        stack = self.stack
+        stack.pop()
+        if stack:
+            stack[-1][1] += elapsed
+        self.timings._add(self.key, self.entry[0], elapsed, self.entry[1])
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current_run():
+    """Timings of the calling thread's run, or of the run without a scope; None outside a run."""
+    timings = _local.timings
+    return timings if timings is not None else _active
+
+
+def span(key):
+    """Times the enclosed block as key in the current run; does nothing outside a run."""
+    timings = _local.timings
+    if timings is None:
+        timings = _active
+        if timings is None:
+            return _NO_SPAN
+    return timings.span(key)
+
+
+def start_run(name, clock=time.perf_counter, scope=None):
+    """Starts collecting into a new Timings for the calling thread.
+
+    With a RunScope (instrument_bench() gives every bench one) the run also
+    takes the calls other threads make to that bench, and runs on other
+    benches are left alone. Without one it replaces the run every thread
+    records into. A previous run of the same thread or scope is dropped.
+    """
+    global _active
+    timings = Timings(name, clock)
+    timings.scope = scope
+    if scope is None:
+        _active = timings
+    else:
+        scope.timings = timings
+    _local.timings = timings
+    return timings
+
+
+def finish_run():
+    """Stops the calling thread's run and returns its Timings (None without one)."""
+    global _active
+    timings = current_run()
+    if timings is None:
+        return None
+    if _local.timings is timings:
+        _local.timings = None
+    if _active is timings:
+        _active = None
+    if timings.scope is not None and timings.scope.timings is timings:
+        timings.scope.timings = None
+    return timings.stop()
+
+
+@contextmanager
+def run(name, clock=time.perf_counter, scope=None):
+    timings = start_run(name, clock, scope)
+    try:
+        yield timings
+    finally:
+        if current_run() is timings:
+            finish_run()
+
+
+class InstrumentedDevice:
+    """Proxy that times attribute reads, writes and method calls of one instrument."""
+
+    def __init__(self, device, name, scope=None):
+        object.__setattr__(self, "_device", device)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_scope", scope if scope is not None else RunScope())
+
+    def _run(self):
+        # The calling thread's own run, else the bench's (device workers, the stream), else the global one
+        timings = _local.timings
+        if timings is None:
+            timings = self._scope.timings
+            if timings is None:
+                timings = _active
+        return timings
+
+    def __getattr__(self, attribute):
+        timings = self._run()
+        if timings is None:
+            return getattr(self._device, attribute)
+        key = f"{self._name}.{attribute}"
+        start = timings.clock()
+        value = getattr(self._device, attribute)
+        looked_up = timings.clock() - start
+        if not callable(value):
+            timings.record(key, looked_up)
+            return value
+
+        # The lookup (an executor round trip behind the control core) counts towards the call
+        def call(*args, **kwargs):
+            with timings.span(key) as timed:
+                timed.start -= looked_up
+                return value(*args, **kwargs)
+        return call
+
+    def __setattr__(self, attribute, value):
+        timings = self._run()
+        if timings is None:
+            setattr(self._device, attribute, value)
+            return
+        with timings.span(f"{self._name}.{attribute}="):
+            setattr(self._device, attribute, value)
+
+
+class InstrumentedClock:
+    """Bench clock whose sleeps are timed as "sleep"."""
+
+    def __init__(self, clock, scope=None):
+        self.clock = clock
+        self.scope = scope if scope is not None else RunScope()
+        self.time = clock.time  # Read on every timed call, so without the extra hop
+
+    def sleep(self, seconds):
+        timings = _local.timings
+        if timings is None:
+            timings = self.scope.timings if self.scope.timings is not None else _active
+            if timings is None:
+                self.clock.sleep(seconds)
+                return
+        with timings.span("sleep"):
+            self.clock.sleep(seconds)
+
+    def __getattr__(self, attribute):
+        return getattr(self.clock, attribute)
+
+
+def instrument_bench(bench):
+    """Wraps the bench's instruments and clock once; later calls return it unchanged.
+
+    The wrappers share one RunScope, bench.clock.scope, for start_run().
+    """
+    if isinstance(bench.clock, InstrumentedClock):
+        return bench
+    scope = RunScope()
+    for name in ("laser", "filter", "power_meter"):
+        setattr(bench, name, InstrumentedDevice(getattr(bench, name), name, scope))
+    bench.clock = InstrumentedClock(bench.clock, scope)
+    return bench
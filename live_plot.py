@@ -0,0 +1,175 @@
+"""Live plots embedded in the main window, redrawn by blitting at a capped frame rate.
+
+Three panels: the power-meter stream against time (the last window_s seconds)
+and the logged points' power and laser setting against wavelength, one line
+per process. Worker threads only hand points over: add_point() appends to a
+ResultHistory under a lock and returns. The Tk main loop picks up whatever is
+new on a timer, at most max_fps times a second, and redraws only the data
+lines on top of cached axes backgrounds. A full redraw happens only when an
+axis has to grow, a new process appears or the window is resized. A frame
+that takes long pushes the next one back, so rendering never gets more than a
+small share of the time and never holds a lock the control thread needs for
+longer than a copy of the samples.
+
+matplotlib is imported when the first LivePlot is created, not at startup.
+"""
+import threading
+import time
+import tkinter as tk
+
+import numpy as np
+
+from result_log import ResultHistory
+
+
+class LivePlot:
+    """Power vs time, power vs wavelength and setting vs wavelength in a Tk container."""
+
+    def __init__(self, root, parent, stream=None, min_wavelength=400, max_wavelength=840,
+                 window_s=30.0, max_fps=10, max_samples=2000):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+
+        self.root = root
+        self.stream = stream
+        self.window_s = window_s
+        self.interval_ms = int(1000 / max_fps)
+        self.max_samples = max_samples  # Stream samples drawn per frame, decimated beyond that
+        self.history = ResultHistory(3)
+        self._lock = threading.Lock()
+        self._shown = 0
+        self._cleared = False
+        self._lines = {}  # process -> (power line, setting line)
+        self._backgrounds = None
+
+        # A bare Figure, not pyplot: nothing global, nothing that wants its own main loop
+        self.figure = Figure(figsize=(5, 6), dpi=80)
+        self.axes = self.figure.subplots(3, 1)
+        time_ax, power_ax, setting_ax = self.axes
+        time_ax.set_xlim(-window_s, 0)
+        time_ax.set_xlabel("Time (s)")
+        time_ax.set_ylabel("Power (µW)")
+        power_ax.set_ylabel("Power (µW)")
+        setting_ax.set_ylabel("Setting (%)")
+        setting_ax.set_ylim(0, 105)
+        for ax in (power_ax, setting_ax):
+            ax.set_xlim(min_wavelength, max_wavelength)
+            ax.set_xlabel("Wavelength (nm)")
+        for ax in (time_ax, power_ax):
+            ax.set_ylim(0, 1)
+        for ax in self.axes:
+            ax.grid(True)
+        self._stream_line, = time_ax.plot([], [], lw=1, animated=True)
+        self.figure.tight_layout()
+
+        self.canvas = FigureCanvasTkAgg(self.figure, master=parent)
+        self.widget = self.canvas.get_tk_widget()
+        # Every full draw (including resizes) refreshes the cached backgrounds
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+        root.after(self.interval_ms, self._tick)
+
+    def add_point(self, process, wavelength, setting, power):
+        """Queues one logged point; may be called from any thread."""
+        with self._lock:
+            self.history.append(process, wavelength, setting, power)
+
+    def clear(self):
+        """Drops the points of the previous job; the stream panel keeps running."""
+        with self._lock:
+            self.history = ResultHistory(3)
+            self._cleared = True
+
+    def show(self, rows, process="Calibration"):
+        """Replaces the points with (wavelength, setting, power) rows, e.g. a finished calibration."""
+        self.clear()
+        for row in rows:
+            self.add_point(process, *row)
+
+    def _on_draw(self, event):
+        self._backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+        self._blit()
+
+    def _blit(self):
+        if self._backgrounds is None:
+            return
+        for ax, background in zip(self.axes, self._backgrounds):
+            self.canvas.restore_region(background)
+            for line in ax.get_lines():
+                ax.draw_artist(line)
+            self.canvas.blit(ax.bbox)
+
+    def _fit(self, ax, top):
+        # Grows (or, after a drop to a much smaller range, shrinks) the power axis with headroom
+        low, high = ax.get_ylim()
+        if not np.isfinite(top):
+            return False
+        top = max(top, 1.0)  # Not down to the dark reading between ON phases
+        if 0.3 * high <= top <= high:
+            return False
+        ax.set_ylim(low, 1.25 * top)
+        return True
+
+    def _update(self):
+        redraw = False
+        time_ax, power_ax, setting_ax = self.axes
+        with self._lock:
+            cleared, self._cleared = self._cleared, False
+            count = len(self.history)
+            if count != self._shown or cleared:
+                values = self.history.values().copy()
+                codes = self.history.codes().copy()
+                labels = self.history.labels
+
+        if cleared:
+            for lines in self._lines.values():
+                for line in lines:
+                    line.remove()
+            self._lines = {}
+            self._shown = 0
+            redraw = True
+        if count != self._shown:
+            self._shown = count
+            for code, label in enumerate(labels):
+                points = values[codes == code]
+                points = points[np.argsort(points[:, 0], kind="stable")]  # Adaptive sampling fills in gaps
+                lines = self._lines.get(label)
+                if lines is None:
+                    lines = self._lines[label] = (
+                        power_ax.plot([], [], "o-", ms=3, lw=1, label=label, animated=True)[0],
+                        setting_ax.plot([], [], "o-", ms=3, lw=1, label=label, animated=True)[0])
+                    redraw = True
+                lines[0].set_data(points[:, 0], points[:, 2])
+                lines[1].set_data(points[:, 0], points[:, 1])
+            if count:
+                redraw |= self._fit(power_ax, np.nanmax(values[:, 2], initial=0.0))
+        if redraw:
+            if self._lines:
+                setting_ax.legend(loc="upper right", fontsize="small")
+            elif setting_ax.get_legend() is not None:
+                setting_ax.get_legend().remove()
+
+        if self.stream is not None:
+            now = self.stream.bench.time()
+            times, powers = self.stream.samples_since(now - self.window_s)
+            step = max(1, len(times) // self.max_samples)
+            self._stream_line.set_data(times[::step] - now, powers[::step])
+            if len(powers):
+                redraw |= self._fit(time_ax, float(powers.max()))
+
+        if redraw:
+            self.canvas.draw()  # Ends in _on_draw, which blits the lines
+        else:
+            self._blit()
+
+    def _tick(self):
+        started = time.perf_counter()
+        try:
+            self._update()
+        except tk.TclError:
+            return  # The window is being destroyed
+        # A slow frame (a full redraw of a large window) pushes the next one back
+        delay = max(self.interval_ms, int(4000 * (time.perf_counter() - started)))
+        try:
+            self.root.after(delay, self._tick)
+        except Exception:
+            pass
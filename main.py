@@ -1,21 +1,27 @@
 import tkinter as tk
 from tkinter import ttk, simpledialog, messagebox
-import threading
-import time
 import csv
-import pyvisa
+import argparse
 import numpy as np
-from scipy.interpolate import interp1d
-import matplotlib.pyplot as plt
-from ThorlabsPM100 import ThorlabsPM100
-from nkt_tools.extreme import Extreme
-from nkt_tools.varia import Varia
 from datetime import datetime
-
-def main():
+from devices import BenchConnector
+from controllers import CONTROLLERS
+from calibration_store import CalibrationStore
+from simulation import RESULTS_DIR
+from calibration_model import KINDS
+from engine import CALIBRATION_HEADER, Engine
+from scheduler import CommandScheduler
+from control_core import Busy, ControlCore, TaskAborted, TkBridge
+from result_log import BatchedTreeLog
+from acquisition import PowerStream
+from result_store import ResultStore
+from stations import StationFileError, find_station, load_stations
+
+def main(simulate=None, controller_name="proportional", sampling="fixed",
+         interpolation="linear", hold_mode="open", compensate_drift=False, station=None):
     # Create the main window
     root = tk.Tk()
-    root.title("Laser Power Stabilization System")
+    root.title("Laser Power Stabilization System" + (f" - {station.name}" if station is not None else ""))
 
     # Create a main frame for padding and layout
     main_frame = ttk.Frame(root, padding="10")
@@ -39,20 +45,46 @@ def main():
     tree.configure(yscroll=scrollbar.set)
     scrollbar.pack(side="left", fill="y")
 
+    # Live plots go next to the log once the first job starts
+    plot_frame = ttk.Frame(main_frame)
+    plot_frame.pack(side="left", fill="both", expand=True)
+
     # Status label
     status_label = ttk.Label(root, text="Status: Idle", font=("Helvetica", 12))
     status_label.pack(pady=10)
 
+    # Live power from the acquisition stream
+    power_label = ttk.Label(root, text="Power: -", font=("Helvetica", 10))
+    power_label.pack()
+
+    # Hardware Setup (simulated bench with --simulate or LASER_SIMULATE=1). Devices connect in
+    # the background and missing ones are retried, so the window is usable right away
+    # A station from a stations file picks the rig (see stations.py)
+    connector = (station.connector(simulate) if station is not None
+                 else BenchConnector(simulate=simulate)).start()
+    device_label = ttk.Label(root, text=connector.status(), font=("Helvetica", 10))
+    device_label.pack()
+
+    # Where the last routine's time went, from the instrumentation timings
+    timing_label = ttk.Label(root, text="", font=("Helvetica", 9))
+    timing_label.pack()
+
     # Button frame
     button_frame = ttk.Frame(root, padding="10")
     button_frame.pack()
 
-    # Hardware Setup
-    rm = pyvisa.ResourceManager()
-    inst = rm.open_resource('USB0::0x1313::0x8078::P0017991::INSTR')
-    power_meter = ThorlabsPM100(inst=inst)
-    Laser = Extreme()
-    Filter = Varia()
+    bridge = TkBridge(root)
+    # Everything that talks to the instruments is set up once the bench is connected
+    bench = core = stream = scheduler = engine = None
+    Laser = None
+    live_plot = None
+
+    def update_power_label():
+        stats = stream.stats(window_s=1.0)
+        if stats.count:
+            power_label.config(text=f"Power: {stats.mean:.2f} ± {stats.std:.2f} µW "
+                                    f"(drift {stats.drift_uW_per_s:+.2f} µW/s)")
+        root.after(500, update_power_label)
 
     # Ask for target power at startup
     target_power = simpledialog.askfloat("Target Power",
@@ -61,6 +93,7 @@ def main():
                                           minvalue=1)
     if target_power is None:
         messagebox.showinfo("Info", "No target power entered. Exiting.")
+        connector.stop()
         root.quit()
         return
     
@@ -70,46 +103,84 @@ def main():
     MIN_LASER_POWER = 10.0  # Minimum allowed laser power setting (10%) by default
     min_wavelength = 400
     max_wavelength = 840
+    if station is not None:
+        MIN_LASER_POWER = station.min_setting
+        min_wavelength = station.min_wavelength
+        max_wavelength = station.max_wavelength
     NumberOfSteps = 20   # Number of calibration steps
 
-    # Calibration data storage
-    calibration_results = []
+    # Past runs used to warm-start each step: the bundled test results and earlier
+    # exports, or only a station's own history
+    if station is not None:
+        calibration_store = station.calibration_store()
+    else:
+        calibration_store = CalibrationStore().load_directory(RESULTS_DIR).load_directory(".")
+
+    def check_connection():
+        nonlocal bench, core, stream, scheduler, engine, Laser
+        device_label.config(text=connector.status())
+        if not connector.connected:
+            root.after(250, check_connection)
+            return
+        bench = connector.bench
+        # Every instrument call now has a timeout; jobs run one at a time and can be aborted
+        core = ControlCore(bench)
+        Laser = bench.laser
+        # Continuous power-meter readings; feedback loops and measurements read through it
+        stream = PowerStream(bench).start()
+        # One worker per device, so filter moves overlap laser commands
+        scheduler = CommandScheduler(bench)
+        # Every sample of the session streams to disk; CSV exports are derived from the rows
+        session = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        store = ResultStore(f"results/{station.name}/{session}" if station is not None else f"results/{session}",
+                            clock=bench.clock)
+        # Calibration history and the routines themselves; the GUI only feeds them parameters
+        engine = Engine(bench, controller_name, interpolation, min_setting=MIN_LASER_POWER,
+                        min_wavelength=min_wavelength, max_wavelength=max_wavelength,
+                        stream=stream, scheduler=scheduler, calibration_store=calibration_store,
+                        store=store)
+        update_power_label()
+
+    def calibration_rows():
+        return engine.rows if engine is not None else []
+
+    def format_log_row(step, wavelength, laser_setting, measured_power):
+        value = f"{measured_power:.1f}" if not np.isnan(measured_power) else "N/A"
+        return (step, f"{wavelength:.1f}", f"{laser_setting:.1f}", value)
+
+    # Worker threads only queue rows; the main loop renders them in batches and auto-scrolls
+    results_log = BatchedTreeLog(root, tree, scrollbar, format_log_row, n_values=3)
 
     def log_entry(step, wavelength, laser_setting, measured_power):
-        value = f"{measured_power:.1f}" if measured_power is not None else "N/A"
-        item_id = tree.insert("", "end", values=(step, f"{wavelength:.1f}", f"{laser_setting:.1f}", value))
-        tree.see(item_id)  # Auto-scroll to new entry
+        results_log.log(step, wavelength, laser_setting, measured_power)
+        if live_plot is not None:
+            live_plot.add_point(step, wavelength, laser_setting, measured_power)
 
     def add_separator():
-        item_id = tree.insert("", "end", values=("─"*10, "─"*10, "─"*10, "─"*10))
-        tree.see(item_id)  # Auto-scroll to separator
+        results_log.separator()
+
+    def ensure_live_plot():
+        nonlocal live_plot
+        # matplotlib is only loaded when the first plot is needed
+        if live_plot is None:
+            try:
+                from live_plot import LivePlot
+            except ImportError:
+                return None
+            live_plot = LivePlot(root, plot_frame, stream, min_wavelength, max_wavelength)
+            live_plot.widget.pack(fill="both", expand=True)
+        return live_plot
 
     def plot_calibration_curve(cal_data):
         if not cal_data:
             messagebox.showerror("Error", "No calibration data to plot")
             return
-            
-        wavelengths = [item[0] for item in cal_data]
-        laser_settings = [item[1] for item in cal_data]
-        measured_powers = [item[2] for item in cal_data]
-
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(8, 10))
-        fig.suptitle("Calibration Curve")
-
-        ax1.plot(wavelengths, measured_powers, 'bo-', label="Measured Power")
-        ax1.set_xlabel("Wavelength (nm)")
-        ax1.set_ylabel("Power (µW)")
-        ax1.grid(True)
-
-        ax2.plot(wavelengths, laser_settings, 'ro-', label="Laser Setting")
-        ax2.set_xlabel("Wavelength (nm)")
-        ax2.set_ylabel("Setting (%)")
-        ax2.grid(True)
-
-        plt.tight_layout()
-        plt.show()
+        if ensure_live_plot() is None:
+            messagebox.showerror("Error", "Plotting needs matplotlib")
+            return
+        live_plot.show(cal_data)
 
-    def export_data(data, default_name):
+    def export_data(data, default_name, table=None):
         if not data:
             messagebox.showerror("Error", "No data to export")
             return
@@ -119,95 +190,103 @@ def main():
         try:
             with open(filename, 'w', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(["Wavelength (nm)", "Laser Setting (%)", "Measured Power (µW)"])
+                writer.writerow(CALIBRATION_HEADER)
                 writer.writerows(data)
+            if table is not None:
+                # All targets side by side, next to the single-target export
+                table_name = f"multi_target_{default_name}_{timestamp}.csv"
+                table.to_csv(table_name)
+                filename += f" and {table_name}"
             messagebox.showinfo("Export Successful", f"Data saved to {filename}")
         except Exception as e:
             messagebox.showerror("Export Error", str(e))
 
-    def create_interpolation():
-        if not calibration_results:
-            messagebox.showerror("Error", "No calibration data available")
-            return None
-        wavelengths = np.array([x[0] for x in calibration_results])
-        settings = np.array([x[1] for x in calibration_results])
-        return interp1d(wavelengths, settings, kind='linear', fill_value="extrapolate")
+    # Jobs run off the Tk thread: the label and dialogs are only touched from the main loop
+    def set_status(text):
+        root.after(0, lambda: status_label.config(text=text))
+
+    def show_error(title, message):
+        root.after(0, lambda: messagebox.showerror(title, message))
+
+    def show_timings():
+        if engine.timings is not None:
+            text = engine.timings.headline()
+            root.after(0, lambda: timing_label.config(text=text))
 
     # Calibration routine
     def run_calibration():
         try:
-            status_label.config(text="Starting calibration...")
-            tolerance = 0.5
-            max_iterations = 10
-
-            # Initial setup
-            Filter.short_setpoint = 495
-            Filter.long_setpoint = 505
-            Laser.set_power(max(30.0, MIN_LASER_POWER))
-            Laser.set_emission(True)
-            time.sleep(3)
-
-            # Initial calibration
-            current_setting = 30.0
-            for _ in range(max_iterations):
-                power = power_meter.read * 1e6
-                if abs(power - target_power) <= tolerance:
-                    break
-                current_setting *= target_power / power
-                current_setting = max(MIN_LASER_POWER, min(100, current_setting))
-                Laser.set_power(current_setting)
-                time.sleep(0.5)
-
-            initial_wl = (Filter.short_setpoint + Filter.long_setpoint) / 2
-            log_entry("Calibration", initial_wl, current_setting, power)
-            calibration_results.append((initial_wl, current_setting, power))
-            status_label.config(text=f"Calibrated {initial_wl:.1f}nm: {power:.1f} µW")
-            time.sleep(1)
-
-            # Wavelength sweep
-            for step in range(NumberOfSteps):
-                new_short = Filter.short_setpoint + 5
-                new_long = Filter.long_setpoint + 5
-                if (new_short + new_long)/2 > max_wavelength:
-                    break
-
-                Filter.short_setpoint = new_short
-                Filter.long_setpoint = new_long
-                time.sleep(0.5)
-
-                # Power adjustment
-                for _ in range(max_iterations):
-                    power = power_meter.read * 1e6
-                    if abs(power - target_power) <= tolerance:
-                        break
-                    current_setting *= target_power / power
-                    current_setting = max(MIN_LASER_POWER, min(100, current_setting))
-                    Laser.set_power(current_setting)
-                    time.sleep(0.5)
-
-                current_wl = (new_short + new_long)/2
-                log_entry("Calibration", current_wl, current_setting, power)
-                calibration_results.append((current_wl, current_setting, power))
-                status_label.config(text=f"Calibrated {current_wl:.1f}nm: {power:.1f} µW")
-                time.sleep(1)
+            set_status("Starting calibration...")
+            engine.calibrate(target_power, steps=NumberOfSteps, sampling=sampling,
+                             on_point=log_entry, on_status=set_status)
+            show_timings()
+            root.after(0, add_separator)
 
+        except TaskAborted:
+            set_status("Calibration aborted, emission off")
+        except Exception as e:
             Laser.set_emission(False)
-            status_label.config(text="Calibration complete")
-            plot_calibration_curve(calibration_results)
+            show_error("Calibration Error", str(e))
+            set_status("Calibration failed")
+
+    # One sweep for several target powers; the startup target stays the current calibration
+    def run_multi_calibration(targets):
+        try:
+            set_status(f"Starting calibration for {len(targets)} targets...")
+            engine.calibrate_targets(targets, steps=NumberOfSteps, on_point=log_entry, on_status=set_status)
+            show_timings()
             root.after(0, add_separator)
-            
+
+        except TaskAborted:
+            set_status("Calibration aborted, emission off")
         except Exception as e:
             Laser.set_emission(False)
-            messagebox.showerror("Calibration Error", str(e))
-            status_label.config(text="Calibration failed")
+            show_error("Calibration Error", str(e))
+            set_status("Calibration failed")
+
+    def start_multi_calibration():
+        answer = simpledialog.askstring("Target Powers",
+                                        "Enter target powers (µW), separated by commas:",
+                                        parent=root, initialvalue=f"{target_power:g}")
+        if answer is None:
+            return
+        try:
+            targets = [float(value) for value in answer.replace(";", ",").split(",") if value.strip()]
+        except ValueError:
+            messagebox.showerror("Error", "Target powers must be numbers")
+            return
+        targets = [target_power] + [t for t in targets if t != target_power]
+        if len(targets) < 2 or min(targets) <= 0:
+            messagebox.showerror("Error", "Enter at least one positive target besides "
+                                          f"{target_power:g} µW")
+            return
+        start_job("Calibration", run_multi_calibration, targets)
 
-    def start_measurement():
+    # Incremental recalibration: spot-check the current version, re-measure what drifted
+    def run_recalibration():
+        if engine.calibration.current is None:
+            show_error("Error", "Perform calibration first!")
+            return
+        try:
+            set_status("Starting incremental recalibration...")
+            engine.recalibrate(on_point=log_entry, on_status=set_status)
+            show_timings()
+            root.after(0, add_separator)
+
+        except TaskAborted:
+            set_status("Recalibration aborted, emission off")
+        except Exception as e:
+            Laser.set_emission(False)
+            show_error("Recalibration Error", str(e))
+            set_status("Recalibration failed")
+
+    def ask_sweep_parameters():
         # Get parameters for measurement: start, end, step
         start_wl = simpledialog.askfloat("Start Wavelength", "Enter start (nm):",
                                         parent=root,
                                         minvalue=min_wavelength, 
                                         maxvalue=max_wavelength)
-        if start_wl is None: return
+        if start_wl is None: return None
         
         root.lift()  # Bring window to front
         
@@ -215,7 +294,7 @@ def main():
                                       parent=root,
                                       minvalue=start_wl, 
                                       maxvalue=max_wavelength)
-        if end_wl is None: return
+        if end_wl is None: return None
         
         root.lift()
         
@@ -223,90 +302,128 @@ def main():
                                          parent=root,
                                          minvalue=1, 
                                          maxvalue=end_wl-start_wl)
-        if step_size is None: return
+        if step_size is None: return None
         
         # Ask for laser ON and OFF durations (in seconds)
         on_time = simpledialog.askfloat("Laser ON Time", "Enter laser ON time (seconds):",
                                         parent=root, minvalue=1)
-        if on_time is None: return
+        if on_time is None: return None
         
         off_time = simpledialog.askfloat("Laser OFF Time", "Enter laser OFF time (seconds):",
                                          parent=root, minvalue=1)
-        if off_time is None: return
-
-        # Start measurement thread with parameters
-        threading.Thread(target=lambda: run_measurement(start_wl, end_wl, step_size, on_time, off_time), daemon=True).start()
-
-    def run_measurement(start_wl, end_wl, step_size, on_time, off_time):
-        try:
-            if not calibration_results:
-                root.after(0, lambda: messagebox.showerror("Error", "Perform calibration first!"))
-                return
-
-            interp_func = create_interpolation()
-            calibrated_wls = [x[0] for x in calibration_results]
-            min_cal_wl, max_cal_wl = min(calibrated_wls), max(calibrated_wls)
-
-            current_wl = start_wl
-            num_steps = int((end_wl - start_wl)/step_size) + 1
-
-            for step_idx in range(num_steps):
-                short = round(current_wl - 5)
-                long = round(current_wl + 5)
-                if not (min_wavelength <= short <= max_wavelength-10):
-                    root.after(0, lambda: messagebox.showerror("Error", "Wavelength out of range!"))
-                    break
-
-                # Set filter for current wavelength
-                Filter.short_setpoint = short
-                Filter.long_setpoint = long
-                time.sleep(0.5)
-                # Set laser power based on calibration interpolation
-                setting = float(interp_func(current_wl))
-                setting = max(MIN_LASER_POWER, min(100, setting))
-                Laser.set_power(setting)
-
-                # Laser ON phase for specified duration
-                Laser.set_emission(True)
-                root.after(0, lambda wl=current_wl: status_label.config(
-                    text=f"Measuring {wl:.1f}nm - LASER ON for {on_time:.1f} sec"))
-                time.sleep(on_time)
-
-                # Laser OFF phase for specified duration
-                Laser.set_emission(False)
-                root.after(0, lambda wl=current_wl: status_label.config(
-                    text=f"Measuring {wl:.1f}nm - LASER OFF for {off_time:.1f} sec"))
-                time.sleep(off_time)
+        if off_time is None: return None
+        return start_wl, end_wl, step_size, on_time, off_time
 
-                # Log the measurement (no power meter reading available in open-loop mode)
-                root.after(0, lambda wl=current_wl, set_val=setting: log_entry("Measurement", wl, set_val, None))
+    def build_plan():
+        # The whole sweep is planned and validated before any hardware is touched
+        if engine is None or engine.calibration.current is None:
+            messagebox.showerror("Error", "Perform calibration first!")
+            return None
+        parameters = ask_sweep_parameters()
+        if parameters is None:
+            return None
+        measurement_target = None
+        if engine.table is not None:
+            # Any power in between the calibrated targets is interpolated from the table
+            measurement_target = simpledialog.askfloat("Measurement Target", "Enter target power (µW):",
+                                                       parent=root, minvalue=0.001,
+                                                       initialvalue=target_power)
+            if measurement_target is None:
+                return None
+        plan = engine.plan(*parameters, target_uW=measurement_target)
+        if not plan.valid:
+            messagebox.showerror("Error", plan.summary())
+            return None
+        return plan
 
-                if current_wl < min_cal_wl or current_wl > max_cal_wl:
-                    root.after(0, lambda: messagebox.showwarning(
-                        "Warning", "Extrapolating beyond calibration range!"))
+    def start_measurement():
+        plan = build_plan()
+        if plan is None:
+            return
+        if plan.warnings and not messagebox.askyesno("Warning", plan.summary() + "\n\nContinue?"):
+            return
 
-                current_wl += step_size
-                current_wl = round(current_wl, 1)
+        # Start the measurement job with the plan
+        start_job("Measurement", run_measurement, plan)
 
-            Laser.set_emission(False)
-            root.after(0, lambda: status_label.config(text="Measurement complete"))
+    def dry_run():
+        plan = build_plan()
+        if plan is None:
+            return
+        if messagebox.askyesno("Dry Run", plan.summary() + "\n\nExport the plan?"):
+            filename = f"sweep_plan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            try:
+                plan.to_csv(filename)
+                messagebox.showinfo("Export Successful", f"Plan saved to {filename}")
+            except Exception as e:
+                messagebox.showerror("Export Error", str(e))
+
+    def run_measurement(plan):
+        try:
+            on_time, off_time = plan.on_time, plan.off_time
+
+            def on_phase(step_idx, phase):
+                wl = float(plan.wavelengths[step_idx])
+                if phase == "on":
+                    remaining = plan.duration - plan.on_times[step_idx]
+                    text = f"Measuring {wl:.1f}nm - LASER ON for {on_time:.1f} sec ({remaining:.0f} s left)"
+                else:
+                    text = f"Measuring {wl:.1f}nm - LASER OFF for {off_time:.1f} sec"
+                set_status(text)
+
+            engine.measure(plan, on_point=log_entry, on_phase=on_phase, hold_mode=hold_mode,
+                           compensate_drift=compensate_drift)
+
+            drift = engine.drift.summary(engine.bench.time())
+            set_status(f"Measurement complete. {drift}")
+            show_timings()
             root.after(0, add_separator)
 
+        except TaskAborted:
+            set_status("Measurement aborted, emission off")
         except Exception as e:
             Laser.set_emission(False)
-            root.after(0, lambda: messagebox.showerror("Measurement Error", str(e)))
-            root.after(0, lambda: status_label.config(text="Measurement failed"))
+            show_error("Measurement Error", str(e))
+            set_status("Measurement failed")
+
+    def start_job(name, job, *args):
+        if core is None:
+            messagebox.showwarning("Not Connected", connector.status())
+            return
+        # Runs on the control core; a second job is refused instead of racing the first
+        try:
+            future = core.start(name, job, *args)
+        except Busy as e:
+            messagebox.showwarning("Busy", f"{e}. Abort it first.")
+            return
+        bridge.watch(future, on_error=lambda e: messagebox.showerror(f"{name} Error", str(e))
+                     if not isinstance(e, TaskAborted) else None)
+        # Each job starts with empty point plots; they fill in as the rows are logged
+        if ensure_live_plot() is not None:
+            live_plot.clear()
 
     def start_calibration():
-        threading.Thread(target=run_calibration, daemon=True).start()
+        start_job("Calibration", run_calibration)
+
+    def abort_job():
+        if core is None or not core.busy:
+            return
+        status_label.config(text=f"Aborting {core.job_name}...")
+        bridge.watch(core.abort(), on_done=lambda _: status_label.config(text="Aborted, emission off"),
+                     on_error=lambda e: messagebox.showerror("Abort Error", f"Emission off failed: {e}"))
 
     # Updated Exit function to turn off the laser and then close the application.
     def exit_application():
         # Cleanup while Tkinter is still alive
         try:
-            Laser.set_emission(False)
-            inst.close()
-            rm.close()
+            connector.stop()
+            if bench is not None:
+                Laser.set_emission(False)
+                stream.stop()
+                scheduler.close()
+                core.close()
+                engine.store.close()
+                bench.close()
             
             for item in tree.get_children():
                 tree.delete(item)
@@ -316,8 +433,6 @@ def main():
             if 'status_label' in globals():
                 status_label.destroy()
             
-            plt.close('all')
-            
         except Exception as e:
             messagebox.showwarning("Warning", f"Cleanup error: {e}")
         
@@ -333,21 +448,57 @@ def main():
         gc.collect()
 
     # Control buttons
-    ttk.Button(button_frame, text="Calibrate", 
-              command=lambda: threading.Thread(target=run_calibration, daemon=True).start(),
+    ttk.Button(button_frame, text="Calibrate", command=start_calibration,
+              width=15).pack(side="left", padx=5)
+    ttk.Button(button_frame, text="Multi-Target", command=start_multi_calibration,
+              width=15).pack(side="left", padx=5)
+    ttk.Button(button_frame, text="Recalibrate",
+              command=lambda: start_job("Recalibration", run_recalibration),
               width=15).pack(side="left", padx=5)
     ttk.Button(button_frame, text="Measure", command=start_measurement,
               width=15).pack(side="left", padx=5)
+    ttk.Button(button_frame, text="Dry Run", command=dry_run,
+              width=10).pack(side="left", padx=5)
+    ttk.Button(button_frame, text="Abort", command=abort_job,
+              width=10).pack(side="left", padx=5)
     ttk.Button(button_frame, text="Export Calibration", 
-              command=lambda: export_data(calibration_results, "calibration"),
+              command=lambda: export_data(calibration_rows(), "calibration",
+                                          engine.table if engine is not None else None),
               width=20).pack(side="left", padx=5)
     ttk.Button(button_frame, text="Plot Calibration", 
-              command=lambda: plot_calibration_curve(calibration_results),
+              command=lambda: plot_calibration_curve(calibration_rows()),
               width=20).pack(side="left", padx=5)
     ttk.Button(button_frame, text="Exit", command=exit_application,
               width=10).pack(side="right", padx=5)
 
+    check_connection()
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Laser Power Stabilization System")
+    parser.add_argument("--simulate", action="store_true", default=None,
+                        help="run against the simulated laser, filter and power meter")
+    parser.add_argument("--controller", choices=sorted(CONTROLLERS), default="proportional",
+                        help="feedback strategy used during calibration")
+    parser.add_argument("--sampling", choices=["fixed", "adaptive"], default="fixed",
+                        help="calibrate on the fixed 5 nm grid or refine where the curve bends")
+    parser.add_argument("--interpolation", choices=KINDS, default="linear",
+                        help="curve used to turn the calibration into measurement settings")
+    parser.add_argument("--hold", choices=["open", "closed"], default="open",
+                        help="keep the planned setting during ON phases or correct it from the power meter")
+    parser.add_argument("--drift-compensation", action="store_true",
+                        help="correct measurement settings for the drift seen since the calibration")
+    parser.add_argument("--stations", help="JSON stations file describing the rigs (see stations.py)")
+    parser.add_argument("--station", help="name of the rig in the stations file to run on")
+    args = parser.parse_args()
+    station = None
+    if args.stations or args.station:
+        if not (args.stations and args.station):
+            parser.error("--stations and --station go together")
+        try:
+            station = find_station(load_stations(args.stations), args.station)
+        except StationFileError as e:
+            parser.error(str(e))
+    main(simulate=args.simulate, controller_name=args.controller, sampling=args.sampling,
+         interpolation=args.interpolation, hold_mode=args.hold, compensate_drift=args.drift_compensation,
+         station=station)
\ No newline at end of file
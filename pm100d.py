@@ -0,0 +1,141 @@
+"""PM100D acquisition layer: on-device averaging, range and wavelength correction.
+
+Every power_meter.read is one USB round trip. Letting the meter average
+internally (one sample takes about 3 ms) turns many noisy single-shot reads
+into one reliable one, so the feedback loops need fewer round trips and fewer
+iterations to decide whether they are within tolerance. The averaging count is
+chosen from the measured single-shot noise and the precision the loop needs,
+capped by how long a single read may take: a loop that polls the meter for
+settling must still get enough reads within its settle time.
+
+The correction wavelength follows the filter centre: the photodiode's
+responsivity changes across the spectrum, and a fixed correction wavelength
+biases every reading away from it. Configuration values are cached, so setting
+them again costs no round trip. Device access is serialised with a lock, so a
+streaming thread and a feedback loop can share the meter.
+"""
+import math
+import threading
+
+SAMPLE_TIME = 0.003  # One on-device sample, per the PM100D manual
+MAX_AVERAGE_COUNT = 1000
+
+
+def averaging_count(noise_uW, precision_uW, max_count=MAX_AVERAGE_COUNT):
+    """On-device samples needed to bring single-shot noise down to precision_uW (1 sigma)."""
+    if precision_uW <= 0:
+        raise ValueError("precision_uW must be positive")
+    return int(min(max_count, max(1, math.ceil((noise_uW / precision_uW) ** 2))))
+
+
+class PowerMeter:
+    """ThorlabsPM100 (or simulated) meter with cached configuration; read returns W."""
+
+    def __init__(self, device):
+        self.device = device
+        self.average_count = None
+        self.wavelength = None
+        self.auto_range = None
+        self.range_upper = None
+        self.round_trips = 0
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # Everything not handled here goes straight to the driver
+        if name in ("device", "_lock"):
+            raise AttributeError(name)
+        return getattr(self.device, name)
+
+    def configure(self, average_count=None, wavelength=None, auto_range=None, range_upper=None):
+        """Sends only the settings that differ from the cached ones."""
+        if average_count is not None:
+            self.set_average_count(average_count)
+        if wavelength is not None:
+            self.set_wavelength(wavelength)
+        if range_upper is not None:
+            # A fixed range implies auto-ranging off
+            self.set_range(range_upper)
+        elif auto_range is not None and auto_range != self.auto_range:
+            with self._lock:
+                self.device.sense.power.dc.range.auto = "ON" if auto_range else "OFF"
+                self.auto_range = auto_range
+                self.round_trips += 1
+        return self
+
+    def set_average_count(self, count):
+        count = int(min(MAX_AVERAGE_COUNT, max(1, count)))
+        with self._lock:
+            if count == self.average_count:
+                return count
+            self.device.sense.average.count = count
+            self.average_count = count
+            self.round_trips += 1
+            return count
+
+    def set_wavelength(self, wavelength):
+        # The correction table is smooth; 1 nm resolution is plenty
+        wavelength = round(float(wavelength))
+        with self._lock:
+            if wavelength != self.wavelength:
+                self.device.sense.correction.wavelength = wavelength
+                self.wavelength = wavelength
+                self.round_trips += 1
+        return wavelength
+
+    def set_range(self, upper_W):
+        with self._lock:
+            if self.auto_range is not False:
+                self.device.sense.power.dc.range.auto = "OFF"
+                self.auto_range = False
+                self.round_trips += 1
+            if upper_W != self.range_upper:
+                self.device.sense.power.dc.range.upper = upper_W
+                self.range_upper = upper_W
+                self.round_trips += 1
+
+    @property
+    def measurement_time(self):
+        """Seconds the meter integrates for one read."""
+        return SAMPLE_TIME * (self.average_count or 1)
+
+    @property
+    def read(self):
+        with self._lock:
+            self.round_trips += 1
+            return self.device.read
+
+    def read_uW(self):
+        return self.read * 1e6
+
+    def start(self):
+        """Starts a measurement without waiting for it; collect it with fetch_uW()."""
+        with self._lock:
+            self.device.initiate.immediate()
+            self.round_trips += 1
+
+    def fetch_uW(self):
+        with self._lock:
+            self.round_trips += 1
+            return self.device.fetch * 1e6
+
+    def measure_noise(self, samples=10):
+        """Single-shot standard deviation (µW) of the current, steady power."""
+        with self._lock:
+            previous = self.average_count
+            self.set_average_count(1)
+            readings = [self.read_uW() for _ in range(max(2, samples))]
+            if previous is not None:
+                self.set_average_count(previous)
+        mean = sum(readings) / len(readings)
+        return math.sqrt(sum((r - mean) ** 2 for r in readings) / (len(readings) - 1))
+
+    def auto_average(self, precision_uW, samples=10, max_read_time=None):
+        """Measures the noise now and sets the averaging count to reach precision_uW.
+
+        With max_read_time (s), the count stops short where one read would take longer.
+        """
+        noise = self.measure_noise(samples)
+        max_count = MAX_AVERAGE_COUNT
+        if max_read_time is not None:
+            max_count = max(1, int(max_read_time / SAMPLE_TIME))
+        return self.set_average_count(averaging_count(noise, precision_uW, max_count))
@@ -0,0 +1,218 @@
+"""Versioned calibrations and incremental recalibration.
+
+A full sweep re-measures every wavelength even when the laser has hardly moved.
+Incremental recalibration instead reads the power at a sparse set of spot-check
+wavelengths with the stored settings, and runs the feedback loop only around
+spots whose power now misses the target by more than the tolerance and has
+moved by more than half of it since it was stored. The re-measured points are
+merged into a new version of the calibration; earlier versions stay available.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from controllers import MAX_LASER_POWER, converge
+
+# Summary of one incremental recalibration; elapsed is in bench (possibly virtual) seconds
+RecalibrationReport = namedtuple("RecalibrationReport", "checked drifted remeasured elapsed")
+
+
+class CalibrationVersion:
+    """One immutable version of a calibration curve."""
+
+    def __init__(self, number, rows, target_uW, parent=None, remeasured=(), created=None):
+        self.number = number
+        self.rows = sorted(rows)
+        self.target_uW = target_uW
+        self.parent = parent
+        self.remeasured = tuple(sorted(remeasured))
+        self.created = created or datetime.now()
+
+    @property
+    def wavelengths(self):
+        return [row[0] for row in self.rows]
+
+    def row_at(self, wavelength):
+        for row in self.rows:
+            if row[0] == wavelength:
+                return row
+        return None
+
+
+class VersionedCalibration:
+    """History of calibration versions; the newest one is current."""
+
+    def __init__(self):
+        self.versions = []
+
+    @property
+    def current(self):
+        return self.versions[-1] if self.versions else None
+
+    def commit(self, rows, target_uW, remeasured=None):
+        """Stores a full calibration as a new version."""
+        rows = list(rows)
+        if remeasured is None:
+            remeasured = [row[0] for row in rows]
+        version = CalibrationVersion(len(self.versions) + 1, rows, target_uW,
+                                     parent=self.current, remeasured=remeasured)
+        self.versions.append(version)
+        return version
+
+    def merge(self, updates):
+        """New version: the current rows with the given (wavelength, setting, power) rows replaced."""
+        current = self.current
+        merged = {row[0]: row for row in current.rows}
+        for row in updates:
+            merged[row[0]] = row
+        return self.commit(merged.values(), current.target_uW,
+                           remeasured=[row[0] for row in updates])
+
+
+def spot_check_wavelengths(wavelengths, spacing=25.0):
+    """Sparse subset of wavelengths about spacing nm apart, always including both ends."""
+    wavelengths = sorted(wavelengths)
+    if not wavelengths:
+        return []
+    spots = [wavelengths[0]]
+    for wavelength in wavelengths[1:-1]:
+        if wavelength - spots[-1] >= spacing:
+            spots.append(wavelength)
+    if wavelengths[-1] != spots[-1]:
+        spots.append(wavelengths[-1])
+    return spots
+
+
+def bind_wavelength(on_reading, wavelength):
+    """Turns on_reading(wavelength, setting, power, iteration) into converge's callback."""
+    if on_reading is None:
+        return None
+    return lambda setting, power, iteration: on_reading(wavelength, setting, power, iteration)
+
+
+def move_filter(bench, wavelength, bandwidth=10.0):
+    bench.set_passband(wavelength - bandwidth / 2, wavelength + bandwidth / 2)
+
+
+def calibrate_wavelengths(bench, wavelengths, target_uW, controller, settler, tolerance=0.5,
+                          max_iterations=10, initial_setting=30.0, settle_time=0.5,
+                          on_point=None, on_reading=None):
+    """Full sweep: converges to target_uW at every wavelength and returns the rows."""
+    rows = []
+    setting = initial_setting
+    try:
+        bench.laser.set_power(setting)
+        bench.laser.set_emission(True)
+        settler.emission_on()
+        first = True
+        for wavelength in wavelengths:
+            move_filter(bench, wavelength)
+            power = settler.wait(max_wait=3 if first else settle_time).power_uW
+            first = False
+            controller.start_step(wavelength)
+            setting, power, _ = converge(bench, controller, settler, target_uW, tolerance,
+                                         max_iterations, setting, power, settle_time,
+                                         bind_wavelength(on_reading, wavelength))
+            rows.append((wavelength, setting, power))
+            if on_point is not None:
+                on_point("Calibration", wavelength, setting, power)
+    finally:
+        bench.laser.set_emission(False)
+    return rows
+
+
+def incremental_recalibration(bench, calibration, controller, settler, tolerance=0.5,
+                              max_iterations=10, spacing=25.0, settle_time=0.5,
+                              jump_settle_time=2.0, on_point=None, on_reading=None):
+    """Spot-checks the current calibration and re-measures only drifted neighbourhoods.
+
+    Jumps between spot checks are long filter and laser moves, so they may settle
+    for up to jump_settle_time instead of settle_time. on_point(process,
+    wavelength, setting, power_uW) is called for every reading that ends up in
+    the log, on_reading(wavelength, setting, power_uW, iteration) for every
+    feedback reading. Returns (version, report); version is the merged
+    new version, or the unchanged current one when nothing drifted.
+    """
+    current = calibration.current
+    if current is None:
+        raise ValueError("No calibration to recalibrate")
+    target_uW = current.target_uW
+    wavelengths = current.wavelengths
+    spots = spot_check_wavelengths(wavelengths, spacing)
+    start = bench.time()
+
+    def drifted_from(setting, stored_power, power):
+        # Pinned points are judged against what they delivered before. The rest must
+        # miss the target and have moved by half the tolerance since they were stored:
+        # a point accepted near the edge of the band can read just outside it again
+        if setting >= MAX_LASER_POWER or setting <= controller.min_setting:
+            return abs(power - stored_power) > tolerance
+        return abs(power - target_uW) > tolerance and abs(power - stored_power) > tolerance / 2
+
+    def report_point(process, wavelength, setting, power):
+        if on_point is not None:
+            on_point(process, wavelength, setting, power)
+
+    def remeasure(wavelength, setting, power):
+        # Points pinned at 100 % that still fall short stay pinned; no iterations needed
+        if setting >= MAX_LASER_POWER and power < target_uW - tolerance:
+            return (wavelength, setting, power)
+        controller.start_step(wavelength)
+        setting, power, _ = converge(bench, controller, settler, target_uW, tolerance,
+                                     max_iterations, setting, power, settle_time,
+                                     bind_wavelength(on_reading, wavelength))
+        return (wavelength, setting, power)
+
+    updates = {}
+    drifted = []
+    scales = {}
+    try:
+        bench.laser.set_power(current.rows[0][1])
+        bench.laser.set_emission(True)
+        settler.emission_on()
+        first = True
+        for wavelength in spots:
+            _, stored_setting, stored_power = current.row_at(wavelength)
+            move_filter(bench, wavelength)
+            bench.laser.set_power(stored_setting)
+            power = settler.wait(max_wait=3 if first else jump_settle_time).power_uW
+            first = False
+            if drifted_from(stored_setting, stored_power, power):
+                # A long jump can look settled too early; confirm before re-measuring a neighbourhood
+                power = settler.wait(max_wait=settle_time).power_uW
+            report_point("Spot check", wavelength, stored_setting, power)
+            if not drifted_from(stored_setting, stored_power, power):
+                continue
+            # Already at this wavelength, so fix the spot right away
+            drifted.append(wavelength)
+            row = remeasure(wavelength, stored_setting, power)
+            updates[wavelength] = row
+            scales[wavelength] = row[1] / stored_setting if stored_setting > 0 else 1.0
+            report_point("Recalibration", *row)
+
+        # Re-measure every stored point between a drifted spot and its neighbouring spots
+        previous = spots[-1] if spots else None
+        for index, spot in enumerate(spots):
+            if spot not in scales:
+                continue
+            low = spots[index - 1] if index > 0 else spot
+            high = spots[index + 1] if index + 1 < len(spots) else spot
+            for wavelength in wavelengths:
+                if not low < wavelength < high or wavelength in updates:
+                    continue
+                _, stored_setting, _ = current.row_at(wavelength)
+                # Start from the stored setting scaled like the nearby spot had to be
+                setting = min(MAX_LASER_POWER, max(controller.min_setting, stored_setting * scales[spot]))
+                move_filter(bench, wavelength)
+                bench.laser.set_power(setting)
+                jump = abs(wavelength - previous) > spacing
+                power = settler.wait(max_wait=jump_settle_time if jump else settle_time).power_uW
+                previous = wavelength
+                row = remeasure(wavelength, setting, power)
+                updates[wavelength] = row
+                report_point("Recalibration", *row)
+    finally:
+        bench.laser.set_emission(False)
+
+    version = calibration.merge(list(updates.values())) if updates else current
+    report = RecalibrationReport(len(spots), tuple(drifted), len(updates), bench.time() - start)
+    return version, report
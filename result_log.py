@@ -0,0 +1,173 @@
+"""Thread-safe, batched logging into a ttk.Treeview.
+
+Worker threads only put rows on a queue; the Tk main loop drains it on a timer
+and applies a whole batch at once. Every row is kept in a compact, array-backed
+ResultHistory, while the Treeview only ever holds as many items as it has
+visible lines: scrolling re-renders that window from the history instead of
+keeping thousands of Tk items alive.
+"""
+import math
+import queue
+
+import numpy as np
+
+SEPARATOR = -1  # Label code of separator rows
+
+
+class ResultHistory:
+    """Growable table of (label, value, value, ...) rows; labels are interned, values float64."""
+
+    def __init__(self, n_values, capacity=1024):
+        self.n_values = n_values
+        self._labels = []
+        self._label_codes = {}
+        self._codes = np.empty(capacity, dtype=np.int32)
+        self._values = np.empty((capacity, n_values), dtype=float)
+        self._size = 0
+
+    def _grow(self):
+        capacity = 2 * len(self._codes)
+        codes = np.empty(capacity, dtype=np.int32)
+        codes[:self._size] = self._codes[:self._size]
+        values = np.empty((capacity, self.n_values), dtype=float)
+        values[:self._size] = self._values[:self._size]
+        self._codes, self._values = codes, values
+
+    def append(self, label, *values):
+        """Appends one row; None values are stored as NaN, label None is a separator."""
+        if self._size == len(self._codes):
+            self._grow()
+        if label is None:
+            code = SEPARATOR
+        else:
+            label = str(label)
+            code = self._label_codes.get(label)
+            if code is None:
+                code = self._label_codes[label] = len(self._labels)
+                self._labels.append(label)
+        self._codes[self._size] = code
+        self._values[self._size] = [math.nan if v is None else v for v in values]
+        self._size += 1
+
+    def row(self, index):
+        code = int(self._codes[index])
+        label = None if code == SEPARATOR else self._labels[code]
+        return (label,) + tuple(float(v) for v in self._values[index])
+
+    def rows(self, start=0, stop=None):
+        stop = self._size if stop is None else min(stop, self._size)
+        return [self.row(i) for i in range(max(0, start), stop)]
+
+    def values(self):
+        """(n, n_values) view of all values; separator rows are included as NaN rows."""
+        return self._values[:self._size]
+
+    def codes(self):
+        """Label code of every row, SEPARATOR for separators; labels[code] names it."""
+        return self._codes[:self._size]
+
+    @property
+    def labels(self):
+        return list(self._labels)
+
+    def __len__(self):
+        return self._size
+
+
+class BatchedTreeLog:
+    """Queue in front of a Treeview that shows a scrollable window of a ResultHistory.
+
+    format_row(label, *values) turns a stored row into the Treeview values.
+    log() and separator() may be called from any thread.
+    """
+
+    def __init__(self, root, tree, scrollbar, format_row, n_values, interval_ms=100,
+                 max_batch=5000):
+        self.root = root
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_row = format_row
+        self.history = ResultHistory(n_values)
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._first = 0
+        self._follow = True
+        self._visible = max(1, int(tree.cget("height")))
+        self._separator = ("─" * 10,) * len(tree["columns"])
+        self._items = [tree.insert("", "end", values=("",) * len(tree["columns"]))
+                       for _ in range(self._visible)]
+        for item in self._items:
+            tree.detach(item)
+
+        # The scrollbar now drives the window, not the Treeview's own view
+        scrollbar.configure(command=self._on_scroll)
+        tree.configure(yscrollcommand="")
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            tree.bind(sequence, self._on_wheel)
+        self._update_scrollbar()
+        root.after(interval_ms, self._drain)
+
+    def log(self, label, *values):
+        self._queue.put((label, values))
+
+    def separator(self):
+        self._queue.put((None, (None,) * self.history.n_values))
+
+    def _drain(self):
+        added = 0
+        try:
+            while added < self.max_batch:
+                label, values = self._queue.get_nowait()
+                self.history.append(label, *values)
+                added += 1
+        except queue.Empty:
+            pass
+        if added:
+            if self._follow:
+                self._first = max(0, len(self.history) - self._visible)
+            self._render()
+        try:
+            self.root.after(self.interval_ms, self._drain)
+        except Exception:
+            pass  # The window is being destroyed
+
+    def _render(self):
+        rows = self.history.rows(self._first, self._first + self._visible)
+        for index, item in enumerate(self._items):
+            if index < len(rows):
+                label = rows[index][0]
+                values = self._separator if label is None else self.format_row(*rows[index])
+                self.tree.item(item, values=values)
+                self.tree.move(item, "", index)
+            else:
+                self.tree.detach(item)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        total = len(self.history)
+        if total <= self._visible:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self._first / total, (self._first + self._visible) / total)
+
+    def _scroll_to(self, first):
+        last_start = max(0, len(self.history) - self._visible)
+        self._first = int(min(max(0, first), last_start))
+        # Stick to new rows only while the view is at the bottom
+        self._follow = self._first == last_start
+        self._render()
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self._scroll_to(round(float(amount) * len(self.history)))
+        elif action == "scroll":
+            step = self._visible if unit == "pages" else 1
+            self._scroll_to(self._first + int(amount) * step)
+
+    def _on_wheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self._scroll_to(self._first - 3)
+        else:
+            self._scroll_to(self._first + 3)
+        return "break"
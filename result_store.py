@@ -0,0 +1,330 @@
+"""Append-only columnar storage of every sample a run produces.
+
+A store is a directory with one raw little-endian binary file per column (time,
+wavelength, setting, power, target, iteration, phase, station) and a small
+meta.json holding the column types and the interned phase and station labels. Samples are appended
+to in-memory buffers and written to the end of every column file in batches,
+at most flush_interval seconds apart, each batch followed by an fsync, so a
+crash loses at most the last unflushed batch. A torn write leaves the columns
+at different lengths; readers only use the records complete in every column,
+and reopening the store for appending cuts the rest off.
+
+Reloading memory-maps the column files, so opening a long run costs next to
+nothing until a column is touched. CSV is only a derived view: export writes
+the classic three-column format with a clean UTF-8 header, and the CSVs in
+test-results/ import into stores.
+
+Several stations can share one store (see stations.py): each writes through a
+StationStore, which tags its records with the station name, shifts its bench
+times onto the store's time base and keeps its side files (timings, step
+statistics) in a subdirectory of its own. Stores written before the station
+column existed read as having no station and get the column when reopened for
+appending.
+
+    python result_store.py import test-results/calibration_20250401_144718.csv results/imported
+    python result_store.py export results/session_20250401_144718 out.csv [--phase Calibration] [--station A]
+    python result_store.py info results/session_20250401_144718
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+COLUMNS = {
+    "time": "<f8",        # bench seconds; epoch = time + meta["epoch_offset"]
+    "wavelength": "<f8",  # nm
+    "setting": "<f8",     # laser setting, %
+    "power": "<f8",       # µW, NaN when not measured
+    "target": "<f8",      # µW, NaN when the phase has none
+    "iteration": "<i4",   # feedback iteration at this wavelength, 0 for the first reading
+    "phase": "u1",        # code into meta["phases"]
+    "station": "u1",      # code into meta["stations"], 0 (the empty label) for no station
+}
+CSV_HEADER = ["Wavelength (nm)", "Laser Setting (%)", "Measured Power (µW)"]
+META = "meta.json"
+
+
+class ResultStore:
+    """Append-only columnar store in one directory."""
+
+    def __init__(self, path, flush_every=256, flush_interval=1.0, fsync=True, clock=None, readonly=False):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._buffers = {name: [] for name in COLUMNS}
+        self._files = {}
+        self._last_flush = time.monotonic()
+        self._clock = clock if clock is not None else time
+
+        meta_path = os.path.join(path, META)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+        elif readonly:
+            raise FileNotFoundError(f"No result store at {path}")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {"columns": COLUMNS, "phases": [], "stations": [""],
+                         "epoch_offset": time.time() - self._clock.time()}
+            self._write_meta()
+        self.meta.setdefault("stations", [""])
+        self._codes = {label: code for code, label in enumerate(self.meta["phases"])}
+        self._station_codes = {label: code for code, label in enumerate(self.meta["stations"])}
+        self._flushed = self._complete_records()
+        if not readonly:
+            if "station" not in self.meta["columns"]:
+                # Written before stations existed: every complete record gets no station
+                with open(self._column_path("station"), "wb") as f:
+                    f.write(bytes(self._flushed))
+                self.meta["columns"] = COLUMNS
+                self._write_meta()
+            # A torn last batch is cut back to the records complete in every column
+            for name, dtype in COLUMNS.items():
+                file = open(self._column_path(name), "ab")
+                file.truncate(self._flushed * np.dtype(dtype).itemsize)
+                self._files[name] = file
+
+    @classmethod
+    def open(cls, path):
+        """Opens an existing store for reading."""
+        return cls(path, readonly=True)
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _complete_records(self):
+        sizes = []
+        for name, dtype in self.meta["columns"].items():
+            column_path = self._column_path(name)
+            size = os.path.getsize(column_path) if os.path.exists(column_path) else 0
+            sizes.append(size // np.dtype(dtype).itemsize)
+        return min(sizes)
+
+    def _write_meta(self):
+        # Replaced atomically; a label is always on disk before the first sample using it
+        temporary = os.path.join(self.path, META + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, indent=1, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, os.path.join(self.path, META))
+
+    def _label_code(self, labels, codes, label):
+        code = codes.get(label)
+        if code is None:
+            code = codes[label] = len(self.meta[labels])
+            self.meta[labels].append(label)
+            self._write_meta()
+        return code
+
+    def append(self, phase, wavelength, setting, power, iteration=0, target_uW=None, t=None, station=None):
+        """Buffers one sample; power and target_uW may be None."""
+        self.append_many(phase, [self._clock.time() if t is None else t], wavelength, setting,
+                         [power], iteration, target_uW, station)
+
+    def append_many(self, phase, times, wavelength, setting, powers, iteration=0, target_uW=None,
+                    station=None):
+        """Buffers a block of readings taken at one wavelength and setting, e.g. a whole ON phase."""
+        if self.readonly:
+            raise ValueError("Result store opened read-only")
+        n = len(times)
+        with self._lock:
+            code = self._label_code("phases", self._codes, phase)
+            station_code = self._label_code("stations", self._station_codes, station or "")
+            buffers = self._buffers
+            buffers["time"].extend(float(t) for t in times)
+            buffers["wavelength"].extend([float(wavelength)] * n)
+            buffers["setting"].extend([math.nan if setting is None else float(setting)] * n)
+            buffers["power"].extend(math.nan if p is None else float(p) for p in powers)
+            buffers["target"].extend([math.nan if target_uW is None else float(target_uW)] * n)
+            buffers["iteration"].extend([int(iteration)] * n)
+            buffers["phase"].extend([code] * n)
+            buffers["station"].extend([station_code] * n)
+            if (len(buffers["time"]) >= self.flush_every
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        pending = len(self._buffers["time"])
+        if not pending:
+            return
+        for name, dtype in COLUMNS.items():
+            file = self._files[name]
+            file.write(np.asarray(self._buffers[name], dtype=dtype).tobytes())
+            file.flush()
+            self._buffers[name] = []
+        if self.fsync:
+            for file in self._files.values():
+                os.fsync(file.fileno())
+        self._flushed += pending
+
+    def close(self):
+        if self.readonly:
+            return
+        self.flush()
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+        self.readonly = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._flushed
+
+    @property
+    def phases(self):
+        return list(self.meta["phases"])
+
+    @property
+    def stations(self):
+        return [station for station in self.meta["stations"] if station]
+
+    def column(self, name):
+        """Flushed values of one column, memory-mapped read-only."""
+        dtype = np.dtype(COLUMNS[name])
+        n = self._flushed
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        if name not in self.meta["columns"]:
+            return np.zeros(n, dtype=dtype)  # Station of a store written before stations existed
+        return np.memmap(self._column_path(name), dtype=dtype, mode="r", shape=(n,))
+
+    def columns(self):
+        return {name: self.column(name) for name in COLUMNS}
+
+    def select(self, phase=None, station=None):
+        """Boolean mask of the records of one phase and/or station (all records for None)."""
+        mask = np.ones(len(self), dtype=bool)
+        for name, codes, label in (("phase", self._codes, phase), ("station", self._station_codes, station)):
+            if label is not None:
+                code = codes.get(label)
+                if code is None:
+                    return np.zeros(len(self), dtype=bool)
+                mask &= self.column(name) == code
+        return mask
+
+    def rows(self, phase=None, station=None):
+        """(wavelength, setting, power) rows, optionally of one phase and/or station only."""
+        mask = self.select(phase, station)
+        return list(zip(*(self.column(name)[mask].tolist() for name in ("wavelength", "setting", "power"))))
+
+    def to_csv(self, path, phase=None, station=None):
+        """Writes the classic three-column export; NaN powers become empty cells."""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
+            for wavelength, setting, power in self.rows(phase, station):
+                writer.writerow([f"{wavelength:.6g}", f"{setting:.6g}",
+                                 "" if math.isnan(power) else f"{power:.6g}"])
+
+
+class StationStore:
+    """One station's writer into a shared ResultStore, usable wherever a ResultStore is.
+
+    Records carry the station's name; times from the station's clock are
+    shifted onto the store's time base. path is the station's subdirectory,
+    where the engine puts its side files.
+    """
+
+    def __init__(self, store, station, clock=None):
+        if not station:
+            raise ValueError("A station needs a name")
+        self.store = store
+        self.station = station
+        self.path = os.path.join(store.path, station)
+        os.makedirs(self.path, exist_ok=True)
+        self._clock = clock if clock is not None else time
+        self._shift = time.time() - self._clock.time() - store.meta["epoch_offset"]
+
+    def append(self, phase, wavelength, setting, power, iteration=0, target_uW=None, t=None):
+        t = self._clock.time() if t is None else t
+        self.store.append(phase, wavelength, setting, power, iteration, target_uW, t + self._shift, self.station)
+
+    def append_many(self, phase, times, wavelength, setting, powers, iteration=0, target_uW=None):
+        self.store.append_many(phase, np.asarray(times, dtype=float) + self._shift, wavelength, setting,
+                               powers, iteration, target_uW, self.station)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        """Flushes; the shared store stays open for the other stations."""
+        self.store.flush()
+
+    def __len__(self):
+        return int(self.select().sum())
+
+    def select(self, phase=None):
+        return self.store.select(phase, self.station)
+
+    def rows(self, phase=None):
+        return self.store.rows(phase, self.station)
+
+    def to_csv(self, path, phase=None):
+        self.store.to_csv(path, phase, self.station)
+
+
+def import_csv(csv_path, store_path, phase="Calibration", target_uW=None):
+    """Copies a calibration/measurement CSV export into a (new or existing) store."""
+    from calibration_store import timestamp_from_name
+    from simulation import read_calibration_csv
+
+    rows = read_calibration_csv(csv_path)
+    stamp = timestamp_from_name(csv_path)
+    # Exports carry no times; rows get the file's timestamp, one second apart
+    start = stamp.timestamp() if stamp is not None else os.path.getmtime(csv_path)
+    with ResultStore(store_path, fsync=False) as store:
+        offset = store.meta["epoch_offset"]
+        for index, (wavelength, setting, power) in enumerate(rows):
+            store.append(phase, wavelength, setting, power, target_uW=target_uW,
+                         t=start + index - offset)
+    return ResultStore.open(store_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import, export and inspect result stores")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="copy CSV exports into a store")
+    importer.add_argument("csv", nargs="+")
+    importer.add_argument("store")
+    importer.add_argument("--phase", default="Calibration")
+    exporter = commands.add_parser("export", help="write a store (or one phase of it) as CSV")
+    exporter.add_argument("store")
+    exporter.add_argument("csv")
+    exporter.add_argument("--phase")
+    exporter.add_argument("--station")
+    info = commands.add_parser("info", help="list the phases, stations and record counts of a store")
+    info.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        for path in args.csv:
+            store = import_csv(path, args.store, args.phase)
+        print(f"{len(store)} records in {args.store}")
+    elif args.command == "export":
+        ResultStore.open(args.store).to_csv(args.csv, args.phase, args.station)
+    else:
+        store = ResultStore.open(args.store)
+        print(f"{len(store)} records")
+        for phase in store.phases:
+            print(f"  {phase}: {int(store.select(phase).sum())}")
+        for station in store.stations:
+            print(f"  station {station}: {int(store.select(station=station).sum())}")
@@ -0,0 +1,88 @@
+"""Per-device command scheduling for the laser, the filter and the power meter.
+
+Each instrument gets one worker thread, so commands to the same device keep
+their order while commands to different devices run at the same time: the
+Varia can move while the Extreme takes its new setting and the PM100D gets its
+new correction wavelength. Callers only join where there is a real
+dependency. Emission is the one command with a fixed dependency: it is only
+switched on after every pending filter and laser command has finished.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+DEVICES = ("laser", "filter", "meter")
+
+
+def _done(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class CommandScheduler:
+    """Issues commands to the bench devices, one ordered queue per device."""
+
+    def __init__(self, bench, threaded=True):
+        self.bench = bench
+        self.threaded = threaded
+        self._workers = {}
+        if threaded:
+            self._workers = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+                             for name in DEVICES}
+        self._pending = {name: _done() for name in DEVICES}
+
+    def submit(self, device, function, *args):
+        """Queues function(*args) on device's worker and returns its Future."""
+        if not self.threaded:
+            try:
+                future = _done(function(*args))
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+        else:
+            future = self._workers[device].submit(function, *args)
+        self._pending[device] = future
+        return future
+
+    def move_filter(self, short, long):
+        """Moves the Varia and retunes the meter; the Future's result is when the move was sent."""
+        filter = self.bench.filter
+
+        def move():
+            filter.short_setpoint = short
+            filter.long_setpoint = long
+            return self.bench.time()
+
+        moved = self.submit("filter", move)
+        set_wavelength = getattr(self.bench.power_meter, "set_wavelength", None)
+        if set_wavelength is not None:
+            self.submit("meter", set_wavelength, (short + long) / 2)
+        return moved
+
+    def set_power(self, setting):
+        return self.submit("laser", self.bench.laser.set_power, setting)
+
+    def set_emission(self, on):
+        """Switches emission, on only once every pending filter and laser command is done."""
+        if on:
+            self.join("filter", "laser")
+        future = self.submit("laser", self.bench.laser.set_emission, on)
+        # Callers rely on the emission state right after this returns
+        return future.result()
+
+    def join(self, *devices):
+        """Waits for the pending commands of devices (all by default); re-raises their errors."""
+        futures = [self._pending[name] for name in (devices or DEVICES)]
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def close(self):
+        for worker in self._workers.values():
+            worker.shutdown(wait=True)
+        self._workers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
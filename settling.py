@@ -0,0 +1,118 @@
+"""Adaptive settling: poll the power meter until the reading stops moving.
+
+Instead of a fixed sleep after every laser or filter change, the detector reads
+the PM100D at a high rate and returns as soon as the last few readings agree
+within a noise band and show no remaining trend. The old fixed sleep is passed
+in as max_wait and only acts as an upper bound; whatever is left of it is
+reported as time saved.
+
+The trend is judged against the readings' own noise (see
+stabilization.trend_significant), not against the band: at a few µW a ramp
+still rising by a few percent per window stays inside an absolute band of
+0.5 µW. After emission_on() the emission ramp additionally rules out settling
+for emission_wait seconds: its tail is too slow to show as a trend within a
+window, yet at 100 µW still off by more than the tolerance seconds in. A wait
+then starts with the rest of the ramp and its max_wait counts from the end.
+"""
+import math
+from collections import deque, namedtuple
+
+import numpy as np
+
+from acquisition import window_stats
+from instrumentation import span
+from stabilization import trend_significant
+
+EMISSION_WAIT = 4.0  # s, eight time constants of the emission turn-on ramp: within 0.05 % of its end
+
+# power_uW: mean of the settled window (or of the last window when max_wait ran out)
+Settle = namedtuple("Settle", "power_uW elapsed saved settled")
+
+
+class SettlingDetector:
+    """Waits for the power meter reading to settle within band_uW (plus rel_band of the reading)."""
+
+    def __init__(self, bench, band_uW=0.5, rel_band=0.0, window=5, poll_interval=0.02, min_wait=0.05,
+                 stream=None, emission_wait=EMISSION_WAIT):
+        self.bench = bench
+        # Optional acquisition.PowerStream; while it runs, readings come from it
+        self.stream = stream
+        self.band_uW = band_uW
+        self.rel_band = rel_band
+        self.window = max(2, int(window))
+        self._base_window = self.window
+        self.poll_interval = poll_interval
+        # Commands take a moment to reach the instrument; never call it settled before this
+        self.min_wait = min_wait
+        self.emission_wait = emission_wait
+        self._ramp_end = None
+        self.total_saved = 0.0
+        self._pending_saved = 0.0
+
+    def set_averaging(self, count):
+        """Shortens the window for reads the meter averages over count samples.
+
+        Such a read is about sqrt(count) times less noisy, so fewer of them show
+        as much; with a long count the full window would not fit in max_wait.
+        """
+        self.window = max(2, math.ceil(self._base_window / math.sqrt(max(1, count))))
+
+    def emission_on(self):
+        """Call as the emission is switched on: the next wait first waits out emission_wait s."""
+        self._ramp_end = self.bench.time() + self.emission_wait
+
+    def read_uW(self):
+        if self.stream is not None and self.stream.running:
+            return self.stream.read_uW()
+        return self.bench.power_meter.read * 1e6
+
+    def is_settled(self, times, history):
+        # A slow exponential tail can look flat within one short window, so the
+        # last window must also agree with the one before it, and neither the two
+        # together nor the last one alone (the laser and the filter can overshoot
+        # in turn, bending the longer one) show a trend beyond the noise
+        previous, latest = history[:self.window], history[self.window:]
+        mean = sum(latest) / len(latest)
+        band = self.band_uW + self.rel_band * abs(mean)
+        if max(latest) - min(latest) > band or abs(mean - sum(previous) / len(previous)) > band / 4:
+            return False
+        times, history = np.asarray(times), np.asarray(history)
+        return not (trend_significant(window_stats(times, history))
+                    or trend_significant(window_stats(times[self.window:], history[self.window:])))
+
+    def wait(self, max_wait):
+        """Polls until the reading is stable or max_wait seconds have passed."""
+        with span("settle"):
+            return self._wait(max_wait)
+
+    def _wait(self, max_wait):
+        start = begin = self.bench.time()
+        history = deque(maxlen=2 * self.window)
+        times = deque(maxlen=2 * self.window)
+        if self._ramp_end is not None and start < self._ramp_end:
+            # Sleep through the ramp, reading only over its last two windows
+            self.bench.sleep(max(0.0, self._ramp_end - start - history.maxlen * self.poll_interval))
+            begin = self._ramp_end
+        settled = False
+        while True:
+            history.append(self.read_uW())
+            now = self.bench.time()
+            times.append(now)
+            if len(history) == history.maxlen and now - start >= self.min_wait and now >= begin:
+                if self.is_settled(list(times), list(history)):
+                    settled = True
+                    break
+            if now - begin + self.poll_interval > max_wait:
+                break
+            self.bench.sleep(self.poll_interval)
+        elapsed = self.bench.time() - start
+        saved = max(0.0, max_wait - (self.bench.time() - begin))
+        self.total_saved += saved
+        self._pending_saved += saved
+        latest = list(history)[-self.window:]
+        return Settle(sum(latest) / len(latest), elapsed, saved, settled)
+
+    def take_saved(self):
+        """Returns the time saved since the previous call, e.g. per calibration step."""
+        saved, self._pending_saved = self._pending_saved, 0.0
+        return saved
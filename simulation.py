@@ -0,0 +1,322 @@
+"""Physics-based stand-ins for the SuperK Extreme, SuperK Varia and PM100D.
+
+The simulated instruments share a VirtualClock: sleeping advances virtual time
+instantly, so a full calibration sweep runs in milliseconds while laser, filter
+and emission settling, drift and noise still behave as if time had passed.
+The spectral power curve is seeded from the calibration CSVs in test-results/.
+Default time constants are chosen so the fixed sleeps of the original control
+loops (3 s after emission on, 0.5 s after a laser or filter change) cover about
+six time constants, i.e. what those sleeps were sized for on the bench.
+"""
+import csv
+import glob
+import math
+import os
+import random
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from devices import Bench
+from pm100d import SAMPLE_TIME, PowerMeter
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-results")
+
+# Passband width (nm) the calibration files were recorded with: short/long setpoints 10 nm apart
+REFERENCE_BANDWIDTH = 10.0
+
+
+class VirtualClock:
+    """Clock whose sleep advances time instead of blocking."""
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+
+def read_calibration_csv(path):
+    """Returns (wavelength, setting, power_uW) rows of a calibration export."""
+    rows = []
+    # The µ in the header is encoding-mangled in older exports; only the numbers matter
+    with open(path, newline='', encoding='latin-1') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) < 3:
+                continue
+            try:
+                rows.append((float(row[0]), float(row[1]), float(row[2])))
+            except ValueError:
+                continue
+    return rows
+
+
+def default_calibration_files():
+    return sorted(glob.glob(os.path.join(RESULTS_DIR, "calibration_*.csv")))
+
+
+class SpectralModel:
+    """Power at the meter as a function of passband centre, bandwidth and laser setting.
+
+    full_power_uW is the power through a REFERENCE_BANDWIDTH passband at 100 %.
+    Below 100 % the output follows ((setting - threshold) / (100 - threshold)) ** exponent,
+    i.e. nothing below the lasing threshold and a mildly super-linear rise above it.
+    """
+
+    def __init__(self, wavelengths, full_power_uW, threshold=3.0, exponent=1.1):
+        order = np.argsort(wavelengths)
+        self.wavelengths = np.asarray(wavelengths, dtype=float)[order]
+        self.full_power_uW = np.asarray(full_power_uW, dtype=float)[order]
+        self.threshold = threshold
+        self.exponent = exponent
+
+    def transfer(self, setting):
+        fraction = (setting - self.threshold) / (100.0 - self.threshold)
+        fraction = min(1.0, max(0.0, fraction))
+        return fraction ** self.exponent
+
+    def inverse_transfer(self, fraction):
+        fraction = min(1.0, max(0.0, fraction))
+        return self.threshold + (100.0 - self.threshold) * fraction ** (1.0 / self.exponent)
+
+    def spectral_power(self, wavelength):
+        return float(np.interp(wavelength, self.wavelengths, self.full_power_uW))
+
+    def power(self, center, bandwidth, setting):
+        scale = max(0.0, bandwidth) / REFERENCE_BANDWIDTH
+        return self.spectral_power(center) * scale * self.transfer(setting)
+
+    def setting_for(self, wavelength, target_uW):
+        """Exact setting that yields target_uW at wavelength, or None if out of reach."""
+        full = self.spectral_power(wavelength)
+        if full <= 0 or target_uW > full:
+            return None
+        return self.inverse_transfer(target_uW / full)
+
+    @classmethod
+    def from_csv(cls, paths=None, min_setting=10.0, **kwargs):
+        """Seeds the spectral curve from calibration exports.
+
+        Every row gives one estimate of the full-power spectrum (power divided by
+        the transfer of its setting); rows below min_setting are skipped because the
+        laser does not follow such small settings. Estimates are combined per
+        wavelength with the median.
+        """
+        if paths is None:
+            paths = default_calibration_files()
+        model = cls([0.0, 1.0], [0.0, 0.0], **kwargs)
+        estimates = {}
+        for path in paths:
+            for wavelength, setting, power in read_calibration_csv(path):
+                if setting < min_setting or setting > 100 or power <= 0:
+                    continue
+                transfer = model.transfer(setting)
+                if transfer > 0:
+                    estimates.setdefault(wavelength, []).append(power / transfer)
+        if not estimates:
+            return cls.synthetic(**kwargs)
+        wavelengths = sorted(estimates)
+        full_power = [float(np.median(estimates[wl])) for wl in wavelengths]
+        return cls(wavelengths, full_power, **kwargs)
+
+    @classmethod
+    def synthetic(cls, **kwargs):
+        """Smooth supercontinuum-like curve used when no calibration files are available."""
+        wavelengths = np.arange(400.0, 845.0, 5.0)
+        blue_edge = 1.0 / (1.0 + np.exp(-(wavelengths - 470.0) / 18.0))
+        red_roll_off = 1.0 / (1.0 + np.exp((wavelengths - 790.0) / 20.0))
+        full_power = 15.0 + 520.0 * blue_edge * red_roll_off
+        return cls(wavelengths, full_power, **kwargs)
+
+
+class _FirstOrder:
+    """First-order lag: the output relaxes towards the last command with time constant tau."""
+
+    def __init__(self, clock, value, tau):
+        self.clock = clock
+        self.tau = tau
+        self._start = value
+        self.target = value
+        self._t_cmd = clock.time()
+
+    def value(self):
+        if self.tau <= 0:
+            return self.target
+        elapsed = self.clock.time() - self._t_cmd
+        return self.target + (self._start - self.target) * math.exp(-elapsed / self.tau)
+
+    def command(self, target):
+        self._start = self.value()
+        self.target = target
+        self._t_cmd = self.clock.time()
+
+
+class SimulatedExtreme:
+    """SuperK Extreme stand-in: set_power (percent) and set_emission."""
+
+    def __init__(self, clock, laser_tau=0.08, emission_tau=0.5):
+        self.clock = clock
+        self._setting = _FirstOrder(clock, 0.0, laser_tau)
+        self._emission = _FirstOrder(clock, 0.0, emission_tau)
+        self.emission = False
+
+    @property
+    def power(self):
+        return self._setting.target
+
+    def set_power(self, power):
+        self._setting.command(min(100.0, max(0.0, float(power))))
+
+    def set_emission(self, value):
+        self.emission = bool(value)
+        if self.emission:
+            self._emission.command(1.0)
+        else:
+            # Emission stops immediately; only the turn-on ramps up
+            self._emission = _FirstOrder(self.clock, 0.0, self._emission.tau)
+
+    def effective_setting(self):
+        return self._setting.value()
+
+    def emission_level(self):
+        return self._emission.value()
+
+    def print_status(self):
+        print(f"Simulated SuperK Extreme: power {self.power:.1f} %, "
+              f"emission {'on' if self.emission else 'off'}")
+
+
+class SimulatedVaria:
+    """SuperK Varia stand-in with short/long setpoints that move with a settling lag."""
+
+    def __init__(self, clock, short_setpoint=527.0, long_setpoint=537.0, filter_tau=0.1):
+        self._short = _FirstOrder(clock, float(short_setpoint), filter_tau)
+        self._long = _FirstOrder(clock, float(long_setpoint), filter_tau)
+
+    @property
+    def short_setpoint(self):
+        return self._short.target
+
+    @short_setpoint.setter
+    def short_setpoint(self, value):
+        self._short.command(float(value))
+
+    @property
+    def long_setpoint(self):
+        return self._long.target
+
+    @long_setpoint.setter
+    def long_setpoint(self, value):
+        self._long.command(float(value))
+
+    def passband(self):
+        short, long = self._short.value(), self._long.value()
+        return (short + long) / 2, long - short
+
+    def print_status(self):
+        print(f"Simulated SuperK Varia: short {self.short_setpoint:.1f} nm, "
+              f"long {self.long_setpoint:.1f} nm")
+
+
+class SimulatedPM100D:
+    """PM100D stand-in; read returns the power in W like ThorlabsPM100.read.
+
+    Supports the settings the acquisition layer uses: sense.average.count (each
+    sample adds SAMPLE_TIME and averages the noise down), sense.correction.wavelength,
+    sense.power.dc.range.auto/upper, and initiate.immediate() followed by fetch.
+    The spectral model already is what the bench meter read, so readings are only
+    biased once a correction wavelength is set and it differs from the filter centre;
+    the photodiode responsivity is taken as proportional to wavelength.
+    """
+
+    def __init__(self, model, laser, filter, clock, noise=0.002, noise_floor_uW=0.01,
+                 drift_per_hour=0.0, read_latency=0.003, seed=0):
+        self.model = model
+        self.laser = laser
+        self.filter = filter
+        self.clock = clock
+        self.noise = noise
+        self.noise_floor_uW = noise_floor_uW
+        self.drift_per_hour = drift_per_hour
+        self.read_latency = read_latency
+        self._rng = random.Random(seed)
+        self._t0 = clock.time()
+        self.sense = SimpleNamespace(
+            average=SimpleNamespace(count=1),
+            correction=SimpleNamespace(wavelength=None),
+            power=SimpleNamespace(dc=SimpleNamespace(range=SimpleNamespace(auto="ON", upper=None))))
+        self.initiate = SimpleNamespace(immediate=self._initiate)
+        self._started = None
+
+    def gain(self):
+        hours = (self.clock.time() - self._t0) / 3600.0
+        return 1.0 + self.drift_per_hour * hours
+
+    def true_power_uW(self):
+        center, bandwidth = self.filter.passband()
+        power = self.model.power(center, bandwidth, self.laser.effective_setting())
+        return power * self.laser.emission_level() * self.gain()
+
+    def _count(self):
+        return max(1, int(self.sense.average.count))
+
+    def _measured_W(self):
+        power = self.true_power_uW()
+        correction = self.sense.correction.wavelength
+        if correction:
+            power *= self.filter.passband()[0] / float(correction)
+        count = self._count()
+        power *= 1.0 + self._rng.gauss(0.0, self.noise / math.sqrt(count))
+        power += self._rng.gauss(0.0, self.noise_floor_uW / math.sqrt(count))
+        power *= 1e-6
+        upper = self.sense.power.dc.range.upper
+        if str(self.sense.power.dc.range.auto).upper() in ("OFF", "0") and upper is not None:
+            power = min(power, float(upper))  # Over range
+        return power
+
+    @property
+    def read(self):
+        # The first sample is part of the round trip; the rest integrate on the device
+        integration = (self._count() - 1) * SAMPLE_TIME
+        self.clock.sleep(self.read_latency + integration / 2)
+        power = self._measured_W()
+        self.clock.sleep(integration / 2)
+        return power
+
+    def _initiate(self):
+        self._started = self.clock.time()
+
+    @property
+    def fetch(self):
+        if self._started is None:
+            return self.read
+        done = self._started + self.read_latency + (self._count() - 1) * SAMPLE_TIME
+        self.clock.sleep(done - self.clock.time())
+        self._started = None
+        return self._measured_W()
+
+
+def simulated_bench(model=None, calibration_files=None, clock=None, noise=0.002,
+                    noise_floor_uW=0.01, drift_per_hour=0.0, laser_tau=0.08,
+                    filter_tau=0.1, emission_tau=0.5, read_latency=0.003, seed=0):
+    """Builds a Bench of simulated instruments sharing one virtual clock."""
+    if model is None:
+        model = SpectralModel.from_csv(calibration_files)
+    if clock is None:
+        clock = VirtualClock()
+    laser = SimulatedExtreme(clock, laser_tau=laser_tau, emission_tau=emission_tau)
+    filter = SimulatedVaria(clock, filter_tau=filter_tau)
+    power_meter = PowerMeter(SimulatedPM100D(model, laser, filter, clock, noise=noise,
+                                             noise_floor_uW=noise_floor_uW,
+                                             drift_per_hour=drift_per_hour,
+                                             read_latency=read_latency, seed=seed))
+    return Bench(power_meter, laser, filter, clock=clock, simulated=True)
@@ -0,0 +1,137 @@
+"""Closed-loop hold: keeps the power on target while a measurement's ON phase lasts.
+
+An open-loop ON phase sets the calibrated setting once and waits, so whatever
+the supercontinuum drifts during the phase (or whatever the calibration is
+off by today) ends up in the measurement. PowerHold instead reads the power
+stream every 1 / rate_hz seconds and, once the power has stopped moving (the
+emission ramp after switching on is left alone), corrects the laser setting
+when the mean of the last interval is outside the deadband. The hold waits
+only while the power is still heading for the target, judged by whether the
+slope fitted to the interval stands out from the meter noise around it: noise
+alone never holds a correction back, at any power. Every correction
+is rate limited to max_rate percent per second, so noise or a single odd
+reading cannot kick the setting around.
+
+Either way each ON phase gets a StepStats: mean power, RMS error against the
+target, settling time (until the power stays within the deadband) and the
+corrections made.
+"""
+import csv
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from acquisition import window_stats
+from instrumentation import span
+
+# setting: the setting the phase started with; final_setting: the setting at its end
+# rms_error_uW: against the target, NaN without one; settling_time: s from the start of the
+# phase until the power stays within the deadband, NaN if it never does
+StepStats = namedtuple("StepStats", "wavelength setting final_setting target_uW mean_uW std_uW "
+                                    "rms_error_uW settling_time adjustments samples")
+STEP_HEADER = ["Wavelength (nm)", "Laser Setting (%)", "Final Setting (%)", "Target Power (µW)",
+               "Mean Power (µW)", "Std (µW)", "RMS Error (µW)", "Settling Time (s)", "Adjustments",
+               "Samples"]
+
+
+def step_stats(times, values, start, wavelength, setting, target_uW=None, deadband_uW=0.5,
+               final_setting=None, adjustments=0, interval=0.2):
+    """StepStats of the readings (times, values) of one ON phase that started at start.
+
+    Settling is judged on interval means, so meter noise alone does not count
+    as leaving the deadband.
+    """
+    stats = window_stats(times, values)
+    rms_error = settling_time = math.nan
+    if target_uW is not None and len(values):
+        error = values - target_uW
+        rms_error = float(np.sqrt(np.mean(error ** 2)))
+        bins = ((times - start) // interval).astype(int)
+        counts = np.bincount(bins)
+        filled = np.flatnonzero(counts)
+        means = np.bincount(bins, weights=error)[filled] / counts[filled]
+        outside = np.flatnonzero(np.abs(means) > deadband_uW)
+        if len(outside) == 0:
+            settling_time = 0.0
+        elif outside[-1] + 1 < len(filled):
+            settling_time = float(filled[outside[-1] + 1] * interval)
+    return StepStats(wavelength, setting, setting if final_setting is None else final_setting,
+                     math.nan if target_uW is None else target_uW, stats.mean, stats.std,
+                     rms_error, settling_time, adjustments, stats.count)
+
+
+def trend_significant(window, sigmas=3.0):
+    """Whether the slope fitted to a WindowStats is more than sigmas standard errors from zero.
+
+    Compares the change the slope predicts over the window with its standard
+    error, both in µW: the residual noise (window std less the trend's share)
+    over sqrt(count), scaled for evenly spaced sample times.
+    """
+    if window.count < 3 or window.span <= 0:
+        return False
+    slope = window.drift_uW_per_s
+    spread = window.span ** 2 / 12  # Variance of evenly spaced sample times
+    residual = max(window.std ** 2 - slope ** 2 * spread, 0.0)
+    change = abs(slope) * window.span
+    return change > sigmas * math.sqrt(residual * 12 / window.count)
+
+
+def write_step_stats(path, steps):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(STEP_HEADER)
+        for step in steps:
+            writer.writerow([f"{value:.6g}" if isinstance(value, float) else value for value in step])
+
+
+class PowerHold:
+    """Corrects the laser setting from the power stream during an ON phase."""
+
+    def __init__(self, bench, stream, controller, rate_hz=5.0, deadband_uW=0.5, max_rate=5.0,
+                 scheduler=None):
+        self.bench = bench
+        self.stream = stream
+        self.scheduler = scheduler  # Corrections go through its laser worker when given
+        self.controller = controller
+        self.interval = 1.0 / rate_hz
+        self.deadband_uW = deadband_uW
+        self.max_rate = max_rate  # % of setting per second
+        self.changed_at = None  # Bench time of the last correction of the last hold
+
+    def hold(self, seconds, wavelength, setting, target_uW):
+        """Holds target_uW for seconds from setting on; returns (times, values, StepStats)."""
+        stream = self.stream
+        start = self.bench.time()
+        end = start + seconds
+        max_step = self.max_rate * self.interval
+        current, adjustments = setting, 0
+        self.changed_at = None
+        while True:
+            remaining = end - self.bench.time()
+            if remaining <= 0:
+                break
+            window = stream.stats_since(stream.capture(min(self.interval, remaining)))
+            if window.count == 0 or remaining <= self.interval:
+                continue
+            error = window.mean - target_uW
+            # Still ramping towards the target (emission just switched on, or the last
+            # correction): let it settle. Moving away from it, correct right away
+            approaching = window.drift_uW_per_s * error < 0
+            if abs(error) <= self.deadband_uW or (approaching and trend_significant(window)):
+                continue
+            wanted = self.controller.next_setting(current, window.mean, target_uW)
+            new = current + max(-max_step, min(max_step, wanted - current))
+            if new != current:
+                with span("hold correction"):
+                    if self.scheduler is not None:
+                        self.scheduler.set_power(new).result()
+                    else:
+                        self.bench.laser.set_power(new)
+                current = new
+                adjustments += 1
+                self.changed_at = self.bench.time()
+        times, values = stream.samples_since(start)
+        return times, values, step_stats(times, values, start, wavelength, setting, target_uW,
+                                         self.deadband_uW, current, adjustments, self.interval)
+
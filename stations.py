@@ -0,0 +1,370 @@
+"""Several rigs run from one process: the same job file (or one per rig) on every station at once.
+
+A station is one laser/filter/meter rig. A stations file lists them as JSON:
+
+    {
+      "stations": [
+        {"name": "A", "resource": "USB0::0x1313::0x8078::P0017991::INSTR",
+         "laser_port": "COM3", "filter_port": "COM4"},
+        {"name": "B", "resource": "USB0::0x1313::0x8078::P0018202::INSTR",
+         "laser_port": "COM5", "filter_port": "COM6", "min_wavelength": 450,
+         "max_wavelength": 800, "min_setting": 12, "jobs": "jobs_b.json",
+         "history": "rig_b_calibrations"},
+        {"name": "sim", "simulate": true, "speed": 20, "simulation": {"drift_per_hour": 0.05, "seed": 3}}
+      ]
+    }
+
+Only "name" is required; the limits default to those of the original bench.
+A station with "jobs" runs that job file instead of the shared one. A
+simulated station runs on a virtual clock, or with "speed" on the wall clock
+that many times faster than real time; "simulation" is passed on to
+simulation.simulated_bench.
+
+Other rigs' curves differ, so a station warm-starts its calibrations only
+from its own: those in "history", a directory of the rig's earlier
+calibration exports (calibration_*.csv), and those it writes to its output
+directory. The bundled test results come from the original bench; only a
+station whose history points there uses them.
+
+Each station runs in its own thread with its own bench, engine, calibration
+history and output directory (<output>/<name>/, laid out like batch.py's), so
+a failing run, or a rig that does not connect at all, only stops that station.
+Every sample goes into one shared result store (session_<timestamp>/ in the
+output directory) tagged with the station; the engines' side files land in a
+subdirectory per station. The log of each station goes to its log.txt, and the
+console gets a progress table of all stations at most once per
+--progress-interval seconds. The instruments wait on the bus most of the
+time, so the stations overlap almost completely.
+
+    python stations.py stations.json jobs.json [--simulate] [--output DIR] [--stop-on-error] [--check]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from batch import DEFAULT_OUTPUT, JobFileError, load_job_file, run_job
+from calibration_store import CalibrationStore
+from controllers import MIN_LASER_POWER
+from devices import PM100D_RESOURCE, BenchConnector, SystemClock, open_bench
+from engine import Engine
+from result_store import ResultStore, StationStore
+from sweep_planner import MAX_WAVELENGTH, MIN_WAVELENGTH
+
+# Keys a station may have, with their defaults (None for name: required)
+STATION_FIELDS = {"name": None, "resource": PM100D_RESOURCE, "laser_port": None, "filter_port": None,
+                  "min_wavelength": MIN_WAVELENGTH, "max_wavelength": MAX_WAVELENGTH,
+                  "min_setting": MIN_LASER_POWER, "simulate": None, "speed": None, "simulation": None,
+                  "jobs": None, "history": None}
+
+
+class StationFileError(ValueError):
+    """The stations file cannot be used as written."""
+
+
+class Station:
+    """One rig: where its instruments are and the limits its routines keep to."""
+
+    def __init__(self, name, resource=PM100D_RESOURCE, laser_port=None, filter_port=None,
+                 min_wavelength=MIN_WAVELENGTH, max_wavelength=MAX_WAVELENGTH,
+                 min_setting=MIN_LASER_POWER, simulate=None, speed=None, simulation=None, jobs=None,
+                 history=None):
+        self.name = name
+        self.resource = resource
+        self.laser_port = laser_port
+        self.filter_port = filter_port
+        self.min_wavelength = min_wavelength
+        self.max_wavelength = max_wavelength
+        self.min_setting = min_setting
+        self.simulate = simulate
+        self.speed = speed  # Simulated only: wall clock this many times faster instead of a virtual one
+        self.simulation = dict(simulation or {})
+        self.jobs = jobs  # Job file of this station, None for the shared one
+        self.history = history  # Directory of this rig's earlier calibrations, None for none
+
+    def _sim_options(self):
+        options = dict(self.simulation)
+        if self.speed is not None:
+            options["clock"] = SystemClock(self.speed)
+        return options
+
+    def open_bench(self, simulate=None):
+        """Opens the station's bench; simulate overrides the station's own setting."""
+        return open_bench(self.simulate if simulate is None else simulate, self.resource,
+                          self.laser_port, self.filter_port, **self._sim_options())
+
+    def connector(self, simulate=None):
+        """BenchConnector for the station, for the GUI."""
+        return BenchConnector(self.simulate if simulate is None else simulate, self.resource,
+                              laser_port=self.laser_port, filter_port=self.filter_port,
+                              **self._sim_options())
+
+    def calibration_store(self, *directories):
+        """CalibrationStore of the station's history and the given directories (its own results)."""
+        store = CalibrationStore()
+        for directory in ((self.history,) if self.history else ()) + directories:
+            store.load_directory(directory)
+        return store
+
+    def engine(self, bench, controller_name="proportional", interpolation="linear", **options):
+        """Engine on bench with the station's limits."""
+        return Engine(bench, controller_name, interpolation, min_setting=self.min_setting,
+                      min_wavelength=self.min_wavelength, max_wavelength=self.max_wavelength, **options)
+
+
+def load_stations(path):
+    """Returns the Stations of a stations file; raises StationFileError when it is not usable."""
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise StationFileError(f"Cannot read {path}: {e}") from None
+    entries = content.get("stations") if isinstance(content, dict) else content
+    if not isinstance(entries, list) or not entries:
+        raise StationFileError("'stations' must be a non-empty list")
+    stations = []
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise StationFileError(f"Station {number}: must be an object")
+        unknown = sorted(set(entry) - set(STATION_FIELDS))
+        if unknown:
+            raise StationFileError(f"Station {number}: unknown keys {', '.join(unknown)}")
+        fields = {**STATION_FIELDS, **entry}
+        name = fields["name"]
+        # The name becomes a directory
+        if not isinstance(name, str) or not name.strip() or name in (".", "..") or set(name) & set("/\\:"):
+            raise StationFileError(f"Station {number}: name must be a plain non-empty string")
+        if any(station.name == name for station in stations):
+            raise StationFileError(f"Station {number}: duplicate name {name}")
+        for key in ("min_wavelength", "max_wavelength", "min_setting"):
+            if not isinstance(fields[key], (int, float)) or fields[key] < 0:
+                raise StationFileError(f"Station {name}: {key} must be a non-negative number")
+        if fields["min_wavelength"] >= fields["max_wavelength"]:
+            raise StationFileError(f"Station {name}: min_wavelength must be below max_wavelength")
+        if fields["speed"] is not None and (not isinstance(fields["speed"], (int, float)) or fields["speed"] <= 0):
+            raise StationFileError(f"Station {name}: speed must be a positive number")
+        if fields["simulation"] is not None and not isinstance(fields["simulation"], dict):
+            raise StationFileError(f"Station {name}: simulation must be an object")
+        if fields["jobs"] is not None and not os.path.isfile(fields["jobs"]):
+            raise StationFileError(f"Station {name}: job file {fields['jobs']} not found")
+        if fields["history"] is not None and (not isinstance(fields["history"], str)
+                                              or not os.path.isdir(fields["history"])):
+            raise StationFileError(f"Station {name}: history directory {fields['history']} not found")
+        stations.append(Station(**fields))
+    return stations
+
+
+def find_station(stations, name):
+    for station in stations:
+        if station.name == name:
+            return station
+    raise StationFileError(f"No station named {name} (have {', '.join(s.name for s in stations)})")
+
+
+class StationProgress:
+    """What one station is doing, for the progress table."""
+
+    def __init__(self, runs):
+        self.state = "waiting"  # waiting, connecting, running, done, failed, stopped
+        self.runs = runs
+        self.run = 0  # Index of the current or last run
+        self.kind = ""
+        self.completed = 0
+        self.failed = 0
+        self.message = ""
+        self.started = None
+        self.finished = None
+
+    def line(self, name, width):
+        runs = f"{self.run}/{self.runs}" if self.run else f"-/{self.runs}"
+        failed = f" {self.failed} failed" if self.failed else ""
+        return f"  {name:<{width}}  {self.state:<10}{runs:>7}  {self.kind:<14}{failed}  {self.message[:60]}"
+
+
+class Orchestrator:
+    """Runs job lists on several stations concurrently, one thread per station."""
+
+    def __init__(self, stations, settings, runs, output=DEFAULT_OUTPUT, simulate=None, stop_on_error=False,
+                 progress_interval=1.0, out=sys.stdout):
+        self.stations = stations
+        self.settings = settings
+        self.output = output
+        self.simulate = simulate
+        self.stop_on_error = stop_on_error
+        self.progress_interval = progress_interval
+        self.out = out
+        # Every station's (settings, runs): its own job file or the shared one
+        self.jobs = {}
+        for station in stations:
+            self.jobs[station.name] = load_job_file(station.jobs) if station.jobs else (settings, runs)
+        self.progress = {station.name: StationProgress(len(self.jobs[station.name][1])) for station in stations}
+        self.results = None  # Shared ResultStore, open while running
+        self._stop = threading.Event()
+        self._print_lock = threading.Lock()
+
+    def stop(self):
+        """Every station stops after its current run."""
+        self._stop.set()
+
+    def run(self):
+        """Runs all stations to the end; returns the number of failed runs (a station that did not connect counts all)."""
+        os.makedirs(self.output, exist_ok=True)
+        self.results = ResultStore(os.path.join(self.output, f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"))
+        started = time.monotonic()
+        threads = [threading.Thread(target=self._run_station, args=(station,), name=f"station {station.name}",
+                                    daemon=True) for station in self.stations]
+        for thread in threads:
+            thread.start()
+        shown = None
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(self.progress_interval / len(threads))
+                shown = self._show_table(time.monotonic() - started, shown)
+        except KeyboardInterrupt:
+            self._print("Stopping every station after its current run...")
+            self.stop()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.results.close()
+        elapsed = time.monotonic() - started
+        self._show_table(elapsed, shown)
+        completed = sum(progress.completed for progress in self.progress.values())
+        failed = sum(progress.failed for progress in self.progress.values())
+        self._print(f"{completed} of {sum(p.runs for p in self.progress.values())} runs on "
+                    f"{len(self.stations)} stations succeeded in {elapsed:.1f} s, "
+                    f"{len(self.results)} samples in {self.results.path}")
+        return failed
+
+    def table(self, elapsed):
+        """Progress of every station, one line each under a summary line."""
+        progress = self.progress.values()
+        completed = sum(p.completed for p in progress)
+        failed = sum(p.failed for p in progress)
+        width = max(len(station.name) for station in self.stations)
+        lines = [f"[{elapsed:7.1f} s] {completed}/{sum(p.runs for p in progress)} runs done, {failed} failed"]
+        lines += [self.progress[station.name].line(station.name, width) for station in self.stations]
+        return "\n".join(lines)
+
+    def _show_table(self, elapsed, shown):
+        # Only printed when a station's line changed; returns what is on screen now
+        table = self.table(elapsed)
+        lines = table.split("\n", 1)[1]
+        if lines != shown:
+            self._print(table)
+        return lines
+
+    def _print(self, text, file=None):
+        with self._print_lock:
+            print(text, file=file or self.out, flush=True)
+
+    def _run_station(self, station):
+        progress = self.progress[station.name]
+        settings, runs = self.jobs[station.name]
+        output = os.path.join(self.output, station.name)
+        os.makedirs(output, exist_ok=True)
+        log_file = open(os.path.join(output, "log.txt"), "a", encoding="utf-8")
+
+        def log(prefix, text):
+            progress.message = text
+            log_file.write(f"{datetime.now():%H:%M:%S} {prefix} {text}\n")
+            log_file.flush()
+
+        progress.started = time.monotonic()
+        bench = engine = None
+        try:
+            progress.state = "connecting"
+            # --simulate, else the station's own setting, else the job file's
+            simulate = self.simulate
+            if simulate is None and station.simulate is None:
+                simulate = settings["simulate"]
+            bench = station.open_bench(simulate)
+            # Only the rig's own earlier results warm-start its calibrations; other rigs' curves differ
+            calibration_store = station.calibration_store(output)
+            engine = station.engine(bench, settings["controller"], settings["interpolation"],
+                                    calibration_store=calibration_store,
+                                    store=StationStore(self.results, station.name, clock=bench.clock))
+            progress.state = "running"
+            for index, (number, kind, parameters) in enumerate(runs, 1):
+                if self._stop.is_set():
+                    progress.state = "stopped"
+                    break
+                progress.run, progress.kind = index, kind
+                prefix = f"[{index}/{len(runs)} {kind}]"
+                started = time.monotonic()
+                try:
+                    result = run_job(engine, index, kind, parameters, output,
+                                     log=lambda text, prefix=prefix: log(prefix, text))
+                except Exception as e:
+                    progress.failed += 1
+                    log(prefix, f"FAILED: {e}")
+                    self._print(f"[{station.name}] {prefix} FAILED: {e}", file=sys.stderr)
+                    if self.stop_on_error:
+                        progress.state = "stopped"
+                        break
+                    continue
+                progress.completed += 1
+                log(prefix, f"done in {time.monotonic() - started:.1f} s -> {result}")
+            else:
+                progress.state = "done"
+        except Exception as e:
+            # The bench did not open (or the engine could not start): nothing ran on this station
+            progress.state = "failed"
+            progress.failed = progress.runs - progress.completed
+            log("[station]", f"FAILED: {e}")
+            self._print(f"[{station.name}] FAILED: {e}", file=sys.stderr)
+        finally:
+            progress.finished = time.monotonic()
+            if bench is not None:
+                try:
+                    bench.laser.set_emission(False)
+                finally:
+                    if engine is not None:
+                        engine.close()
+                    bench.close()
+            log_file.close()
+
+
+def run_stations(stations_path, jobs_path, simulate=None, output=None, stop_on_error=False, check=False,
+                 progress_interval=1.0):
+    """Runs the job file on every station of the stations file; returns the number of failed runs."""
+    stations = load_stations(stations_path)
+    settings, runs = load_job_file(jobs_path)
+    output = output or settings["output"]
+    orchestrator = Orchestrator(stations, settings, runs, output, simulate, stop_on_error, progress_interval)
+    print(f"{len(stations)} stations from {stations_path}, results in {output}")
+    if check:
+        for station in stations:
+            station_runs = orchestrator.jobs[station.name][1]
+            print(f"{station.name}: {len(station_runs)} runs from {station.jobs or jobs_path}, "
+                  f"{station.min_wavelength:g}-{station.max_wavelength:g} nm, min setting {station.min_setting:g} %, "
+                  f"{'simulated' if station.simulate else station.resource}")
+        return 0
+    return orchestrator.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run calibration and measurement jobs on several stations at once")
+    parser.add_argument("stations", help="JSON stations file")
+    parser.add_argument("jobs", help="JSON job file, for every station without one of its own")
+    parser.add_argument("--simulate", action="store_true", default=None,
+                        help="simulate every station's laser, filter and power meter")
+    parser.add_argument("--output", help=f"directory for the results, one subdirectory per station "
+                                         f"(default: {DEFAULT_OUTPUT})")
+    parser.add_argument("--stop-on-error", action="store_true",
+                        help="stop a station at its first failed run instead of going on with the next")
+    parser.add_argument("--check", action="store_true",
+                        help="only validate the files and list the stations")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="s between progress tables at most")
+    args = parser.parse_args()
+    try:
+        failures = run_stations(args.stations, args.jobs, args.simulate, args.output, args.stop_on_error,
+                                args.check, args.progress_interval)
+    except (StationFileError, JobFileError) as e:
+        parser.exit(2, f"{e}\n")
+    sys.exit(1 if failures else 0)
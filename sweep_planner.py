@@ -0,0 +1,224 @@
+"""Measurement sweep plans, computed and validated before the laser is touched.
+
+A plan turns (start, end, step, on_time, off_time) into arrays of filter
+setpoints, laser settings and start times for every step. Wavelengths outside
+the filter range are errors that reject the whole plan; wavelengths outside the
+calibration are warnings, reported once up front instead of at every step after
+the laser has already fired, as are steps where the calibration was pinned at
+a setting limit; for those the plan lists the power the laser can deliver. A
+plan can be printed or exported as a dry run.
+
+Steps are pipelined: emission is off between ON phases anyway, so the filter
+move and laser setting of the next step are issued at the start of the OFF
+phase and the filter settles while the OFF phase runs.
+
+    python sweep_planner.py test-results/calibration_20250401_144718.csv 450 700 10 2 1
+"""
+import argparse
+import csv
+
+import numpy as np
+
+from calibration_model import KINDS, CalibrationModel, sweep_wavelengths
+from controllers import MAX_LASER_POWER
+from scheduler import CommandScheduler
+from simulation import read_calibration_csv
+
+MIN_WAVELENGTH = 400
+MAX_WAVELENGTH = 840
+FILTER_SETTLE = 0.5  # Wait after moving the filter, emission is off then
+BANDWIDTH = 10
+
+PLAN_HEADER = ["Step", "Wavelength (nm)", "Short (nm)", "Long (nm)", "Laser Setting (%)",
+               "Extrapolated", "Start (s)", "Laser On (s)", "Laser Off (s)", "Out of Reach",
+               "Min Power (µW)", "Max Power (µW)"]
+
+
+class MeasurementPlan:
+    """Every step of one measurement sweep, with its validation result."""
+
+    def __init__(self, wavelengths, settings, extrapolated, on_time, off_time,
+                 filter_settle=FILTER_SETTLE, bandwidth=BANDWIDTH,
+                 min_wavelength=MIN_WAVELENGTH, max_wavelength=MAX_WAVELENGTH, target_uW=None,
+                 limited=None, power_range=None):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self.settings = np.asarray(settings, dtype=float)
+        self.extrapolated = np.asarray(extrapolated, dtype=bool)
+        n = len(self.wavelengths)
+        # Steps pinned at a setting limit, and the (min, max) power achievable at each step
+        self.limited = np.zeros(n, dtype=bool) if limited is None else np.asarray(limited, dtype=bool)
+        if power_range is None:
+            power_range = (np.full(n, np.nan), np.full(n, np.nan))
+        self.min_power, self.max_power = (np.asarray(bound, dtype=float) for bound in power_range)
+        self.on_time = on_time
+        self.off_time = off_time
+        self.filter_settle = filter_settle
+        self.target_uW = target_uW  # Power the settings were calibrated for, if known
+        # Same rounding the filter setpoints always had
+        self.short = np.round(self.wavelengths - bandwidth / 2)
+        self.long = np.round(self.wavelengths + bandwidth / 2)
+        # From one ON phase to the next; the filter settle overlaps the OFF phase
+        self.step_time = on_time + max(off_time, filter_settle)
+        # Filter moves: the first before the sweep, the others when the previous OFF phase starts
+        self.on_times = filter_settle + np.arange(len(self.wavelengths)) * self.step_time
+        self.start_times = np.concatenate([[0.0], self.on_times[:-1] + on_time])[:len(self.wavelengths)]
+        self.min_wavelength = min_wavelength
+        self.max_wavelength = max_wavelength
+        self.errors = []
+        self.warnings = []
+        self.validate()
+
+    def validate(self):
+        """Checks the whole plan; errors make it unusable, warnings need confirmation."""
+        self.errors, self.warnings = [], []
+        if len(self.wavelengths) == 0:
+            self.errors.append("The sweep has no steps")
+        if self.on_time <= 0 or self.off_time < 0:
+            self.errors.append("Laser ON time must be positive and OFF time not negative")
+        bad = (self.short < self.min_wavelength) | (self.long > self.max_wavelength)
+        if bad.any():
+            self.errors.append(f"Wavelength out of range! {int(bad.sum())} steps between "
+                               f"{self.wavelengths[bad].min():.1f} and {self.wavelengths[bad].max():.1f} nm "
+                               f"fall outside the filter range {self.min_wavelength}-{self.max_wavelength} nm")
+        if self.extrapolated.any():
+            self.warnings.append(f"Extrapolating beyond calibration range! {int(self.extrapolated.sum())} "
+                                 f"steps between {self.wavelengths[self.extrapolated].min():.1f} and "
+                                 f"{self.wavelengths[self.extrapolated].max():.1f} nm")
+        saturated = self.limited & (self.settings >= MAX_LASER_POWER)
+        for steps, limit, bound, powers in ((saturated, "100 %", "at most", self.max_power),
+                                            (self.limited & ~saturated, "the minimum setting", "at least",
+                                             self.min_power)):
+            if not steps.any():
+                continue
+            text = (f"Target out of reach! {int(steps.sum())} steps between {self.wavelengths[steps].min():.1f} "
+                    f"and {self.wavelengths[steps].max():.1f} nm are pinned at {limit}")
+            if np.isfinite(powers[steps]).all():
+                # The power every one of those steps can deliver
+                best = powers[steps].min() if bound == "at most" else powers[steps].max()
+                text += f" ({bound} {best:.3g} µW there)"
+            self.warnings.append(text)
+        return not self.errors
+
+    @property
+    def valid(self):
+        return not self.errors
+
+    @property
+    def duration(self):
+        """Estimated runtime in seconds."""
+        if len(self.wavelengths) == 0:
+            return 0.0
+        return float(self.on_times[-1]) + self.on_time + self.off_time
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    def rows(self):
+        for i in range(len(self.wavelengths)):
+            on = self.on_times[i]
+            yield (i + 1, self.wavelengths[i], self.short[i], self.long[i], round(self.settings[i], 2),
+                   bool(self.extrapolated[i]), self.start_times[i], on, on + self.on_time,
+                   bool(self.limited[i]), round(self.min_power[i], 3), round(self.max_power[i], 3))
+
+    def summary(self):
+        minutes, seconds = divmod(int(round(self.duration)), 60)
+        text = (f"{len(self)} steps, {self.wavelengths[0]:.1f}-{self.wavelengths[-1]:.1f} nm, "
+                f"estimated {minutes} min {seconds} s" if len(self) else "Empty sweep")
+        return "\n".join([text] + self.errors + self.warnings)
+
+    def format_table(self):
+        lines = ["\t".join(PLAN_HEADER)]
+        for row in self.rows():
+            lines.append("\t".join(str(value) if not isinstance(value, float) else f"{value:g}"
+                                   for value in row))
+        return "\n".join(lines)
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(PLAN_HEADER)
+            writer.writerows(self.rows())
+
+
+def plan_measurement(model, start_wl, end_wl, step_size, on_time, off_time, **kwargs):
+    """Builds the plan for a sweep from start_wl to end_wl with a compiled CalibrationModel."""
+    if step_size <= 0:
+        raise ValueError("Step size must be positive")
+    sweep = model.plan(sweep_wavelengths(start_wl, end_wl, step_size))
+    return MeasurementPlan(sweep.wavelengths, sweep.settings, sweep.extrapolated,
+                           on_time, off_time, limited=sweep.limited,
+                           power_range=model.power_range(sweep.wavelengths), **kwargs)
+
+
+def execute_plan(bench, plan, scheduler=None, hold=None, on_phase=None, on_step=None, setting_for=None):
+    """Runs a validated plan on the bench.
+
+    hold(seconds) keeps the laser on and returns the measured power (or None);
+    it defaults to sleeping. on_phase(index, phase) is called as each "on" and
+    "off" phase starts, on_step(index, wavelength, setting, power) after each
+    step. setting_for(index), if given, returns the laser setting of a step as
+    it is issued instead of the planned one. The laser is left with emission
+    off, also on errors.
+    """
+    if not plan.valid:
+        raise ValueError(plan.summary())
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = CommandScheduler(bench)
+
+    def prepare(index):
+        # Filter and laser are independent; both run while the caller goes on
+        moved = scheduler.move_filter(int(plan.short[index]), int(plan.long[index]))
+        settings[index] = setting_for(index) if setting_for is not None else float(plan.settings[index])
+        scheduler.set_power(settings[index])
+        return moved
+
+    settings = {}
+    try:
+        moved = prepare(0) if len(plan) else None
+        for index in range(len(plan)):
+            # The settle counts from the move itself; set_emission joins the laser setting
+            bench.sleep(plan.filter_settle - (bench.time() - moved.result()))
+            scheduler.set_emission(True)
+            if on_phase is not None:
+                on_phase(index, "on")
+            if hold is not None:
+                power = hold(plan.on_time)
+            else:
+                bench.sleep(plan.on_time)
+                power = None
+
+            scheduler.set_emission(False)
+            off_started = bench.time()
+            if on_phase is not None:
+                on_phase(index, "off")
+            if index + 1 < len(plan):
+                moved = prepare(index + 1)
+            if on_step is not None:
+                on_step(index, float(plan.wavelengths[index]), settings.pop(index), power)
+            bench.sleep(plan.off_time - (bench.time() - off_started))
+    finally:
+        bench.laser.set_emission(False)
+        if own_scheduler:
+            scheduler.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dry run: print or export a measurement sweep plan")
+    parser.add_argument("calibration", help="calibration CSV exported by main.py")
+    parser.add_argument("start", type=float, help="start wavelength (nm)")
+    parser.add_argument("end", type=float, help="end wavelength (nm)")
+    parser.add_argument("step", type=float, help="step size (nm)")
+    parser.add_argument("on_time", type=float, help="laser ON time (s)")
+    parser.add_argument("off_time", type=float, help="laser OFF time (s)")
+    parser.add_argument("--interpolation", choices=KINDS, default="linear")
+    parser.add_argument("--export", metavar="CSV", help="write the plan to this file instead of printing it")
+    args = parser.parse_args()
+
+    model = CalibrationModel.from_rows(read_calibration_csv(args.calibration), args.interpolation)
+    plan = plan_measurement(model, args.start, args.end, args.step, args.on_time, args.off_time)
+    if args.export:
+        plan.to_csv(args.export)
+    else:
+        print(plan.format_table())
+    print(plan.summary())